@@ -0,0 +1,195 @@
+import os
+import math
+import time
+import threading
+from functools import wraps
+
+# Admission control for the heavy inference endpoints.
+# Each endpoint gets a concurrency limit, a short bounded wait queue and a
+# per-user token bucket. Anything beyond that is turned away immediately
+# with 429 (this user is sending too fast) or 503 (the server is saturated)
+# and a Retry-After header, instead of piling up OpenCV/Tesseract work until
+# every request times out.
+#
+# Limits are per process: with gunicorn, each worker enforces its own.
+
+
+def _env(endpoint, key, default, cast=int):
+    return cast(os.environ.get(f"AQUAGUARD_{endpoint.upper()}_{key}", default))
+
+
+# 🔧 CONFIGURATION (override with AQUAGUARD_<ENDPOINT>_<SETTING>, e.g. AQUAGUARD_QUALITY_CONCURRENCY=2)
+LIMITS = {
+    'quality': {
+        'concurrency': _env('quality', 'CONCURRENCY', 4),       # Requests running inference at once
+        'queue': _env('quality', 'QUEUE', 8),                   # Requests allowed to wait for a slot
+        'queue_timeout': _env('quality', 'QUEUE_TIMEOUT', 5, float),  # Seconds a request may wait
+        'rate': _env('quality', 'RATE', 30, float),             # Sustained uploads per user per minute (0 = no limit)
+        'burst': _env('quality', 'BURST', 10),                  # Uploads a user may send back to back
+    },
+    'meter': {
+        'concurrency': _env('meter', 'CONCURRENCY', 2),
+        'queue': _env('meter', 'QUEUE', 4),
+        'queue_timeout': _env('meter', 'QUEUE_TIMEOUT', 5, float),
+        'rate': _env('meter', 'RATE', 12, float),
+        'burst': _env('meter', 'BURST', 5),
+    },
+}
+MAX_TRACKED_USERS = 10000   # Idle, full buckets are dropped beyond this many users
+
+
+class Rejected(Exception):
+    """Request turned away; status is 429 (user rate) or 503 (server saturated)"""
+
+    def __init__(self, status, retry_after, message):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.message = message
+
+
+class Limiter:
+    def __init__(self, name, concurrency, queue, queue_timeout, rate, burst):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate / 60.0     # tokens per second
+        self.burst = burst
+
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._buckets = {}          # user_id -> [tokens, last refill time]
+        self.active = 0
+        self.waiting = 0
+        self._service_time = 1.0    # EWMA of seconds per request, for Retry-After
+
+        self.admitted = 0
+        self.rejected_rate = 0
+        self.rejected_busy = 0
+        self.timed_out = 0
+
+    # --- Per-user token bucket (call with the lock held) ---
+
+    def _take_token(self, user_id, now):
+        if self.rate <= 0:
+            return 0   # No per-user limit
+        tokens, last = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = [tokens, now]
+            return (1 - tokens) / self.rate
+        self._buckets[user_id] = [tokens - 1, now]
+        if len(self._buckets) > MAX_TRACKED_USERS:
+            self._prune(now)
+        return 0
+
+    def _refund_token(self, user_id):
+        bucket = self._buckets.get(user_id)
+        if bucket:
+            bucket[0] = min(self.burst, bucket[0] + 1)
+
+    def _prune(self, now):
+        full_after = self.burst / self.rate
+        self._buckets = {u: b for u, b in self._buckets.items() if now - b[1] < full_after}
+
+    def _busy_retry_after(self):
+        # Time for the current queue to drain through the available slots
+        return self._service_time * (self.waiting + 1) / self.concurrency
+
+    # --- Admission ---
+
+    def acquire(self, user_id):
+        """Take a slot (waiting briefly if the queue has room) or raise Rejected"""
+        with self._lock:
+            now = time.monotonic()
+            wait_for_token = self._take_token(user_id, now)
+            if wait_for_token:
+                self.rejected_rate += 1
+                raise Rejected(429, wait_for_token, "Too many uploads. Please wait a moment and try again.")
+
+            if self.active >= self.concurrency:
+                if self.waiting >= self.queue:
+                    self.rejected_busy += 1
+                    self._refund_token(user_id)
+                    raise Rejected(503, self._busy_retry_after(), "Server is busy. Please try again shortly.")
+
+                self.waiting += 1
+                deadline = now + self.queue_timeout
+                try:
+                    while self.active >= self.concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.timed_out += 1
+                            self._refund_token(user_id)
+                            raise Rejected(503, self._busy_retry_after(),
+                                           "Server is busy. Please try again shortly.")
+                        self._slot_freed.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+            self.active += 1
+            self.admitted += 1
+            return time.monotonic()
+
+    def release(self, started):
+        with self._lock:
+            self.active -= 1
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - started)
+            self._slot_freed.notify()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'queue': self.queue,
+                'queue_timeout': self.queue_timeout,
+                'rate_per_minute': self.rate * 60,
+                'burst': self.burst,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected_rate': self.rejected_rate,
+                'rejected_busy': self.rejected_busy,
+                'timed_out': self.timed_out,
+                'avg_service_seconds': round(self._service_time, 3),
+                'tracked_users': len(self._buckets),
+            }
+
+
+limiters = {name: Limiter(name, **settings) for name, settings in LIMITS.items()}
+
+
+def admit(endpoint, get_user):
+    """
+    View decorator: run the view only once admitted to `endpoint`.
+    get_user() returns the caller's user id; anonymous requests pass straight
+    through so the view can answer 401 itself.
+    """
+    limiter = limiters[endpoint]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import jsonify
+
+            user_id = get_user()
+            if user_id is None:
+                return view(*args, **kwargs)
+            try:
+                started = limiter.acquire(user_id)
+            except Rejected as e:
+                retry_after = max(1, math.ceil(e.retry_after))
+                return (jsonify({'error': e.message, 'retry_after': retry_after}),
+                        e.status, {'Retry-After': str(retry_after)})
+            try:
+                return view(*args, **kwargs)
+            finally:
+                limiter.release(started)
+        return wrapper
+    return decorator
+
+
+def status():
+    """Current limits and counters of every endpoint, for monitoring"""
+    return {name: limiter.snapshot() for name, limiter in limiters.items()}
@@ -1,27 +1,106 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, Response, g
 import os
-import joblib
-from quality_model import extract_features
-from ocr_model import read_meter
+import threading
+import inference
+import events
+import image_store
+import image_gate
+import admission
+import profiling
+import http_cache
+import sql_trace
+import area_stats
+from usage_analytics import score_reading, reset_state
 from database import (
     init_db, create_user, verify_user, save_quality_reading, 
     save_meter_reading, get_user_statistics, get_recent_readings,
-    get_unread_alerts, mark_alert_read, get_db
+    get_unread_alerts, mark_alert_read, mark_alerts_read, delete_readings, MAX_BULK_IDS,
+    get_user_settings, update_user_settings, save_quality_feedback,
+    get_meter_context, save_meter_layout, get_usage_trends, get_safety_distribution,
+    get_report_rows, user_owns_image, get_reading, delete_reading as delete_user_reading
 )
+from auth import AuthBusy, is_admin
 from datetime import datetime, timedelta
-import pandas as pd
 from io import BytesIO
+from functools import wraps
 import json
+import re
+import uuid
 
 app = Flask(__name__, template_folder="../templates", static_folder="../static")
 app.secret_key = 'aquaguard_secret_key_2026_final_year_project'  # Change in production
 
-# Load AI Model
-MODEL_PATH = "../models/rf_model.pkl"
-model = joblib.load(MODEL_PATH) if os.path.exists(MODEL_PATH) else None
-
-# Initialize database on startup
-init_db()
+# AI model and image decoding live in inference.py (shared with app.py);
+# the model is loaded on first use so workers boot fast, see warmup()
+_init_lock = threading.Lock()
+_db_ready = False
+
+def warmup():
+    """
+    Eagerly do all deferred start-up work. Called by the production server
+    before forking so workers share the loaded model and libraries.
+    """
+    ensure_db()
+    inference.warmup()
+    import pandas  # noqa: F401
+
+def ensure_db():
+    """Initialize database once, before the first request"""
+    global _db_ready
+    if not _db_ready:
+        with _init_lock:
+            if not _db_ready:
+                init_db()
+                _db_ready = True
+
+def _is_admin():
+    return is_admin(session.get('username'), request.headers.get('X-Admin-Token'))
+
+def admin_required(view):
+    """Allow only admins (see AQUAGUARD_ADMIN_USERS / AQUAGUARD_ADMIN_TOKEN in auth.py)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _is_admin():
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.context_processor
+def _template_context():
+    return {'is_admin': _is_admin}
+
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+@app.before_request
+def _before_request():
+    # Correlates this request's SQL (slow-query log) with the caller's logs
+    request_id = request.headers.get('X-Request-Id', '')
+    g.request_id = request_id if _REQUEST_ID.match(request_id) else uuid.uuid4().hex[:16]
+    sql_trace.start_request(g.request_id, request.endpoint)
+    ensure_db()
+    # Opt-in profile of this one request (admins only)
+    if (request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1') and _is_admin():
+        profiling.start_request()
+
+@app.after_request
+def _after_request(response):
+    timings = []
+    statements, sql_ms = sql_trace.request_totals()
+    if statements:
+        timings.append(f'db;dur={sql_ms:.1f};desc="{statements} statements"')
+    profiled = profiling.finish_request(request.endpoint)
+    if profiled:
+        profile_id, elapsed_ms = profiled
+        response.headers['X-Profile-Id'] = profile_id
+        timings.append(f'app;dur={elapsed_ms:.1f}')
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(timings)
+    response.headers['X-Request-Id'] = g.get('request_id', '')
+    return http_cache.compress(response)
+
+@app.teardown_request
+def _teardown_request(exc):
+    sql_trace.finish_request()
 
 # ============================================
 # AUTHENTICATION ROUTES
@@ -40,7 +119,10 @@ def login():
         username = data.get('username')
         password = data.get('password')
         
-        user = verify_user(username, password)
+        try:
+            user = verify_user(username, password)
+        except AuthBusy:
+            return jsonify({'success': False, 'message': 'Server busy, please try again'}), 503, {'Retry-After': '1'}
         if user:
             session['user_id'] = user['id']
             session['username'] = user['username']
@@ -60,7 +142,10 @@ def register():
         password = data.get('password')
         full_name = data.get('full_name')
         
-        user_id = create_user(username, email, password, full_name)
+        try:
+            user_id = create_user(username, email, password, full_name)
+        except AuthBusy:
+            return jsonify({'success': False, 'message': 'Server busy, please try again'}), 503, {'Retry-After': '1'}
         if user_id:
             return jsonify({'success': True, 'message': 'Registration successful'})
         else:
@@ -78,6 +163,7 @@ def logout():
 # ============================================
 
 @app.route('/dashboard')
+@http_cache.conditional(lambda: session.get('user_id'))
 def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -103,6 +189,7 @@ def meter_page():
     return render_template('meter.html', user=session)
 
 @app.route('/history')
+@http_cache.conditional(lambda: session.get('user_id'))
 def history_page():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -127,12 +214,7 @@ def settings_page():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM settings WHERE user_id = ?', (session['user_id'],))
-    result = cursor.fetchone()
-    settings = dict(result) if result else None
-    conn.close()
+    settings = get_user_settings(session['user_id'])
     
     # Get user statistics for settings page
     stats = get_user_statistics(session['user_id'])
@@ -151,6 +233,8 @@ def documentation_page():
 # ============================================
 
 @app.route('/api/predict_quality', methods=['POST'])
+@admission.admit('quality', lambda: session.get('user_id'))
+@profiling.track('quality')
 def predict_quality():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
@@ -162,28 +246,28 @@ def predict_quality():
     location = request.form.get('location', '')
     notes = request.form.get('notes', '')
     
-    # Save temp file
-    if not os.path.exists("../uploads"):
-        os.makedirs("../uploads")
-        
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"quality_{session['user_id']}_{timestamp}.jpg"
-    path = os.path.join("../uploads", filename)
-    file.save(path)
+    data = file.read()
+    # Turn away unusable photos before storing or classifying them
+    gate = image_gate.check_image(data, 'quality')
+    if not gate['ok']:
+        return jsonify(image_gate.rejection_response(gate)), 422
+
+    # Store in the content-addressed image store (deduplicated)
+    image_ref, _ = image_store.put(data)
+    saved = False
 
     try:
-        features = extract_features(path)
-        if features is None:
+        # Decoded from this request's bytes, not read back from disk
+        img = inference.decode_image(data)
+        if img is None:
             return jsonify({'status': 'Error', 'message': 'Could not extract features'})
-        
-        # AI Prediction
-        if model:
-            prediction = model.predict([features])[0]
-            probabilities = model.predict_proba([features])[0]
-            confidence = max(probabilities) * 100
-        else:
-            prediction = 0 
-            confidence = 50
+
+        # AI Prediction (with the per-tile contamination heatmap)
+        quality = inference.classify_quality(img)
+        prediction = quality['prediction']
+        confidence = quality['confidence']
+        features = quality['features']
+        regions = quality['regions']
         
         # Generate results (1 = Dirty/Unsafe, 0 = Clean/Safe)
         if prediction == 1:
@@ -202,6 +286,9 @@ def predict_quality():
             alert_level = 'NONE'
             alert_msg = '✅ No Realtime Alerts'
             insight = f'Water quality is good ({confidence:.1f}% confidence). Safe for consumption.'
+            if regions and regions['worst_tile']['probability'] >= inference.LOCAL_UNSAFE_PROBABILITY:
+                insight += (f" However, one area of the sample looks contaminated "
+                            f"({regions['worst_tile']['probability'] * 100:.0f}%) - check the highlighted region.")
         
         # Save to database
         reading_id = save_quality_reading(
@@ -210,10 +297,11 @@ def predict_quality():
             safety_score, 
             features, 
             alert_level,
-            filename,
+            image_ref,
             location,
             notes
         )
+        saved = True
         
         result = {
             'reading_id': reading_id,
@@ -222,14 +310,22 @@ def predict_quality():
             'alert': alert_msg,
             'insight': insight,
             'confidence': f'{confidence:.1f}%',
+            'regions': regions,
+            'image_warnings': image_gate.warnings(gate),
             'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
         
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        # Don't keep images for readings that were never saved
+        if not saved:
+            image_store.release(image_ref)
 
 @app.route('/api/read_meter', methods=['POST'])
+@admission.admit('meter', lambda: session.get('user_id'))
+@profiling.track('meter')
 def api_read_meter():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
@@ -241,43 +337,48 @@ def api_read_meter():
     location = request.form.get('location', '')
     meter_id = request.form.get('meter_id', '')
     
-    # Save with timestamp
-    if not os.path.exists("../uploads"):
-        os.makedirs("../uploads")
+    data = file.read()
+    # Turn away unusable photos before the (slow) OCR pass
+    gate = image_gate.check_image(data, 'meter')
+    if not gate['ok']:
+        return jsonify(image_gate.rejection_response(gate)), 422
     
+    # Name recorded with the reading; the photo itself is only read in memory
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"meter_{session['user_id']}_{timestamp}_{file.filename}"
-    path = os.path.join("../uploads", filename)
-    file.save(path)
+    filename = f"meter_{session['user_id']}_{timestamp}_{os.path.basename(file.filename or '')}"
 
     try:
+        # Known meters: reuse the digit window from the last good read and
+        # reject readings that would make the odometer run backwards
+        layout, previous = get_meter_context(session['user_id'], meter_id) if meter_id else (None, None)
+
         # Get Reading from OCR Model
-        reading_str = read_meter(path)
+        ocr = inference.read_meter(data, filename, layout, previous)
+        reading_str = ocr['value']
         
         if reading_str == "Retake Photo":
+            if ocr['below_previous']:
+                return jsonify({'status': 'Error', 'retake': True,
+                                'message': f'Reading is lower than the last one ({previous}). Please retake the photo'})
             return jsonify({'status': 'Error', 'message': 'Could not read digits'})
 
         try:
             usage_val = int(reading_str)
-        except:
-            usage_val = 0
-
-        # Get user's eco limit from settings
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT eco_limit FROM settings WHERE user_id = ?', (session['user_id'],))
-        result = cursor.fetchone()
-        limit = result['eco_limit'] if result else 14500
-        conn.close()
-
-        if usage_val > limit:
-            insight_msg = f"⚠️ Alert: Usage exceeds {limit}L limit!"
-            cons_tip = "High consumption detected. Check for leaks immediately."
-            is_high = True
-        else:
-            insight_msg = "✅ Normal Usage Pattern."
-            cons_tip = "Great job! Your usage is within eco-limits."
-            is_high = False
+        except (TypeError, ValueError):
+            # OCR failures ("Error: ...") are not readings: saving them as 0
+            # would break the below-previous check and fake a usage spike
+            return jsonify({'status': 'Error', 'message': 'Could not read digits'})
+
+        if meter_id and ocr['layout'] and ocr['layout'] != layout:
+            save_meter_layout(session['user_id'], meter_id, ocr['layout'])
+
+        # Get user's eco limit from settings (cached per user)
+        settings = get_user_settings(session['user_id'])
+        limit = settings['eco_limit'] if settings else inference.DEFAULT_ECO_LIMIT
+        verdict = inference.usage_verdict(usage_val, limit)
+        insight_msg = verdict['insight']
+        cons_tip = verdict['conservation']
+        is_high = verdict['is_high']
         
         # Save to database
         reading_id = save_meter_reading(
@@ -290,6 +391,13 @@ def api_read_meter():
             location
         )
         
+        # Score against this meter's usage history (spikes / night-time leaks)
+        usage_score = score_reading(session['user_id'], meter_id, usage_val, reading_id)
+        if usage_score['is_leak']:
+            insight_msg = "⚠️ Alert: Continuous night-time flow detected. Possible leak!"
+        elif usage_score['is_spike']:
+            insight_msg = "⚠️ Alert: Unusual spike compared to your normal usage."
+        
         result = {
             'reading_id': reading_id,
             'usage': f"{reading_str} Liters",
@@ -297,90 +405,29 @@ def api_read_meter():
             'conservation': cons_tip,
             'insight': insight_msg,
             'is_high': is_high,
+            'usage_rate': usage_score['rate'],
+            'is_spike': usage_score['is_spike'],
+            'is_leak': usage_score['is_leak'],
+            'read_method': ocr['method'],
+            'image_warnings': image_gate.warnings(gate),
             'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
             
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        # Cleanup temp file
-        if os.path.exists(path):
-            os.remove(path)
 
 @app.route('/api/analytics_data')
+@http_cache.conditional(lambda: session.get('user_id'))
 def analytics_data():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
     days = int(request.args.get('days', 30))
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Determine granularity: hourly for 1 day, daily for others
-    if days == 1:
-        # Hourly data for today
-        cursor.execute('''
-            SELECT strftime('%Y-%m-%d %H:00', timestamp) as date, 
-                   AVG(safety_score) as avg_score,
-                   COUNT(*) as count
-            FROM quality_readings 
-            WHERE user_id = ? AND DATE(timestamp) = DATE('now')
-            GROUP BY strftime('%Y-%m-%d %H:00', timestamp)
-            ORDER BY date
-        ''', (session['user_id'],))
-        
-        quality_trend = [dict(row) for row in cursor.fetchall()]
-        
-        cursor.execute('''
-            SELECT strftime('%Y-%m-%d %H:00', timestamp) as date,
-                   AVG(reading_value) as avg_usage,
-                   COUNT(*) as count
-            FROM meter_readings 
-            WHERE user_id = ? AND DATE(timestamp) = DATE('now')
-            GROUP BY strftime('%Y-%m-%d %H:00', timestamp)
-            ORDER BY date
-        ''', (session['user_id'],))
-        
-        meter_trend = [dict(row) for row in cursor.fetchall()]
-    else:
-        # Daily data for 7, 30, 90 days
-        cursor.execute('''
-            SELECT DATE(timestamp) as date, 
-                   AVG(safety_score) as avg_score,
-                   COUNT(*) as count
-            FROM quality_readings 
-            WHERE user_id = ? AND timestamp >= datetime('now', ?)
-            GROUP BY DATE(timestamp)
-            ORDER BY date
-        ''', (session['user_id'], f'-{days} days'))
-        
-        quality_trend = [dict(row) for row in cursor.fetchall()]
-        
-        cursor.execute('''
-            SELECT DATE(timestamp) as date,
-                   AVG(reading_value) as avg_usage,
-                   COUNT(*) as count
-            FROM meter_readings 
-            WHERE user_id = ? AND timestamp >= datetime('now', ?)
-            GROUP BY DATE(timestamp)
-            ORDER BY date
-        ''', (session['user_id'], f'-{days} days'))
-        
-        meter_trend = [dict(row) for row in cursor.fetchall()]
-    
-    # Safety status distribution
-    cursor.execute('''
-        SELECT safety_status, COUNT(*) as count
-        FROM quality_readings
-        WHERE user_id = ?
-        GROUP BY safety_status
-    ''', (session['user_id'],))
-    
-    safety_distribution = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
+    # Hourly data for today, daily for 7, 30, 90 days
+    quality_trend, meter_trend = get_usage_trends(session['user_id'], days)
+    safety_distribution = get_safety_distribution(session['user_id'])
     
     return jsonify({
         'quality_trend': quality_trend,
@@ -396,25 +443,12 @@ def export_report():
     
     report_type = request.args.get('type', 'csv')
     
-    conn = get_db()
-    
-    # Get quality readings
-    quality_df = pd.read_sql_query('''
-        SELECT timestamp, safety_status, safety_score, alert_level, location
-        FROM quality_readings
-        WHERE user_id = ?
-        ORDER BY timestamp DESC
-    ''', conn, params=(session['user_id'],))
+    import pandas as pd  # Only needed for exports
     
-    # Get meter readings
-    meter_df = pd.read_sql_query('''
-        SELECT timestamp, reading_value, is_high_usage, location
-        FROM meter_readings
-        WHERE user_id = ?
-        ORDER BY timestamp DESC
-    ''', conn, params=(session['user_id'],))
-    
-    conn.close()
+    quality_rows, meter_rows = get_report_rows(session['user_id'])
+    quality_df = pd.DataFrame(quality_rows, columns=['timestamp', 'safety_status', 'safety_score',
+                                                     'alert_level', 'location'])
+    meter_df = pd.DataFrame(meter_rows, columns=['timestamp', 'reading_value', 'is_high_usage', 'location'])
     
     if report_type == 'csv':
         output = BytesIO()
@@ -437,9 +471,71 @@ def api_mark_alert_read(alert_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    mark_alert_read(alert_id)
+    mark_alert_read(alert_id, session['user_id'])
     return jsonify({'success': True})
 
+def _bulk_ids(data):
+    """'ids' from a bulk request body: None if absent, else a list of ints (ValueError if invalid)"""
+    ids = data.get('ids')
+    if ids is None:
+        return None
+    if not isinstance(ids, list) or len(ids) > MAX_BULK_IDS:
+        raise ValueError(f'ids must be a list of at most {MAX_BULK_IDS} ids')
+    return [int(i) for i in ids]
+
+def _bulk_date(data, key):
+    """A YYYY-MM-DD field from a bulk request body as a date, or None (ValueError if invalid)"""
+    value = data.get(key)
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+@app.route('/api/alerts/mark_read', methods=['POST'])
+def api_mark_alerts_read():
+    """
+    Mark many alerts read at once. JSON body filters (all optional, combined):
+    ids, alert_type, severity, before (YYYY-MM-DD). No filter marks every unread alert.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        ids = _bulk_ids(data)
+        before = _bulk_date(data, 'before')
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid filter: {e}'}), 400
+
+    marked = mark_alerts_read(session['user_id'], ids=ids, alert_type=data.get('alert_type'),
+                              severity=data.get('severity'), before=before and before.isoformat())
+    return jsonify({'success': True, 'marked': len(marked)})
+
+@app.route('/api/events')
+def event_stream():
+    """Server-Sent Events feed of new readings, alerts and stat deltas"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not events.STREAMING:
+        # 204 tells EventSource to stop reconnecting (see events.py)
+        return '', 204
+    
+    return Response(
+        events.broker.stream(session['user_id']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/admission')
+@admin_required
+def admission_status():
+    """Inference admission limits, in-flight/queued requests and rejection counters"""
+    return jsonify(admission.status())
+
+@app.route('/api/upload_settings')
+def upload_settings():
+    """Photo size the upload pages resize to before sending"""
+    response = jsonify(image_gate.upload_targets())
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
 @app.route('/api/settings/update', methods=['POST'])
 def update_settings():
     if 'user_id' not in session:
@@ -447,23 +543,13 @@ def update_settings():
     
     data = request.get_json()
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE settings 
-        SET eco_limit = ?, alert_email = ?, alert_push = ?, theme = ?
-        WHERE user_id = ?
-    ''', (
+    update_user_settings(
+        session['user_id'],
         data.get('eco_limit'),
         data.get('alert_email'),
         data.get('alert_push'),
-        data.get('theme'),
-        session['user_id']
-    ))
-    
-    conn.commit()
-    conn.close()
+        data.get('theme')
+    )
     
     return jsonify({'success': True})
 
@@ -471,7 +557,28 @@ def update_settings():
 # READING DETAILS AND MANAGEMENT API
 # ============================================
 
+@app.route('/api/image/<image_ref>')
+def get_image(image_ref):
+    """Serve a stored reading image (?size=thumb for the small preview)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if not image_store.is_ref(image_ref):
+        return jsonify({'error': 'Image not found'}), 404
+    
+    owned = user_owns_image(session['user_id'], image_ref)
+    found = image_store.lookup(image_ref, thumbnail=request.args.get('size') == 'thumb') if owned else None
+    if not found:
+        return jsonify({'error': 'Image not found'}), 404
+    
+    path, mimetype = found
+    # Content-addressed files never change, so they can be cached forever
+    response = send_file(os.path.abspath(path), mimetype=mimetype, conditional=True)
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
 @app.route('/api/reading_details')
+@http_cache.conditional(lambda: session.get('user_id'))
 def reading_details():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
@@ -482,34 +589,38 @@ def reading_details():
     if not reading_type or not reading_id:
         return jsonify({'error': 'Missing parameters'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
+    if reading_type not in ('quality', 'meter'):
+        return jsonify({'error': 'Invalid reading type'}), 400
     
     try:
-        if reading_type == 'quality':
-            cursor.execute('''
-                SELECT * FROM quality_readings 
-                WHERE id = ? AND user_id = ?
-            ''', (reading_id, session['user_id']))
-        elif reading_type == 'meter':
-            cursor.execute('''
-                SELECT * FROM meter_readings 
-                WHERE id = ? AND user_id = ?
-            ''', (reading_id, session['user_id']))
-        else:
-            return jsonify({'error': 'Invalid reading type'}), 400
-        
-        reading = cursor.fetchone()
-        conn.close()
-        
+        reading = get_reading(session['user_id'], reading_type, reading_id)
         if not reading:
             return jsonify({'error': 'Reading not found'}), 404
         
-        return jsonify(dict(reading))
+        if image_store.is_ref(reading.get('image_path')):
+            reading['image_url'] = url_for('get_image', image_ref=reading['image_path'])
+            reading['thumbnail_url'] = url_for('get_image', image_ref=reading['image_path'], size='thumb')
+        return jsonify(reading)
     except Exception as e:
-        conn.close()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/reading_feedback', methods=['POST'])
+def reading_feedback():
+    """Confirm or correct the label of a quality reading (used for retraining)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json() or {}
+    labels = {'SAFE': 0, 'UNSAFE': 1}
+    if data.get('label') not in labels or not data.get('id'):
+        return jsonify({'error': 'Missing or invalid parameters'}), 400
+    
+    feedback_id = save_quality_feedback(session['user_id'], data['id'], labels[data['label']])
+    if feedback_id is None:
+        return jsonify({'error': 'Reading not found or unauthorized'}), 404
+    
+    return jsonify({'success': True, 'message': 'Thanks! Your label will be used to improve the model.'})
+
 @app.route('/api/delete_reading', methods=['DELETE'])
 def delete_reading():
     if 'user_id' not in session:
@@ -521,65 +632,216 @@ def delete_reading():
     if not reading_type or not reading_id:
         return jsonify({'error': 'Missing parameters'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
+    if reading_type not in ('quality', 'meter'):
+        return jsonify({'error': 'Invalid reading type'}), 400
     
     try:
-        # First verify the reading belongs to the user
-        if reading_type == 'quality':
-            cursor.execute('''
-                SELECT id FROM quality_readings 
-                WHERE id = ? AND user_id = ?
-            ''', (reading_id, session['user_id']))
-            
-            if cursor.fetchone():
-                # Delete associated alerts first
-                cursor.execute('''
-                    DELETE FROM alerts 
-                    WHERE related_reading_id = ? AND alert_type = 'WATER_QUALITY'
-                ''', (reading_id,))
-                
-                # Delete the reading
-                cursor.execute('''
-                    DELETE FROM quality_readings 
-                    WHERE id = ? AND user_id = ?
-                ''', (reading_id, session['user_id']))
-            else:
-                conn.close()
-                return jsonify({'error': 'Reading not found or unauthorized'}), 404
-                
-        elif reading_type == 'meter':
-            cursor.execute('''
-                SELECT id FROM meter_readings 
-                WHERE id = ? AND user_id = ?
-            ''', (reading_id, session['user_id']))
-            
-            if cursor.fetchone():
-                # Delete associated alerts first
-                cursor.execute('''
-                    DELETE FROM alerts 
-                    WHERE related_reading_id = ? AND alert_type = 'HIGH_USAGE'
-                ''', (reading_id,))
-                
-                # Delete the reading
-                cursor.execute('''
-                    DELETE FROM meter_readings 
-                    WHERE id = ? AND user_id = ?
-                ''', (reading_id, session['user_id']))
-            else:
-                conn.close()
-                return jsonify({'error': 'Reading not found or unauthorized'}), 404
-        else:
-            conn.close()
-            return jsonify({'error': 'Invalid reading type'}), 400
+        image_ref = delete_user_reading(session['user_id'], reading_type, reading_id)
+        if image_ref is False:
+            return jsonify({'error': 'Reading not found or unauthorized'}), 404
         
-        conn.commit()
-        conn.close()
+        if reading_type == 'meter':
+            # Usage baselines included the deleted reading; rebuild on next scan
+            reset_state(session['user_id'])
+        else:
+            # Drop the image reference (files go when no reading uses them)
+            image_store.release(image_ref)
         
         return jsonify({'success': True, 'message': 'Reading deleted successfully'})
     except Exception as e:
-        conn.close()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/delete_readings', methods=['POST'])
+def delete_readings_bulk():
+    """
+    Delete many readings of one type at once. JSON body: type ('quality' or 'meter')
+    plus ids and/or from / to (YYYY-MM-DD, inclusive); at least one filter is required.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    reading_type = data.get('type')
+    if reading_type not in ('quality', 'meter'):
+        return jsonify({'error': 'Invalid reading type'}), 400
+    try:
+        ids = _bulk_ids(data)
+        start, end = _bulk_date(data, 'from'), _bulk_date(data, 'to')
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid filter: {e}'}), 400
+    if ids is None and not start and not end:
+        return jsonify({'error': 'Give ids or a date range'}), 400
+
+    try:
+        deleted, image_refs = delete_readings(
+            session['user_id'], reading_type, ids=ids,
+            start=start and start.isoformat(), end=end and (end + timedelta(days=1)).isoformat()
+        )
+        if deleted:
+            if reading_type == 'meter':
+                reset_state(session['user_id'])
+            else:
+                image_store.release_many(image_refs)
+        return jsonify({'success': True, 'deleted': deleted})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============================================
+# OPERATOR ROUTES (network-wide, admins only)
+# ============================================
+# Served from the area aggregates (area_stats.py), never from raw readings.
+
+def _arg_int(name, default, low, high):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        value = default
+    return max(low, min(value, high))
+
+def _operator_json(data):
+    response = jsonify(data)
+    response.headers['Cache-Control'] = 'private, max-age=30'
+    return response
+
+@app.route('/operator')
+@admin_required
+def operator_page():
+    return render_template('operator.html', user=session)
+
+@app.route('/api/operator/areas')
+@admin_required
+def operator_areas():
+    """Readings, UNSAFE rate and mean score per area over the last ?hours=24"""
+    hours = _arg_int('hours', 24, 1, 24 * 90)
+    return _operator_json({'hours': hours, 'areas': area_stats.quality_by_area(hours)})
+
+@app.route('/api/operator/hotspots')
+@admin_required
+def operator_hotspots():
+    """Top ?top=10 areas by UNSAFE rate over the last ?hours=24 (with at least ?min_readings)"""
+    hours = _arg_int('hours', 24, 1, 24 * 90)
+    return _operator_json({'hours': hours, 'hotspots': area_stats.hotspots(
+        hours, _arg_int('top', 10, 1, 100),
+        _arg_int('min_readings', area_stats.HOTSPOT_MIN_READINGS, 1, 10000))})
+
+@app.route('/api/operator/heatmap')
+@admin_required
+def operator_heatmap():
+    """Area x hour grid of readings and UNSAFE counts over the last ?hours=24"""
+    return _operator_json(area_stats.quality_heatmap(
+        _arg_int('hours', 24, 1, area_stats.MAX_HEATMAP_HOURS),
+        _arg_int('areas', area_stats.MAX_HEATMAP_AREAS, 1, 100)))
+
+@app.route('/api/operator/consumption')
+@admin_required
+def operator_consumption():
+    """Metered usage per area over the last ?days=30, largest first (?top=20)"""
+    days = _arg_int('days', 30, 1, 365)
+    return _operator_json({'days': days, 'areas': area_stats.consumption_by_area(days, _arg_int('top', 20, 1, 200))})
+
+# ============================================
+# ADMIN PROFILING ROUTES
+# ============================================
+# Profiles describe the worker process that answered (see the pid in each response).
+
+@app.route('/admin/profile/cpu')
+@admin_required
+def admin_profile_cpu():
+    """
+    Profile the inference endpoints for ?seconds=N (the request blocks meanwhile).
+    mode=sample (default): collapsed stacks for flamegraph.pl / speedscope.
+    mode=cprofile: merged cProfile of every request, format=text (default) or pstats.
+    """
+    mode = request.args.get('mode', 'sample')
+    fmt = request.args.get('format', 'collapsed' if mode == 'sample' else 'text')
+    endpoints = request.args.getlist('endpoint') or ['quality', 'meter']
+    if mode not in ('sample', 'cprofile') or not set(endpoints) <= {'quality', 'meter'}:
+        return jsonify({'error': 'Invalid mode or endpoint'}), 400
+    if fmt not in (('collapsed',) if mode == 'sample' else ('text', 'pstats')):
+        return jsonify({'error': 'Invalid format for this mode'}), 400
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        return jsonify({'error': 'Invalid seconds'}), 400
+
+    try:
+        window = profiling.profile_cpu(seconds, endpoints, mode)
+    except profiling.ProfilerBusy:
+        return jsonify({'error': 'A profile is already running in this worker'}), 409
+
+    headers = {'X-Profile-Pid': str(os.getpid()), 'X-Profile-Seconds': str(window.seconds)}
+    if mode == 'sample':
+        headers['X-Profile-Samples'] = str(window.sample_count)
+        return Response(profiling.collapsed(window), mimetype='text/plain', headers=headers)
+
+    headers['X-Profile-Requests'] = str(window.requests)
+    if window.stats is None:
+        return jsonify({'pid': os.getpid(), 'requests': 0, 'skipped': window.skipped,
+                        'message': 'No inference requests ran during the profile'})
+    if fmt == 'pstats':
+        return send_file(BytesIO(profiling.stats_bytes(window.stats)), mimetype='application/octet-stream',
+                         as_attachment=True, download_name=f'cpu-{os.getpid()}.pstats'), 200, headers
+    return Response(profiling.stats_text(window.stats, int(request.args.get('top', 40))),
+                    mimetype='text/plain', headers=headers)
+
+@app.route('/admin/profile/memory', methods=['GET', 'DELETE'])
+@admin_required
+def admin_profile_memory():
+    """
+    GET starts tracemalloc, then returns the top allocation sites (?top=25,
+    ?group=lineno|filename|traceback) and the change since the previous call.
+    DELETE stops tracing.
+    """
+    if request.method == 'DELETE':
+        return jsonify({'pid': os.getpid(), 'stopped': profiling.stop_memory()})
+    group_by = request.args.get('group', 'lineno')
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({'error': 'Invalid group'}), 400
+    return jsonify(profiling.memory_snapshot(int(request.args.get('top', 25)), group_by))
+
+@app.route('/admin/profile/requests')
+@admin_required
+def admin_request_profiles():
+    """Saved per-request profiles (made with an X-Profile: 1 header), newest first"""
+    return jsonify({'profiles': profiling.list_request_profiles()})
+
+@app.route('/admin/profile/requests/<profile_id>')
+@admin_required
+def admin_request_profile(profile_id):
+    path = profiling.request_profile_path(profile_id)
+    if not path:
+        return jsonify({'error': 'Profile not found'}), 404
+    if request.args.get('format') == 'pstats':
+        return send_file(os.path.abspath(path), as_attachment=True, download_name=profile_id + '.pstats')
+    import pstats
+    return Response(profiling.stats_text(pstats.Stats(path), int(request.args.get('top', 40))),
+                    mimetype='text/plain')
+
+# ============================================
+# ADMIN SQL TRACING ROUTES
+# ============================================
+
+@app.route('/admin/sql/stats', methods=['GET', 'DELETE'])
+@admin_required
+def admin_sql_stats():
+    """
+    Per-statement totals in this worker since start or the last DELETE:
+    ?sort=total_ms (default), count, max_ms or mean_ms; ?top=50
+    """
+    if request.method == 'DELETE':
+        sql_trace.reset()
+        return jsonify({'pid': os.getpid(), 'reset': True})
+    sort = request.args.get('sort', 'total_ms')
+    if sort not in ('total_ms', 'count', 'max_ms', 'mean_ms', 'slow'):
+        return jsonify({'error': 'Invalid sort'}), 400
+    return jsonify(sql_trace.stats(int(request.args.get('top', 50)), sort))
+
+@app.route('/admin/sql/slow')
+@admin_required
+def admin_sql_slow():
+    """Newest slow statements from every worker, with query plans and request ids (?limit=100)"""
+    return jsonify({'slow_ms': sql_trace.SLOW_MS, 'entries': sql_trace.slow_entries(int(request.args.get('limit', 100)))})
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=9000)
+    # Requests share nothing but the loaded model, so serve them concurrently
+    app.run(debug=True, host='0.0.0.0', port=9000, threaded=True)
@@ -0,0 +1,227 @@
+"""
+AquaGuard AI - Columnar Archive Export
+Copies quality_readings, meter_readings and alerts into compressed Parquet
+(or Arrow IPC) files for cross-user analysis, so analytical scans read
+compact columnar files instead of the live database.
+
+Layout (hive partitioning, readable by pyarrow.dataset, pandas, DuckDB, Spark):
+    <out>/<table>/date=YYYY-MM-DD/user_id=N/part-<first id>-<last id>.parquet
+
+Runs are incremental: only rows with an id above the table's high-water mark
+(kept in <out>/_export_state.json, one per shard) are exported. Rows are
+exported as they were at the time of the run; later edits (e.g. an alert
+being marked read) and deletions are not carried over - use --full to
+rebuild the archive.
+
+Usage:
+    python archive_export.py                       # Parquet + zstd into ../data/archive
+    python archive_export.py --format arrow --compression lz4
+"""
+
+import os
+import json
+import time
+import argparse
+
+import storage
+from storage import sql
+from database import get_storage
+
+# 🔧 CONFIGURATION
+ARCHIVE_DIR = "../data/archive"
+STATE_FILE = "_export_state.json"
+BATCH_ROWS = 50000            # Rows converted and written per batch
+DEFAULT_FORMAT = 'parquet'    # 'parquet' or 'arrow' (Arrow IPC / Feather v2)
+DEFAULT_COMPRESSION = 'zstd'  # zstd, lz4, snappy (Parquet only), gzip (Parquet only) or none
+
+# Column types are fixed so every part file of a table has the same schema,
+# even when a batch happens to contain only NULLs in some column.
+# user_id and the date are partition keys (taken from the directory names).
+TABLES = {
+    'quality_readings': [
+        ('id', 'int64'), ('timestamp', 'timestamp'), ('safety_status', 'string'),
+        ('safety_score', 'int32'), ('mean_hue', 'float64'), ('mean_saturation', 'float64'),
+        ('mean_value', 'float64'), ('texture_score', 'float64'), ('alert_level', 'string'),
+        ('image_path', 'string'), ('location', 'string'), ('notes', 'string'),
+    ],
+    'meter_readings': [
+        ('id', 'int64'), ('timestamp', 'timestamp'), ('reading_value', 'int64'),
+        ('is_high_usage', 'bool'), ('monthly_usage', 'int64'), ('conservation_tip', 'string'),
+        ('image_path', 'string'), ('meter_id', 'string'), ('location', 'string'),
+    ],
+    'alerts': [
+        ('id', 'int64'), ('timestamp', 'timestamp'), ('alert_type', 'string'),
+        ('alert_message', 'string'), ('severity', 'string'), ('is_read', 'bool'),
+        ('related_reading_id', 'int64'),
+    ],
+}
+
+
+def _arrow_type(name):
+    import pyarrow as pa
+    return pa.timestamp('s') if name == 'timestamp' else pa.type_for_alias(name)
+
+
+def load_state(out_dir):
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(out_dir, state):
+    """Written only after the part files, so a crash just re-exports (and overwrites) the last batch"""
+    path = os.path.join(out_dir, STATE_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _to_arrow(rows, columns):
+    """Database rows (user_id, day, *columns) -> (user ids, days, Arrow table of the columns)"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    user_ids = [r[0] for r in rows]
+    days = [r[1] or 'unknown' for r in rows]
+    arrays = []
+    for i, (name, type_name) in enumerate(columns, start=2):
+        values = [r[i] for r in rows]
+        if type_name == 'timestamp':
+            # Stored as text; drop fractional seconds some writers add
+            text = pc.utf8_slice_codeunits(pa.array(values, pa.string()), 0, 19)
+            arrays.append(pc.strptime(text, format='%Y-%m-%d %H:%M:%S', unit='s', error_is_null=True))
+        elif type_name == 'bool':
+            # Stored as 0/1 integers (see storage.py)
+            arrays.append(pa.array([None if v is None else bool(v) for v in values], pa.bool_()))
+        else:
+            arrays.append(pa.array(values, _arrow_type(type_name)))
+    return user_ids, days, pa.Table.from_arrays(arrays, names=[name for name, _ in columns])
+
+
+def _write_part(table, path, fmt, compression):
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    if fmt == 'parquet':
+        pq.write_table(table, tmp, compression=compression)
+    else:
+        feather.write_feather(table, tmp, compression=compression)
+    os.replace(tmp, path)
+
+
+def export_table(conn, name, out_dir, since_id, fmt=DEFAULT_FORMAT, compression=DEFAULT_COMPRESSION):
+    """Export rows with id > since_id; returns (rows exported, new high-water mark, files written)"""
+    import pyarrow as pa
+
+    columns = TABLES[name]
+    extension = 'parquet' if fmt == 'parquet' else 'arrow'
+    cursor = conn.execute(
+        f"SELECT user_id, {sql(conn, 'day', 'timestamp')}, {', '.join(c for c, _ in columns)} "
+        f"FROM {name} WHERE id > ? ORDER BY id",
+        (since_id,)
+    )
+
+    exported, files, high_water = 0, 0, since_id
+    while True:
+        rows = cursor.fetchmany(BATCH_ROWS)
+        if not rows:
+            break
+        user_ids, days, table = _to_arrow(rows, columns)
+
+        # Group row indexes by partition; ids are ascending within each group
+        partitions = {}
+        for i, key in enumerate(zip(days, user_ids)):
+            partitions.setdefault(key, []).append(i)
+        for (day, user_id), indexes in partitions.items():
+            part = table.take(pa.array(indexes))
+            ids = part.column('id')
+            path = os.path.join(out_dir, name, f"date={day}", f"user_id={user_id}",
+                                f"part-{ids[0].as_py()}-{ids[-1].as_py()}.{extension}")
+            _write_part(part, path, fmt, compression)
+            files += 1
+
+        exported += len(rows)
+        high_water = rows[-1][2]
+    return exported, high_water, files
+
+
+def export_archive(db_path=None, out_dir=ARCHIVE_DIR, fmt=DEFAULT_FORMAT,
+                   compression=DEFAULT_COMPRESSION, tables=None, full=False):
+    """
+    Bring the archive up to date from the configured database (or the SQLite
+    file db_path); returns {table: rows exported}
+    """
+    if compression == 'none':
+        compression = None
+    backend = storage.SQLiteStorage(db_path) if db_path else get_storage()
+    os.makedirs(out_dir, exist_ok=True)
+    state = load_state(out_dir)
+    selected = list(tables or TABLES)
+    # full only starts the selected tables over; the others keep their files and marks
+    kept = [name for name in state.get('tables', {}) if not (full and name in selected)]
+    if kept and state.get('format', fmt) != fmt:
+        raise ValueError(f"Archive in {out_dir} is {state['format']}; "
+                         f"use --full for all tables to rebuild it as {fmt}")
+    if full:
+        import shutil
+        for name in selected:
+            shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+            state.get('tables', {}).pop(name, None)
+
+    summary = {}
+    for name in selected:
+        started = time.perf_counter()
+        marks = state.setdefault('tables', {}).get(name, {})
+        if not isinstance(marks, dict):
+            marks = {'main': marks}   # Archives from before sharding support
+        rows = files = 0
+        # Ids only grow within one database, so each shard has its own mark
+        for shard in backend.shards():
+            # Read-only connection: the export never takes write locks on the live database
+            conn = backend.connect_shard(shard, readonly=True)
+            try:
+                exported, marks[shard], written = export_table(conn, name, out_dir, marks.get(shard, 0),
+                                                               fmt, compression)
+            finally:
+                conn.close()
+            rows += exported
+            files += written
+        state['tables'][name] = marks
+        state['format'] = fmt
+        save_state(out_dir, state)
+        summary[name] = rows
+        print(f"   📦 {name}: {rows} new rows -> {files} files ({time.perf_counter() - started:.1f}s)")
+    return summary
+
+
+def open_dataset(name, out_dir=ARCHIVE_DIR, fmt=DEFAULT_FORMAT):
+    """
+    The archived table as a pyarrow Dataset with date/user_id partition columns, e.g.
+    open_dataset('quality_readings').to_table(filter=pc.field('date') >= '2026-01-01')
+    """
+    import pyarrow.dataset as ds
+    return ds.dataset(os.path.join(out_dir, name), format='parquet' if fmt == 'parquet' else 'ipc',
+                      partitioning='hive')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export readings and alerts to a partitioned columnar archive")
+    parser.add_argument('--db', default=None,
+                        help="SQLite file to read (default: the configured database, see database.py)")
+    parser.add_argument('--out', default=ARCHIVE_DIR, help="Archive directory")
+    parser.add_argument('--format', choices=['parquet', 'arrow'], default=DEFAULT_FORMAT)
+    parser.add_argument('--compression', default=DEFAULT_COMPRESSION,
+                        help="zstd, lz4, snappy, gzip or none")
+    parser.add_argument('--table', action='append', choices=list(TABLES), help="Only these tables (repeatable)")
+    parser.add_argument('--full', action='store_true',
+                        help="Discard the archive of the selected tables (default: all) and export them again")
+    args = parser.parse_args()
+
+    print(f"🗄️  Exporting {args.db or get_storage().name} -> {args.out} ({args.format}, {args.compression})")
+    summary = export_archive(args.db, args.out, args.format, args.compression, args.table, args.full)
+    print(f"✅ Exported {sum(summary.values())} rows")
@@ -0,0 +1,355 @@
+import re
+import unicodedata
+from datetime import datetime, timedelta, timezone
+
+from storage import sql, ddl, table_columns
+
+# Network-wide contamination and consumption per area, for operators.
+#
+# Readings store a normalized location_key next to the free-text location,
+# and two small aggregate tables are updated in the same transaction as every
+# reading insert and delete:
+#
+#   area_quality_hourly  (location_key, hour)  readings, unsafe, score_sum
+#   area_usage_daily     (location_key, day)   readings, high_usage, usage_sum
+#
+# Meter readings are cumulative register values, so consumption is counted
+# from meter_readings.usage_delta: the litres since the same meter's previous
+# reading (by id, like usage_analytics.py), 0 for a meter's first reading and
+# for resets/misreads that make the register go backwards.
+#
+# Reports read only these tables, so an operator refresh costs the same with
+# a hundred readings or ten million. With sharded storage each shard
+# aggregates its own users' readings and the reports add the shards up.
+# Buckets are in UTC, like the stored timestamps.
+
+# 🔧 CONFIGURATION
+UNKNOWN_AREA = 'unknown'      # Key of readings recorded without a location
+MAX_KEY_LENGTH = 80
+HOTSPOT_MIN_READINGS = 3      # Areas with fewer readings in the window aren't ranked as hotspots
+MAX_HEATMAP_HOURS = 168
+MAX_HEATMAP_AREAS = 30
+IDS_PER_STATEMENT = 500
+
+# reading type -> readings table, aggregate table, bucket, aggregate columns
+KINDS = {
+    'quality': {
+        'table': 'quality_readings',
+        'aggregate': 'area_quality_hourly',
+        'bucket': 'hour',
+        'columns': {
+            'readings': 'COUNT(*)',
+            'unsafe': "SUM(CASE WHEN safety_status = 'UNSAFE' THEN 1 ELSE 0 END)",
+            'score_sum': 'SUM(safety_score)',
+        },
+    },
+    'meter': {
+        'table': 'meter_readings',
+        'aggregate': 'area_usage_daily',
+        'bucket': 'day',
+        'columns': {
+            'readings': 'COUNT(*)',
+            'high_usage': 'SUM(CASE WHEN is_high_usage = 1 THEN 1 ELSE 0 END)',
+            'usage_sum': 'SUM(usage_delta)',
+        },
+    },
+}
+
+_APOSTROPHES = re.compile(r"['’`]")
+
+# meter_id NULL (readings from before meter ids) and '' (none given) are the
+# same unnamed meter, here and in usage_analytics.py.
+# One meter's readings, for a meter id parameter ('' for the unnamed meter) bound twice:
+METER_MATCH = "(meter_id = ? OR (? = '' AND meter_id IS NULL))"
+# Same meter as the reading being updated:
+_SAME_METER = ("p.user_id = meter_readings.user_id AND (p.meter_id = meter_readings.meter_id "
+               "OR (COALESCE(p.meter_id, '') = '' AND COALESCE(meter_readings.meter_id, '') = ''))")
+_PREVIOUS_VALUE = (f"(SELECT p.reading_value FROM meter_readings p WHERE {_SAME_METER} "
+                   f"AND p.id < meter_readings.id ORDER BY p.id DESC LIMIT 1)")
+_DIFFERENCE = f"meter_readings.reading_value - COALESCE({_PREVIOUS_VALUE}, meter_readings.reading_value)"
+USAGE_DELTA = f"CASE WHEN {_DIFFERENCE} > 0 THEN {_DIFFERENCE} ELSE 0 END"
+
+
+def location_key(location):
+    """
+    Normalized area key: "  St. Mary's Rd., WARD 5 " and "st marys rd ward 5"
+    give the same key. Accents on Latin letters are dropped; other scripts are kept.
+    """
+    if not location or not location.strip():
+        return UNKNOWN_AREA
+    chars = []
+    for c in unicodedata.normalize('NFKD', location.casefold()):
+        if unicodedata.combining(c) and chars and chars[-1].isascii():
+            continue   # é -> e (but Indic vowel signs are combining marks too, and stay)
+        chars.append(c)
+    text = _APOSTROPHES.sub('', unicodedata.normalize('NFKC', ''.join(chars)))
+    # Punctuation separates words; letters, digits and marks (vowel signs) don't
+    text = ''.join(c if c.isalnum() or unicodedata.category(c)[0] == 'M' else ' ' for c in text)
+    key = ' '.join(text.split())[:MAX_KEY_LENGTH].strip()
+    return key or UNKNOWN_AREA
+
+
+def area_label(key):
+    return 'Unknown' if key == UNKNOWN_AREA else key.title()
+
+
+# ============================================
+# SCHEMA
+# ============================================
+
+def create_tables(conn):
+    """Aggregate tables, plus location keys and aggregates for readings that predate them"""
+    missing_tables = not table_columns(conn, 'area_quality_hourly')
+    conn.execute(ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS area_quality_hourly (
+            location_key TEXT NOT NULL,
+            hour TEXT NOT NULL,
+            readings INTEGER NOT NULL DEFAULT 0,
+            unsafe INTEGER NOT NULL DEFAULT 0,
+            score_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (location_key, hour)
+        )
+    '''))
+    conn.execute(ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS area_usage_daily (
+            location_key TEXT NOT NULL,
+            day TEXT NOT NULL,
+            readings INTEGER NOT NULL DEFAULT 0,
+            high_usage INTEGER NOT NULL DEFAULT 0,
+            usage_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (location_key, day)
+        )
+    '''))
+    # Reports scan a time window across every area
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_area_quality_hour ON area_quality_hourly (hour)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_area_usage_day ON area_usage_daily (day)')
+
+    added = False
+    for kind in KINDS.values():
+        if 'location_key' not in table_columns(conn, kind['table']):
+            conn.execute(f"ALTER TABLE {kind['table']} ADD COLUMN location_key TEXT")
+            _backfill_keys(conn, kind['table'])
+            added = True
+    if 'usage_delta' not in table_columns(conn, 'meter_readings'):
+        conn.execute("ALTER TABLE meter_readings ADD COLUMN usage_delta INTEGER")
+        conn.execute(f"UPDATE meter_readings SET usage_delta = {USAGE_DELTA}")
+        added = True
+    if added or missing_tables:
+        rebuild(conn)
+
+
+def _backfill_keys(conn, table):
+    locations = [row[0] for row in conn.execute(
+        f'SELECT DISTINCT location FROM {table} WHERE location IS NOT NULL')]
+    conn.executemany(f'UPDATE {table} SET location_key = ? WHERE location = ? AND location_key IS NULL',
+                     [(location_key(location), location) for location in locations])
+    conn.execute(f'UPDATE {table} SET location_key = ? WHERE location_key IS NULL', (UNKNOWN_AREA,))
+
+
+# ============================================
+# INCREMENTAL MAINTENANCE (inside the caller's transaction)
+# ============================================
+
+def _grouped(conn, kind, where):
+    """SELECT of (location_key, bucket, aggregate columns...) for the readings matching where"""
+    bucket = sql(conn, kind['bucket'], 'timestamp')
+    return (f"SELECT location_key, {bucket}, {', '.join(kind['columns'].values())} "
+            f"FROM {kind['table']} WHERE {where} GROUP BY location_key, {bucket}")
+
+
+def _set_usage_deltas(conn, ids):
+    conn.execute(f"UPDATE meter_readings SET usage_delta = {USAGE_DELTA} WHERE id IN ({', '.join('?' * len(ids))})",
+                 ids)
+
+
+def _adjust_usage(conn, ids, sign):
+    """Add (sign=1) or take out (sign=-1) these meter readings' usage_delta in their buckets"""
+    bucket = sql(conn, 'day', 'timestamp')
+    groups = conn.execute(f'''
+        SELECT location_key, {bucket}, SUM(usage_delta) FROM meter_readings
+        WHERE id IN ({', '.join('?' * len(ids))}) AND timestamp IS NOT NULL
+        GROUP BY location_key, {bucket}
+    ''', ids).fetchall()
+    conn.executemany('UPDATE area_usage_daily SET usage_sum = usage_sum + ? WHERE location_key = ? AND day = ?',
+                     [(sign * int(row[2] or 0), row[0], row[1]) for row in groups])
+
+
+def add_readings(conn, reading_type, ids):
+    """Count newly inserted readings (by id) into their area's bucket"""
+    kind = KINDS[reading_type]
+    columns = list(kind['columns'])
+    upsert = ', '.join(f"{c} = {kind['aggregate']}.{c} + excluded.{c}" for c in columns)
+    for start in range(0, len(ids), IDS_PER_STATEMENT):
+        batch = ids[start:start + IDS_PER_STATEMENT]
+        if reading_type == 'meter':
+            _set_usage_deltas(conn, batch)
+        conn.execute(f'''
+            INSERT INTO {kind['aggregate']} (location_key, {kind['bucket']}, {', '.join(columns)})
+            {_grouped(conn, kind, f"id IN ({', '.join('?' * len(batch))}) AND timestamp IS NOT NULL")}
+            ON CONFLICT (location_key, {kind['bucket']}) DO UPDATE SET {upsert}
+        ''', batch)
+
+
+def remove_readings(conn, reading_type, where, params):
+    """
+    Take the readings about to be deleted (those matching where) out of the
+    aggregates. Returns the ids of meter readings whose previous reading is
+    among them: pass them to rebase_usage() after the delete.
+    """
+    kind = KINDS[reading_type]
+    columns = list(kind['columns'])
+    groups = conn.execute(_grouped(conn, kind, where), params).fetchall()
+    if not groups:
+        return []
+    key = f"location_key = ? AND {kind['bucket']} = ?"
+    conn.executemany(
+        f"UPDATE {kind['aggregate']} SET {', '.join(f'{c} = {c} - ?' for c in columns)} WHERE {key}",
+        [(*row[2:], row[0], row[1]) for row in groups])
+    conn.executemany(f"DELETE FROM {kind['aggregate']} WHERE {key} AND readings <= 0",
+                     [(row[0], row[1]) for row in groups])
+    if reading_type != 'meter':
+        return []
+    # The next surviving reading of each meter that loses readings
+    following = conn.execute(f'''
+        SELECT DISTINCT (SELECT MIN(p.id) FROM meter_readings p
+                         WHERE {_SAME_METER.replace('meter_readings.', 'd.')} AND p.id > d.id
+                           AND p.id NOT IN (SELECT id FROM meter_readings WHERE {where}))
+        FROM meter_readings d WHERE {where}
+    ''', [*params, *params]).fetchall()
+    return [row[0] for row in following if row[0] is not None]
+
+
+def rebase_usage(conn, ids):
+    """After a delete: count these meter readings' usage from their new previous reading"""
+    for start in range(0, len(ids), IDS_PER_STATEMENT):
+        batch = ids[start:start + IDS_PER_STATEMENT]
+        _adjust_usage(conn, batch, -1)
+        _set_usage_deltas(conn, batch)
+        _adjust_usage(conn, batch, 1)
+
+
+def rebuild(conn):
+    """Recompute the aggregates from the readings (after a migration, restore or manual edit)"""
+    for kind in KINDS.values():
+        conn.execute(f"DELETE FROM {kind['aggregate']}")
+        conn.execute(f'''
+            INSERT INTO {kind['aggregate']} (location_key, {kind['bucket']}, {', '.join(kind['columns'])})
+            {_grouped(conn, kind, 'location_key IS NOT NULL AND timestamp IS NOT NULL')}
+        ''')
+
+
+# ============================================
+# REPORTS (summed over every shard)
+# ============================================
+
+def _query(statement, params):
+    from database import shard_connections
+    rows = []
+    for _, conn in shard_connections(readonly=True):
+        try:
+            rows.extend(tuple(row) for row in conn.execute(statement, params))
+        finally:
+            conn.close()
+    return rows
+
+
+def _hour_cutoff(hours):
+    return (datetime.now(timezone.utc) - timedelta(hours=hours - 1)).strftime('%Y-%m-%d %H:00')
+
+
+def _day_cutoff(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+
+
+def quality_by_area(hours=24):
+    """Readings, UNSAFE count/rate and mean score per area over the last `hours` (current hour included)"""
+    totals = {}
+    for key, readings, unsafe, score_sum in _query('''
+        SELECT location_key, SUM(readings), SUM(unsafe), SUM(score_sum)
+        FROM area_quality_hourly WHERE hour >= ? GROUP BY location_key
+    ''', (_hour_cutoff(hours),)):
+        t = totals.setdefault(key, [0, 0, 0])
+        t[0] += int(readings)   # PostgreSQL sums are NUMERIC
+        t[1] += int(unsafe)
+        t[2] += int(score_sum)
+    areas = [{'area': key, 'label': area_label(key), 'readings': readings, 'unsafe': unsafe,
+              'unsafe_rate': round(unsafe / readings, 4), 'avg_score': round(score_sum / readings, 1)}
+             for key, (readings, unsafe, score_sum) in totals.items() if readings > 0]
+    areas.sort(key=lambda a: (a['unsafe_rate'], a['unsafe']), reverse=True)
+    return areas
+
+
+def hotspots(hours=24, top=10, min_readings=HOTSPOT_MIN_READINGS):
+    """Areas with the highest UNSAFE rate (ties: most UNSAFE readings) and enough readings to tell"""
+    return [a for a in quality_by_area(hours)
+            if a['unsafe'] and a['readings'] >= min_readings and a['area'] != UNKNOWN_AREA][:top]
+
+
+def quality_heatmap(hours=24, max_areas=MAX_HEATMAP_AREAS):
+    """
+    Area x hour grid of readings and UNSAFE counts over the last `hours`, for
+    the busiest areas with UNSAFE readings first.
+    """
+    hours = max(1, min(hours, MAX_HEATMAP_HOURS))
+    start = datetime.now(timezone.utc) - timedelta(hours=hours - 1)
+    labels = [(start + timedelta(hours=i)).strftime('%Y-%m-%d %H:00') for i in range(hours)]
+    column = {label: i for i, label in enumerate(labels)}
+
+    cells = {}
+    for key, hour, readings, unsafe in _query('''
+        SELECT location_key, hour, readings, unsafe FROM area_quality_hourly WHERE hour >= ?
+    ''', (labels[0],)):
+        if hour not in column:
+            continue   # Readings timestamped in the future
+        row = cells.setdefault(key, ([0] * hours, [0] * hours))
+        row[0][column[hour]] += readings
+        row[1][column[hour]] += unsafe
+
+    keys = sorted(cells, key=lambda k: (sum(cells[k][1]), sum(cells[k][0])), reverse=True)[:max_areas]
+    return {
+        'hours': labels,
+        'areas': [{'area': key, 'label': area_label(key)} for key in keys],
+        'readings': [cells[key][0] for key in keys],
+        'unsafe': [cells[key][1] for key in keys],
+    }
+
+
+def consumption_by_area(days=30, top=20):
+    """Metered usage per area over the last `days` (today included), largest first"""
+    totals = {}
+    for key, readings, high_usage, usage_sum in _query('''
+        SELECT location_key, SUM(readings), SUM(high_usage), SUM(usage_sum)
+        FROM area_usage_daily WHERE day >= ? GROUP BY location_key
+    ''', (_day_cutoff(days),)):
+        t = totals.setdefault(key, [0, 0, 0])
+        t[0] += int(readings)
+        t[1] += int(high_usage)
+        t[2] += int(usage_sum)
+    areas = [{'area': key, 'label': area_label(key), 'readings': readings, 'high_usage': high_usage,
+              'total_usage': usage_sum, 'avg_usage': round(usage_sum / readings, 1)}
+             for key, (readings, high_usage, usage_sum) in totals.items() if readings > 0]
+    areas.sort(key=lambda a: a['total_usage'], reverse=True)
+    return areas[:top]
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import init_db, shard_connections
+
+    parser = argparse.ArgumentParser(description="Area aggregates for operators")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute the aggregates from all readings")
+    parser.add_argument('--hours', type=int, default=24)
+    args = parser.parse_args()
+
+    init_db()
+    if args.rebuild:
+        for shard, conn in shard_connections():
+            try:
+                conn.begin_write('area-aggregates')
+                rebuild(conn)
+                conn.commit()
+            finally:
+                conn.close()
+        print("✅ Area aggregates rebuilt")
+    for area in hotspots(args.hours):
+        print(f"🔥 {area['label']}: {area['unsafe']}/{area['readings']} UNSAFE ({area['unsafe_rate']:.0%})")
@@ -0,0 +1,125 @@
+import os
+import hmac
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# Passwords are stored as "pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>".
+# Older accounts still have a bare SHA-256 hex digest; those are accepted and
+# upgraded to the KDF format on the next successful login.
+
+# 🔧 CONFIGURATION
+KDF_ITERATIONS = int(os.environ.get('AQUAGUARD_KDF_ITERATIONS', 200000))
+HASH_WORKERS = int(os.environ.get('AQUAGUARD_HASH_WORKERS', 2))      # Threads doing KDF work
+MAX_PENDING_HASHES = int(os.environ.get('AQUAGUARD_MAX_PENDING_HASHES', 32))  # Queue bound
+HASH_WAIT_SECONDS = 10
+
+# Admin-only tools (profiling): sign in as one of these users, or send the token
+# in an X-Admin-Token header. With neither set, nobody is an admin.
+ADMIN_USERS = {u.strip() for u in os.environ.get('AQUAGUARD_ADMIN_USERS', '').split(',') if u.strip()}
+ADMIN_TOKEN = os.environ.get('AQUAGUARD_ADMIN_TOKEN')
+
+ALGORITHM = 'pbkdf2_sha256'
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(MAX_PENDING_HASHES)
+
+
+class AuthBusy(Exception):
+    """Raised when too many password hashes are already queued"""
+
+
+def hash_password(password, iterations=KDF_ITERATIONS):
+    """Hash password with salted PBKDF2-HMAC-SHA256"""
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored_hash):
+    """Check a password against a stored hash (KDF or legacy SHA-256)"""
+    if not stored_hash:
+        return False
+
+    if '$' not in stored_hash:
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored_hash)
+
+    try:
+        algorithm, iterations, salt, expected = stored_hash.split('$')
+        iterations = int(iterations)
+        salt = bytes.fromhex(salt)
+    except ValueError:
+        return False
+    if algorithm != ALGORITHM:
+        return False
+
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def needs_rehash(stored_hash):
+    """True for legacy hashes or ones made with a different iteration count"""
+    return not stored_hash.startswith(f"{ALGORITHM}${KDF_ITERATIONS}$")
+
+
+_dummy_hash = None
+
+
+def verify_dummy(password):
+    """
+    Burn the same KDF time for an unknown username so response timing
+    doesn't reveal which usernames exist. Always returns False.
+    """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(os.urandom(8).hex())
+    verify_password(password, _dummy_hash)
+    return False
+
+
+def is_admin(username, token=None):
+    """True for a configured admin username or a matching admin token"""
+    if ADMIN_TOKEN and token and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return True
+    return username is not None and username in ADMIN_USERS
+
+
+def _get_executor():
+    """The hashing pool of this process (created after the fork, in the worker)"""
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                from storage import green_threads
+                if green_threads():
+                    # Under gevent, threads are greenlets: KDF work would stall every
+                    # open connection. gevent's pool runs on real OS threads.
+                    from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+                    _executor = NativeThreadPoolExecutor(max_workers=HASH_WORKERS)
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='kdf')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def run_hasher(func, *args):
+    """
+    Run KDF work on the bounded hashing pool.
+    Raises AuthBusy instead of queueing without limit during login bursts.
+    """
+    if not _pending.acquire(blocking=False):
+        raise AuthBusy()
+    try:
+        future = _get_executor().submit(func, *args)
+    except RuntimeError:
+        _pending.release()
+        raise
+    # The slot is freed when the hash finishes, even if the caller gave up waiting
+    future.add_done_callback(lambda _: _pending.release())
+    try:
+        return future.result(timeout=HASH_WAIT_SECONDS)
+    except FutureTimeout:
+        raise AuthBusy()
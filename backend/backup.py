@@ -0,0 +1,417 @@
+"""
+AquaGuard AI - Online Database Backups
+Snapshots the live SQLite database(s) while the server keeps running, using
+SQLite's online backup API in small page steps: each step holds the read
+lock for about a millisecond, and the copy pauses between steps so uploads
+committing meanwhile never wait behind the backup.
+
+    <backups>/<YYYYmmdd-HHMMSS>/
+        aquaguard.db                 consistent copy (main.db + shard-NN.db when sharded)
+        manifest.json                sizes, SHA-256, integrity check, row counts, id high-water marks
+        changes-<time>.jsonl.gz      optional changelog: rows added after the snapshot
+
+Changelogs only record new rows (users, readings, alerts, feedback) by id,
+so they are cheap to write every few minutes between full snapshots. Edits
+and deletions (an alert marked read, a deleted reading) are picked up by
+the next snapshot. After a replay the per-area aggregates (area_stats.py)
+of each restored file are rebuilt from its readings.
+
+PostgreSQL databases are backed up with their own tools (pg_dump,
+pg_basebackup). Photos in the image store are files; back them up with the
+uploads directory.
+
+Usage:
+    python backup.py                            # one snapshot into ../data/backups, then prune
+    python backup.py --every 360 --changelog-every 10
+    python backup.py --changelog                 # rows added since the latest snapshot
+    python backup.py --restore latest --to /tmp/restore-check
+"""
+
+import os
+import gzip
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+
+import storage
+import area_stats
+from database import get_storage
+
+# 🔧 CONFIGURATION
+BACKUP_DIR = os.environ.get('AQUAGUARD_BACKUP_DIR', "../data/backups")
+PAGES_PER_STEP = 256          # Pages copied per backup step (1 MB with 4 KB pages)
+STEP_PAUSE = 0.005            # Seconds between steps, so writers get the lock
+MAX_RESTARTS = 20             # Then copy the rest in one step (see copy_online)
+KEEP_SNAPSHOTS = 7            # Newest snapshots always kept
+KEEP_DAILY = 30               # ...plus the newest snapshot of each of the last N days
+NICE = 10                     # CPU priority of the backup process (hashing, integrity checks)
+
+# Append-only tables recorded in changelogs (rows are only added by id)
+CHANGELOG_TABLES = ('users', 'quality_readings', 'meter_readings', 'alerts', 'quality_feedback')
+MANIFEST = "manifest.json"
+SNAPSHOT_FORMAT = '%Y%m%d-%H%M%S'
+
+
+class BackupError(Exception):
+    """A snapshot or restore failed verification"""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def database_files(backend=None):
+    """(file name in the snapshot, live path) of every SQLite file of the configured database"""
+    backend = backend or get_storage()
+    if isinstance(backend, storage.SQLiteStorage):
+        return [(os.path.basename(backend.path), backend.path)]
+    if isinstance(backend, storage.ShardedSQLiteStorage):
+        return [('main.db', backend.main_path)] + [
+            (shard + '.db', os.path.join(backend.directory, shard + '.db')) for shard in backend.shards()]
+    raise ValueError(f"{backend.name} databases are backed up with their own tools (pg_dump, pg_basebackup)")
+
+
+def copy_online(src_path, dst_path, pages=PAGES_PER_STEP, pause=STEP_PAUSE):
+    """
+    Consistent copy of a live SQLite file; returns {steps, restarts, seconds}.
+    In WAL mode (the default, see storage.py) the copy reads one snapshot.
+    Otherwise a write from another connection restarts the copy from the
+    first page, and under constant writes the copy falls back, after
+    MAX_RESTARTS, to one step holding the read lock for the whole copy.
+    """
+    started = time.perf_counter()
+    src = _readonly(src_path)
+    if src.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+        # Pin one read snapshot for the whole copy: WAL readers don't block
+        # writers, and changes committed meanwhile don't restart the copy
+        src.execute('BEGIN')
+        src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+    progress = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+    def on_step(status, remaining, total):
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1
+            if progress['restarts'] > MAX_RESTARTS:
+                raise _Restarted()
+        progress['remaining'] = remaining
+        progress['steps'] += 1
+        if remaining:
+            time.sleep(pause)
+
+    try:
+        dst = sqlite3.connect(dst_path)
+        try:
+            try:
+                src.backup(dst, pages=pages, progress=on_step, sleep=0.05)
+            except _Restarted:
+                src.backup(dst, pages=-1, sleep=0.05)
+                progress['steps'] += 1
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    return {'steps': progress['steps'], 'restarts': progress['restarts'],
+            'seconds': round(time.perf_counter() - started, 3)}
+
+
+def _readonly(path):
+    conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True, timeout=storage.SQLITE_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _tables(conn):
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+
+
+def inspect(path):
+    """Integrity check, row counts and id high-water marks of a (copied) SQLite file"""
+    conn = _readonly(path)
+    try:
+        problems = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        tables = _tables(conn)
+        rows = {t: conn.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0] for t in tables}
+        high_water = {t: conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {t}').fetchone()[0]
+                      for t in CHANGELOG_TABLES if t in tables}
+    finally:
+        conn.close()
+    return {'integrity': 'ok' if problems == ['ok'] else problems, 'rows': rows, 'high_water': high_water}
+
+
+# ============================================
+# SNAPSHOTS
+# ============================================
+
+def list_snapshots(out_dir=BACKUP_DIR):
+    """Finished snapshots, oldest first"""
+    if not os.path.exists(out_dir):
+        return []
+    return sorted(name for name in os.listdir(out_dir)
+                  if os.path.exists(os.path.join(out_dir, name, MANIFEST)))
+
+
+def load_manifest(snapshot_dir):
+    with open(os.path.join(snapshot_dir, MANIFEST)) as f:
+        return json.load(f)
+
+
+def snapshot(out_dir=BACKUP_DIR, backend=None):
+    """Back up every database file into a new snapshot directory; returns its path"""
+    backend = backend or get_storage()
+    files = database_files(backend)
+    name = time.strftime(SNAPSHOT_FORMAT)
+    while os.path.exists(os.path.join(out_dir, name)):
+        time.sleep(1)
+        name = time.strftime(SNAPSHOT_FORMAT)
+    # Built under a hidden name and renamed when verified, so a crash never leaves a half snapshot
+    partial = os.path.join(out_dir, f".{name}.partial")
+    os.makedirs(partial)
+
+    manifest = {'created': datetime.now().isoformat(timespec='seconds'), 'database': backend.name, 'files': {}}
+    try:
+        for file_name, path in files:
+            if not os.path.exists(path):
+                raise BackupError(f"{path} does not exist")
+            target = os.path.join(partial, file_name)
+            info = copy_online(path, target)
+            info.update(inspect(target))
+            if info['integrity'] != 'ok':
+                raise BackupError(f"Integrity check failed for the copy of {path}: {info['integrity'][:5]}")
+            info['bytes'] = os.path.getsize(target)
+            info['sha256'] = _sha256(target)
+            manifest['files'][file_name] = info
+            print(f"   💾 {file_name}: {info['bytes'] // 1024} KB in {info['seconds']}s "
+                  f"({info['steps']} steps, {info['restarts']} restarts)")
+        with open(os.path.join(partial, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        final = os.path.join(out_dir, name)
+        os.replace(partial, final)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    return final
+
+
+def prune(out_dir=BACKUP_DIR, keep=KEEP_SNAPSHOTS, keep_daily=KEEP_DAILY):
+    """Delete snapshots outside the retention policy (and leftovers of interrupted runs); returns their names"""
+    snapshots = list_snapshots(out_dir)
+    kept = set(snapshots[-keep:]) if keep else set()
+    cutoff = (datetime.now() - timedelta(days=keep_daily)).strftime('%Y%m%d')
+    newest_per_day = {}
+    for name in snapshots:
+        newest_per_day[name[:8]] = name
+    kept.update(name for day, name in newest_per_day.items() if day > cutoff)
+
+    removed = [name for name in snapshots if name not in kept]
+    for name in removed:
+        shutil.rmtree(os.path.join(out_dir, name))
+    for name in os.listdir(out_dir) if os.path.exists(out_dir) else []:
+        if name.endswith('.partial'):
+            shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+    return removed
+
+
+# ============================================
+# CHANGELOG
+# ============================================
+
+CHANGELOG_STATE = "changelog.json"
+
+
+def write_changelog(out_dir=BACKUP_DIR, backend=None):
+    """
+    Record rows added since the latest snapshot (or its previous changelog)
+    in a new changes-*.jsonl.gz file next to it; returns (path or None, rows)
+    """
+    snapshots = list_snapshots(out_dir)
+    if not snapshots:
+        raise BackupError(f"No snapshot in {out_dir} to write a changelog for")
+    snapshot_dir = os.path.join(out_dir, snapshots[-1])
+    state_path = os.path.join(snapshot_dir, CHANGELOG_STATE)
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            marks = json.load(f)
+    else:
+        marks = {name: info['high_water'] for name, info in load_manifest(snapshot_dir)['files'].items()}
+
+    path = os.path.join(snapshot_dir, f"changes-{time.strftime(SNAPSHOT_FORMAT)}.jsonl.gz")
+    written = 0
+    with gzip.open(path + '.tmp', 'wt') as out:
+        for file_name, live_path in database_files(backend):
+            file_marks = marks.setdefault(file_name, {})
+            # Read-only, one short read per table: only rows past the mark (primary key range)
+            conn = _readonly(live_path)
+            try:
+                tables = set(_tables(conn))
+                for table in CHANGELOG_TABLES:
+                    if table not in tables:
+                        continue
+                    rows = conn.execute(f'SELECT * FROM {table} WHERE id > ? ORDER BY id',
+                                        (file_marks.get(table, 0),)).fetchall()
+                    for row in rows:
+                        out.write(json.dumps({'file': file_name, 'table': table, 'row': dict(row)}, default=str))
+                        out.write('\n')
+                    if rows:
+                        file_marks[table] = rows[-1]['id']
+                        written += len(rows)
+            finally:
+                conn.close()
+
+    if not written:
+        os.remove(path + '.tmp')
+        return None, 0
+    os.replace(path + '.tmp', path)
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(marks, f, indent=2)
+    os.replace(state_path + '.tmp', state_path)
+    return path, written
+
+
+def _replay(target_dir, changelog_path):
+    """Apply a changelog to restored files; returns rows inserted"""
+    connections, columns, inserted = {}, {}, 0
+    try:
+        with gzip.open(changelog_path, 'rt') as f:
+            for line in f:
+                change = json.loads(line)
+                file_name, table = change['file'], change['table']
+                conn = connections.get(file_name)
+                if conn is None:
+                    conn = connections[file_name] = storage._connect_sqlite(os.path.join(target_dir, file_name))
+                if (file_name, table) not in columns:
+                    columns[file_name, table] = {r[1] for r in conn.execute(f'PRAGMA table_info({table})')}
+                # Columns added by a migration after the snapshot are dropped
+                row = {k: v for k, v in change['row'].items() if k in columns[file_name, table]}
+                cursor = conn.execute(
+                    f"INSERT OR IGNORE INTO {table} ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                    list(row.values()))
+                inserted += cursor.rowcount
+        for conn in connections.values():
+            # Replayed readings bypassed the per-area aggregates: recompute them
+            if 'usage_delta' in storage.table_columns(conn, 'meter_readings'):
+                area_stats.rebuild(conn)
+            conn.commit()
+    finally:
+        for conn in connections.values():
+            conn.close()
+    return inserted
+
+
+# ============================================
+# RESTORE
+# ============================================
+
+def restore(snapshot_dir, target_dir, changelog=True):
+    """
+    Restore a snapshot (and its changelogs) into a new directory and verify it:
+    checksums of the copied files, integrity check, and no fewer rows than
+    the snapshot had. Returns a report; raises BackupError if verification fails.
+    """
+    if os.path.exists(target_dir) and os.listdir(target_dir):
+        raise ValueError(f"{target_dir} is not empty; restore into a fresh directory")
+    os.makedirs(target_dir, exist_ok=True)
+    manifest = load_manifest(snapshot_dir)
+    report = {'snapshot': os.path.basename(os.path.normpath(snapshot_dir)), 'target': target_dir,
+              'files': {}, 'changelogs': [], 'ok': True}
+
+    for file_name, info in manifest['files'].items():
+        target = os.path.join(target_dir, file_name)
+        shutil.copyfile(os.path.join(snapshot_dir, file_name), target)
+        checksum_ok = _sha256(target) == info['sha256']
+        report['files'][file_name] = {'checksum_ok': checksum_ok}
+        report['ok'] &= checksum_ok
+
+    if changelog and report['ok']:
+        for name in sorted(n for n in os.listdir(snapshot_dir) if n.startswith('changes-') and n.endswith('.gz')):
+            report['changelogs'].append({'file': name, 'rows': _replay(target_dir, os.path.join(snapshot_dir, name))})
+
+    for file_name, info in manifest['files'].items():
+        result = inspect(os.path.join(target_dir, file_name))
+        missing = {t: n for t, n in info['rows'].items() if result['rows'].get(t, 0) < n}
+        report['files'][file_name].update(integrity=result['integrity'], rows=result['rows'], missing_rows=missing)
+        report['ok'] &= result['integrity'] == 'ok' and not missing
+
+    if not report['ok']:
+        raise BackupError(f"Restore of {snapshot_dir} failed verification: {json.dumps(report['files'])}")
+    return report
+
+
+def run_schedule(out_dir, every_minutes, changelog_minutes=None):
+    """Snapshot (and prune) every `every_minutes`, with changelogs in between"""
+    tick = min(every_minutes, changelog_minutes or every_minutes) * 60
+    next_snapshot = time.monotonic()
+    while True:
+        try:
+            if time.monotonic() >= next_snapshot:
+                next_snapshot = time.monotonic() + every_minutes * 60
+                print(f"✅ Snapshot {snapshot(out_dir)}")
+                removed = prune(out_dir)
+                if removed:
+                    print(f"   🗑️  Pruned {len(removed)} old snapshots")
+            elif changelog_minutes:
+                path, rows = write_changelog(out_dir)
+                if path:
+                    print(f"   📝 {rows} new rows -> {path}")
+        except (BackupError, sqlite3.Error, OSError) as e:
+            # Keep the schedule running; the next tick tries again
+            print(f"❌ Backup failed: {e}")
+        time.sleep(tick)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Online snapshots, changelogs and verified restores of the database")
+    parser.add_argument('--out', default=BACKUP_DIR, help="Backup directory")
+    parser.add_argument('--every', type=float, metavar='MINUTES', help="Keep running: snapshot every N minutes")
+    parser.add_argument('--changelog-every', type=float, metavar='MINUTES',
+                        help="With --every: write a changelog of new rows every N minutes between snapshots")
+    parser.add_argument('--changelog', action='store_true', help="Write one changelog for the latest snapshot and exit")
+    parser.add_argument('--prune', action='store_true', help="Only apply the retention policy")
+    parser.add_argument('--list', action='store_true', help="List snapshots")
+    parser.add_argument('--restore', metavar='SNAPSHOT', help="Snapshot name (or 'latest') to restore and verify")
+    parser.add_argument('--to', help="Fresh directory for --restore")
+    parser.add_argument('--no-changelog', action='store_true', help="With --restore: don't replay changelogs")
+    args = parser.parse_args()
+
+    if hasattr(os, 'nice'):
+        os.nice(NICE)
+
+    if args.list:
+        for name in list_snapshots(args.out):
+            files = load_manifest(os.path.join(args.out, name))['files']
+            changelogs = sum(n.startswith('changes-') for n in os.listdir(os.path.join(args.out, name)))
+            print(f"{name}  {sum(f['bytes'] for f in files.values()) // 1024:>8} KB  "
+                  f"{len(files)} files  {changelogs} changelogs")
+    elif args.restore:
+        snapshots = list_snapshots(args.out)
+        name = snapshots[-1] if args.restore == 'latest' and snapshots else args.restore
+        if not args.to:
+            parser.error("--restore needs --to DIRECTORY")
+        report = restore(os.path.join(args.out, name), args.to, not args.no_changelog)
+        replayed = sum(c['rows'] for c in report['changelogs'])
+        print(f"✅ Restored {name} into {args.to}: checksums and integrity ok, "
+              f"{replayed} rows replayed from {len(report['changelogs'])} changelogs")
+    elif args.changelog:
+        path, rows = write_changelog(args.out)
+        print(f"✅ {rows} new rows -> {path}" if path else "✅ No new rows since the last snapshot or changelog")
+    elif args.prune:
+        print(f"✅ Pruned {len(prune(args.out))} snapshots")
+    elif args.every:
+        print(f"🗄️  Backing up {get_storage().name} into {args.out} every {args.every:g} minutes")
+        run_schedule(args.out, args.every, args.changelog_every)
+    else:
+        path = snapshot(args.out)
+        prune(args.out)
+        print(f"✅ Snapshot {path}")
@@ -0,0 +1,418 @@
+"""
+AquaGuard AI - Batch Scorer
+Runs quality and/or meter inference over a directory tree or zip archive of
+historical photos on every core, and writes the results to CSV / NDJSON or
+straight into the database.
+
+Work is split into fixed chunks of images. Each worker process loads the model
+once and scores a whole chunk with one predict_proba call. Finished chunks are
+recorded in a checkpoint, so re-running the same command after an interruption
+continues where it stopped.
+
+Usage:
+    python batch_score.py archive.zip --task both --output results.csv
+    python batch_score.py /data/photos --task quality --db --user 1
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import signal
+import hashlib
+import zipfile
+import threading
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from inference import get_model, MODEL_PATH
+
+# 🔧 CONFIGURATION
+CHUNK_SIZE = 64           # Images per unit of work (and per DB transaction)
+IN_FLIGHT_PER_WORKER = 2  # Chunks queued per worker; bounds memory on huge jobs
+PROGRESS_SECONDS = 5
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+FIELDS = ['source', 'taken_at', 'safety_status', 'safety_score', 'unsafe_probability',
+          'mean_hue', 'mean_saturation', 'mean_value', 'texture_score', 'meter_reading', 'error']
+
+
+# ============================================
+# INPUT
+# ============================================
+
+def list_images(source):
+    """Image names in a stable order (paths for a directory, member names for a zip)"""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            names = [n for n in zf.namelist() if n.lower().endswith(IMAGE_EXTENSIONS)]
+    else:
+        names = []
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            names.extend(os.path.join(dirpath, f) for f in sorted(filenames)
+                         if f.lower().endswith(IMAGE_EXTENSIONS))
+    names.sort()
+    return names
+
+
+# ============================================
+# WORKERS
+# ============================================
+
+_zip = None
+
+
+def _init_worker(source, tasks):
+    global _zip
+    # Ctrl+C reaches the whole process group: the parent stops the job after
+    # the chunks in flight, so workers must not die with a KeyboardInterrupt
+    # (spawn/forkserver workers don't inherit the parent's handler)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import cv2
+    # One process per core already; OpenCV's own thread pool would oversubscribe
+    cv2.setNumThreads(1)
+    if 'quality' in tasks:
+        # Forked workers already hold the parent's copy; spawned ones load their own
+        get_model()
+    if zipfile.is_zipfile(source):
+        _zip = zipfile.ZipFile(source)
+
+
+def _read(name):
+    """(raw bytes, timestamp) of one image, the timestamp in naive UTC like CURRENT_TIMESTAMP"""
+    if _zip is not None:
+        info = _zip.getinfo(name)
+        # Zip entries carry local wall-clock time: taken as this host's zone
+        taken_at = datetime(*info.date_time).astimezone(timezone.utc)
+        return _zip.read(info), taken_at.replace(tzinfo=None)
+    with open(name, 'rb') as f:
+        return f.read(), datetime.fromtimestamp(os.path.getmtime(name), timezone.utc).replace(tzinfo=None)
+
+
+def score_chunk(names, tasks):
+    """Score one chunk of images; returns one result dict per image"""
+    import cv2
+    import numpy as np
+    from quality_model import features_from_array
+    from ocr_model import read_meter, extract_value_from_filename
+
+    rows, features, feature_rows = [], [], []
+    for name in names:
+        row = dict.fromkeys(FIELDS)
+        row['source'] = name
+        try:
+            data, taken_at = _read(name)
+            row['taken_at'] = taken_at.strftime("%Y-%m-%d %H:%M:%S")
+
+            # Meter photos named with their value never need decoding
+            img = None
+            if 'quality' in tasks or extract_value_from_filename(os.path.basename(name)) is None:
+                img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                if img is None:
+                    raise ValueError("could not decode image")
+
+            if 'quality' in tasks:
+                f = features_from_array(img)
+                row.update(zip(FIELDS[5:9], (float(v) for v in f)))
+                features.append(f)
+                feature_rows.append(row)
+            if 'meter' in tasks:
+                row['meter_reading'] = read_meter(name, image=img, verbose=False)
+        except Exception as e:
+            row['error'] = str(e)
+        rows.append(row)
+
+    if features:
+        model = get_model()
+        probabilities = model.predict_proba(features)
+        unsafe_col = list(model.classes_).index(1)
+        for row, p in zip(feature_rows, probabilities):
+            confidence = float(max(p)) * 100
+            if p.argmax() == unsafe_col:
+                row['safety_status'], row['safety_score'] = 'UNSAFE', int(100 - confidence)
+            else:
+                row['safety_status'], row['safety_score'] = 'SAFE', int(confidence)
+            row['unsafe_probability'] = round(float(p[unsafe_col]), 4)
+    return rows
+
+
+def failed_rows(names, error):
+    """One error row per image of a chunk that could not be scored as a whole"""
+    rows = []
+    for name in names:
+        row = dict.fromkeys(FIELDS)
+        row['source'], row['error'] = name, f"chunk failed: {error}"
+        rows.append(row)
+    return rows
+
+
+# ============================================
+# OUTPUT + CHECKPOINTS
+# ============================================
+
+class FileSink:
+    """
+    CSV or NDJSON output. The checkpoint file (<output>.checkpoint) stores the
+    job description and, per finished chunk, the output size after writing it;
+    on resume the output is truncated to the last recorded size so a chunk that
+    was half-written when the job died is not duplicated.
+    """
+
+    def __init__(self, path, job):
+        self.path = path
+        self.ndjson = path.endswith(('.ndjson', '.jsonl'))
+        self.checkpoint_path = path + '.checkpoint'
+        self.done = set()
+
+        if os.path.exists(self.checkpoint_path) and os.path.exists(path):
+            with open(self.checkpoint_path) as f:
+                header = json.loads(f.readline())
+                if header['job'] != job:
+                    sys.exit(f"❌ {self.checkpoint_path} belongs to a different job; use --restart")
+                end = header['offset']
+                for line in f:
+                    chunk, offset = line.split()
+                    self.done.add(int(chunk))
+                    end = int(offset)
+            self.out = open(path, 'r+', newline='')
+            self.out.truncate(end)
+            self.out.seek(end)
+            self.checkpoint = open(self.checkpoint_path, 'a')
+        else:
+            self.out = open(path, 'w', newline='')
+            if not self.ndjson:
+                csv.writer(self.out).writerow(FIELDS)
+                self.out.flush()
+            self.checkpoint = open(self.checkpoint_path, 'w')
+            self.checkpoint.write(json.dumps({'job': job, 'offset': self.out.tell()}) + '\n')
+            self.checkpoint.flush()
+
+        self.writer = None if self.ndjson else csv.DictWriter(self.out, FIELDS)
+
+    def write(self, chunk, rows):
+        if self.ndjson:
+            self.out.writelines(json.dumps(row) + '\n' for row in rows)
+        else:
+            self.writer.writerows(rows)
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        self.checkpoint.write(f"{chunk} {self.out.tell()}\n")
+        self.checkpoint.flush()
+
+    def close(self):
+        self.out.close()
+        self.checkpoint.close()
+
+
+def job_key(job):
+    return hashlib.sha256(job.encode()).hexdigest()[:16]
+
+
+class DbSink:
+    """Inserts readings in one transaction per chunk, together with its checkpoint row"""
+
+    def __init__(self, job, user_id, meter_id='', location=None):
+        from database import init_db, get_db, get_user_settings
+        from http_cache import bump_version
+        init_db()
+        self.get_db = get_db
+        self.bump_version = bump_version
+        self.job = job_key(job)
+        self.user_id = user_id
+        self.meter_id = meter_id or ''   # Like the web form: '' is the unnamed meter
+        self.location = location
+        settings = get_user_settings(user_id)
+        self.eco_limit = settings['eco_limit'] if settings else 14500
+        self.meter_rows = 0
+
+        conn = get_db(user_id)
+        self.done = {r['chunk'] for r in conn.execute(
+            'SELECT chunk FROM batch_checkpoints WHERE job = ?', (self.job,))}
+        conn.close()
+
+    def write(self, chunk, rows):
+        import area_stats
+        conn = self.get_db(self.user_id)
+        key = area_stats.location_key(self.location)
+        quality_ids, meter_ids = [], []
+        try:
+            # usage_delta reads the meter's previous reading: serialize with the app's writers
+            conn.begin_write(f'meter_readings-{self.user_id}')
+            cursor = conn.cursor()
+            for row in rows:
+                if row['error']:
+                    continue
+                notes = f"Batch import: {row['source']}"
+                if row['safety_status']:
+                    cursor.execute('''
+                        INSERT INTO quality_readings
+                        (user_id, timestamp, safety_status, safety_score, mean_hue, mean_saturation,
+                         mean_value, texture_score, alert_level, location, location_key, notes)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (self.user_id, row['taken_at'], row['safety_status'], row['safety_score'],
+                          row['mean_hue'], row['mean_saturation'], row['mean_value'], row['texture_score'],
+                          'HIGH' if row['safety_status'] == 'UNSAFE' else 'NONE', self.location, key, notes))
+                    quality_ids.append(cursor.lastrowid)
+                    if row['safety_status'] == 'UNSAFE':
+                        # Historical alerts are recorded already read so they don't flood the dashboard
+                        cursor.execute('''
+                            INSERT INTO alerts (user_id, alert_type, alert_message, severity,
+                                                timestamp, is_read, related_reading_id, quality_reading_id)
+                            VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+                        ''', (self.user_id, 'WATER_QUALITY', 'Unsafe water detected! Boil water before use.',
+                              'HIGH', row['taken_at'], cursor.lastrowid, cursor.lastrowid))
+                if row['meter_reading'] and row['meter_reading'].isdigit():
+                    value = int(row['meter_reading'])
+                    is_high = value > self.eco_limit
+                    cursor.execute('''
+                        INSERT INTO meter_readings
+                        (user_id, timestamp, reading_value, is_high_usage, conservation_tip, meter_id,
+                         location, location_key)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (self.user_id, row['taken_at'], value, is_high,
+                          "High consumption detected. Check for leaks immediately." if is_high
+                          else "Great job! Your usage is within eco-limits.",
+                          self.meter_id, self.location, key))
+                    meter_ids.append(cursor.lastrowid)
+                    self.meter_rows += 1
+            # One grouped update of the area aggregates per chunk
+            area_stats.add_readings(conn, 'quality', quality_ids)
+            area_stats.add_readings(conn, 'meter', meter_ids)
+            cursor.execute('INSERT INTO batch_checkpoints (job, chunk) VALUES (?, ?)', (self.job, chunk))
+            conn.commit()
+            self.bump_version(self.user_id)
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def close(self):
+        if self.meter_rows:
+            # Spike / leak scoring needs the whole imported history in order
+            from usage_analytics import backfill
+            backfill(self.user_id)
+
+
+# ============================================
+# DRIVER
+# ============================================
+
+def run(source, tasks, sink, names, chunk_size=CHUNK_SIZE, workers=None):
+    """Score every chunk not yet in the checkpoint. Returns False if stopped early by Ctrl+C."""
+    chunks = [names[i:i + chunk_size] for i in range(0, len(names), chunk_size)]
+    todo = iter([i for i in range(len(chunks)) if i not in sink.done])
+    remaining = len(chunks) - len(sink.done)
+    if sink.done:
+        print(f"↩️  Resuming: {len(sink.done)} of {len(chunks)} chunks already done")
+
+    # First Ctrl+C: stop handing out chunks, finish and record the ones in flight
+    stopping = threading.Event()
+    previous_handler = signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    if 'quality' in tasks and get_model() is None:
+        raise FileNotFoundError(f"No trained model at {MODEL_PATH}; run train_model.py first")
+
+    workers = workers or os.cpu_count()
+    scored = errors = 0
+    broken = None
+    started = last_report = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(source, tasks)) as pool:
+            pending = {}
+
+            def submit_next():
+                i = None if stopping.is_set() or broken else next(todo, None)
+                if i is not None:
+                    pending[pool.submit(score_chunk, chunks[i], tasks)] = i
+
+            for _ in range(workers * IN_FLIGHT_PER_WORKER):
+                submit_next()
+            while pending:
+                finished, _ = wait(pending, timeout=PROGRESS_SECONDS, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    chunk = pending.pop(future)
+                    try:
+                        rows = future.result()
+                    except BrokenProcessPool as e:
+                        # A worker died: every chunk in flight is lost. Record the ones
+                        # that finished, then stop; the lost ones aren't checkpointed,
+                        # so re-running the command scores them again
+                        broken = broken or e
+                        continue
+                    except Exception as e:
+                        rows = failed_rows(chunks[chunk], e)
+                    sink.write(chunk, rows)
+                    scored += len(rows)
+                    errors += sum(1 for r in rows if r['error'])
+                    remaining -= 1
+                    submit_next()
+
+                now = time.perf_counter()
+                if now - last_report >= PROGRESS_SECONDS:
+                    last_report = now
+                    rate = scored / (now - started)
+                    eta = remaining * chunk_size / rate if rate else 0
+                    print(f"   📦 {scored} images ({rate:.0f}/s), {remaining} chunks left, ETA {eta / 60:.1f} min")
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        sink.close()
+    if broken:
+        print(f"❌ A worker process died; {remaining} chunks left. Re-run the same command to resume.")
+        raise broken
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Scored {scored} images in {elapsed:.1f}s ({scored / elapsed if elapsed else 0:.0f}/s), "
+          f"{errors} errors")
+    if stopping.is_set() and remaining:
+        print(f"⏹️  Stopped with {remaining} chunks left. Re-run the same command to resume.")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a directory or zip of photos in parallel")
+    parser.add_argument('source', help="Directory tree or .zip archive")
+    parser.add_argument('--task', choices=['quality', 'meter', 'both'], default='quality')
+    parser.add_argument('--output', help="Results file (.csv, or .ndjson / .jsonl)")
+    parser.add_argument('--db', action='store_true', help="Insert readings into the database instead")
+    parser.add_argument('--user', type=int, help="Owner of the readings (with --db)")
+    parser.add_argument('--meter-id', help="Meter the photos belong to (with --db)")
+    parser.add_argument('--location', help="Location recorded on the readings (with --db)")
+    parser.add_argument('--workers', type=int, default=None, help="Processes (default: all cores)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    if bool(args.output) == args.db:
+        parser.error("choose exactly one of --output or --db")
+    if args.db and args.user is None:
+        parser.error("--db needs --user")
+
+    tasks = ('quality', 'meter') if args.task == 'both' else (args.task,)
+    names = list_images(args.source)
+    print(f"🔎 {len(names)} images in {args.source}")
+
+    # Resuming is only valid for the same input split into the same chunks
+    job = json.dumps({'source': os.path.abspath(args.source), 'tasks': tasks, 'count': len(names),
+                      'chunk_size': args.chunk_size, 'user': args.user}, sort_keys=True)
+    if args.db:
+        if args.restart:
+            from database import get_db
+            conn = get_db(args.user)
+            conn.execute('DELETE FROM batch_checkpoints WHERE job = ?', (job_key(job),))
+            conn.commit()
+            conn.close()
+        sink = DbSink(job, args.user, args.meter_id, args.location)
+    else:
+        if args.restart and os.path.exists(args.output + '.checkpoint'):
+            os.remove(args.output + '.checkpoint')
+        sink = FileSink(args.output, job)
+
+    if not run(args.source, tasks, sink, names, args.chunk_size, args.workers):
+        sys.exit(130)
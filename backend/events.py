@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import queue
+import select
+import threading
+
+# Pub/sub for live dashboard updates (Server-Sent Events).
+#
+# Each connected browser gets a small bounded queue in the process serving
+# its stream. A reading saved in another worker (or on another host) still
+# has to reach it, so publish() never delivers directly: it hands the event
+# to a transport shared by every process, and one relay thread per process
+# feeds what arrives to that process's local streams.
+#
+# - PostgreSQL: NOTIFY on one channel, relayed by a LISTEN connection
+#   (works across hosts).
+# - SQLite (one host): an append-only journal file that the relay tails.
+#
+# An open stream holds its connection for as long as the page is open, so
+# streams are only served by servers that don't give each request an OS
+# thread from a small fixed pool (gevent workers, or the threaded dev
+# server). serve.py turns them off for gthread/sync workers and waitress;
+# dashboards then just don't get live updates.
+
+# 🔧 CONFIGURATION
+STREAMING = os.environ.get('AQUAGUARD_SSE', '1') != '0'
+QUEUE_SIZE = 100          # Pending events per connection before the oldest are dropped
+HEARTBEAT_SECONDS = 15    # Keep-alive comment interval (also detects closed clients)
+EVENT_LOG = os.environ.get('AQUAGUARD_EVENT_LOG', "../data/events.log")
+EVENT_LOG_MAX_BYTES = 1024 * 1024   # The journal is rotated to EVENT_LOG + '.1' past this size
+POLL_SECONDS = 0.25       # How often the relay looks for new journal lines
+PG_CHANNEL = 'aquaguard_events'
+PG_MAX_PAYLOAD = 7900     # NOTIFY payloads are limited to 8000 bytes
+
+
+def format_event(event, data):
+    """Serialize one SSE frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class EventBroker:
+    """Fan-out to the streams open in this process"""
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}  # user_id -> set of queues
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            subs = self._subscribers.get(user_id)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    del self._subscribers[user_id]
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscribers
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def publish(self, user_id, frame):
+        """Push an SSE frame to every open stream of a user in this process"""
+        with self._lock:
+            subs = list(self._subscribers.get(user_id, ()))
+        for q in subs:
+            try:
+                q.put_nowait(frame)
+            except queue.Full:
+                # Slow client: drop its oldest event rather than block the relay
+                try:
+                    q.get_nowait()
+                    q.put_nowait(frame)
+                except (queue.Empty, queue.Full):
+                    pass
+        return len(subs)
+
+    def stream(self, user_id, heartbeat=HEARTBEAT_SECONDS):
+        """Generator of SSE frames for one connection"""
+        _start_relay()
+        q = self.subscribe(user_id)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(user_id, q)
+
+
+broker = EventBroker()
+
+
+# ============================================
+# TRANSPORTS (shared by every process)
+# ============================================
+
+def _dsn():
+    """PostgreSQL DSN of the configured database, or None for SQLite"""
+    import database
+    backend = database.get_storage()
+    return backend.dsn if backend.name == 'postgresql' else None
+
+
+class _journal_lock:
+    """Exclusive lock on the journal across processes (a thread lock where flock is missing)"""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def __enter__(self):
+        _write_lock.acquire()
+        if _flock:
+            _flock(self.fd, _LOCK_EX)
+
+    def __exit__(self, *exc):
+        if _flock:
+            _flock(self.fd, _LOCK_UN)
+        _write_lock.release()
+
+
+try:
+    from fcntl import flock as _flock, LOCK_EX as _LOCK_EX, LOCK_UN as _LOCK_UN
+except ImportError:   # Windows: waitress runs a single process
+    _flock = None
+_write_lock = threading.Lock()
+
+
+def _append_journal(line):
+    os.makedirs(os.path.dirname(EVENT_LOG) or '.', exist_ok=True)
+    # Opened by path each time, under the lock that also guards rotation,
+    # so nothing is ever appended to a file the relays have moved past
+    fd = os.open(EVENT_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        with _journal_lock(fd):
+            if os.fstat(fd).st_size >= EVENT_LOG_MAX_BYTES:
+                os.replace(EVENT_LOG, EVENT_LOG + '.1')
+                os.close(fd)
+                fd = os.open(EVENT_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(fd, line.encode() + b'\n')
+    finally:
+        os.close(fd)
+
+
+def _notify(line):
+    import database
+    if len(line.encode()) > PG_MAX_PAYLOAD:
+        print(f"⚠️ Live event too large for NOTIFY, not sent ({len(line)} bytes)")
+        return
+    conn = database.get_db()
+    try:
+        conn.execute('SELECT pg_notify(?, ?)', (PG_CHANNEL, line))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def publish(user_id, event, data):
+    """Send an event to the user's open streams, in whichever process or host serves them"""
+    if not STREAMING:
+        return
+    line = json.dumps({'user_id': user_id, 'frame': format_event(event, data)})
+    try:
+        if _dsn():
+            _notify(line)
+        else:
+            _append_journal(line)
+    except Exception as e:
+        # Live updates are best effort: never fail the write that triggered them
+        print(f"⚠️ Live event not sent: {e}")
+
+
+def _deliver(line):
+    try:
+        message = json.loads(line)
+    except ValueError:
+        return   # A line cut short by a crash mid-write
+    if broker.has_subscribers(message['user_id']):
+        broker.publish(message['user_id'], message['frame'])
+
+
+def _deliver_all(text):
+    for line in text.split('\n'):
+        if line:
+            _deliver(line)
+
+
+def _tail_journal():
+    """Relay journal lines appended from now on (following rotation)"""
+    started = time.time()
+    f, inode, partial = None, None, ''
+    if os.path.exists(EVENT_LOG):
+        # Only what is written after this process starts streaming
+        f = open(EVENT_LOG)
+        f.seek(0, os.SEEK_END)
+        inode = os.fstat(f.fileno()).st_ino
+    while True:
+        try:
+            chunk = f.read() if f is not None else ''
+            if chunk:
+                lines = (partial + chunk).split('\n')
+                partial = lines.pop()
+                _deliver_all('\n'.join(lines))
+            elif os.path.exists(EVENT_LOG) and (f is None or os.stat(EVENT_LOG).st_ino != inode):
+                # Created or rotated. Nothing is written to the old file after a rotation, so finish it.
+                if f is not None:
+                    _deliver_all(partial + f.read())
+                # A generation that was created and rotated away since the last poll is EVENT_LOG.1
+                # (it can't share the inode of the file still open here)
+                if os.path.exists(EVENT_LOG + '.1'):
+                    with open(EVENT_LOG + '.1') as skipped:
+                        stat = os.fstat(skipped.fileno())
+                        if stat.st_ino != inode and stat.st_mtime >= started:
+                            _deliver_all(skipped.read())
+                if f is not None:
+                    f.close()
+                f, partial = open(EVENT_LOG), ''
+                inode = os.fstat(f.fileno()).st_ino
+                continue
+        except OSError as e:
+            print(f"⚠️ Event journal: {e}")
+            time.sleep(5)
+        time.sleep(POLL_SECONDS)
+
+
+def _listen(dsn):
+    """Relay NOTIFY messages, reconnecting if the connection drops"""
+    import psycopg2
+    import psycopg2.extensions
+
+    while True:
+        try:
+            conn = psycopg2.connect(dsn)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f"LISTEN {PG_CHANNEL}")
+            while True:
+                if select.select([conn], [], [], HEARTBEAT_SECONDS) != ([], [], []):
+                    conn.poll()
+                    while conn.notifies:
+                        _deliver(conn.notifies.pop(0).payload)
+        except psycopg2.Error as e:
+            print(f"⚠️ Event listener: {e}")
+            time.sleep(5)
+
+
+_relay_pid = None
+_relay_lock = threading.Lock()
+
+
+def _start_relay():
+    """One relay thread per process, started with its first stream"""
+    global _relay_pid
+    if _relay_pid == os.getpid():
+        return
+    with _relay_lock:
+        if _relay_pid != os.getpid():
+            dsn = _dsn()
+            target, args = (_listen, (dsn,)) if dsn else (_tail_journal, ())
+            threading.Thread(target=target, args=args, name='event-relay', daemon=True).start()
+            _relay_pid = os.getpid()
@@ -0,0 +1,340 @@
+import os
+import glob
+import gzip
+import time
+import mmap
+import struct
+import select
+import threading
+from datetime import date
+from functools import wraps
+
+try:
+    import brotli  # Optional: pip install Brotli
+except ImportError:
+    brotli = None
+
+# Conditional responses and compression for per-user pages and JSON.
+#
+# Every user has a data version that database.py bumps after each committed
+# write to their readings, alerts or settings. Cached views get an ETag built
+# from that version, so a browser revalidating with If-None-Match gets a 304
+# without the view (or the database) being touched.
+#
+# Versions live in a small memory-mapped file shared by every worker process
+# on the host (and by batch jobs writing to the same database). Users hash to
+# slots, so two users sharing a slot only cost each other a cache miss. The
+# file starts with a random epoch that is part of every ETag: deleting the
+# file can never make an old ETag match again.
+#
+# With PostgreSQL, workers may run on several hosts that don't share that
+# file, so the counters are kept in the data_versions table instead (one row
+# per user, row 0 for the global generation and epoch). Each process caches
+# the rows it has read, and every bump sends a NOTIFY that drops the cached
+# row in every process (all of them, for row 0), so revalidations still don't
+# touch the database. Until a process's LISTEN connection is up, or while it
+# is reconnecting, versions are read from the table on every request.
+
+# 🔧 CONFIGURATION
+VERSION_FILE = "../data/data_versions.bin"
+VERSION_SLOTS = 65536
+COMPRESS_MIN_BYTES = 1024     # Smaller responses are sent as they are
+COMPRESS_TYPES = ('application/json', 'text/html', 'text/plain', 'text/csv')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+PG_CHANNEL = 'aquaguard_versions'
+TEMPLATE_DIR = "../templates"
+
+_HEADER = struct.Struct('<QQQ')   # epoch, global generation, global change time
+_SLOT = struct.Struct('<QQ')      # version, change time (unix seconds)
+
+_map = None
+_map_fd = None
+_map_pid = None
+_lock = threading.Lock()
+
+
+def _open():
+    """Map the version file (once per process; a forked worker maps its own)"""
+    global _map, _map_fd, _map_pid
+    if _map is not None and _map_pid == os.getpid():
+        return _map
+    with _lock:
+        if _map is not None and _map_pid == os.getpid():
+            return _map
+        os.makedirs(os.path.dirname(VERSION_FILE) or '.', exist_ok=True)
+        size = _HEADER.size + VERSION_SLOTS * _SLOT.size
+        fd = os.open(VERSION_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        with _file_lock(fd):
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+                epoch = int.from_bytes(os.urandom(8), 'little')
+                os.lseek(fd, 0, os.SEEK_SET)   # (no os.pwrite on Windows)
+                os.write(fd, _HEADER.pack(epoch, 0, int(time.time())))
+        _map, _map_fd, _map_pid = mmap.mmap(fd, size), fd, os.getpid()
+        return _map
+
+
+class _file_lock:
+    """Exclusive lock on the version file across processes (a thread lock where flock is missing)"""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def __enter__(self):
+        _write_lock.acquire()
+        if _flock:
+            _flock(self.fd, _LOCK_EX)
+
+    def __exit__(self, *exc):
+        if _flock:
+            _flock(self.fd, _LOCK_UN)
+        _write_lock.release()
+
+
+try:
+    from fcntl import flock as _flock, LOCK_EX as _LOCK_EX, LOCK_UN as _LOCK_UN
+except ImportError:   # Windows: waitress runs a single process
+    _flock = None
+_write_lock = threading.Lock()
+
+
+# ============================================
+# POSTGRESQL COUNTERS
+# ============================================
+
+def _database():
+    """The database module when versions are kept in PostgreSQL, else None"""
+    import database
+    return database if database.get_storage().name == 'postgresql' else None
+
+
+def create_tables(conn):
+    """The data_versions table (PostgreSQL only), with a random epoch in row 0"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id BIGINT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            changed BIGINT NOT NULL DEFAULT 0,
+            epoch BIGINT
+        )
+    ''')
+    conn.execute('INSERT INTO data_versions (user_id, changed, epoch) VALUES (0, ?, ?) ON CONFLICT DO NOTHING',
+                 (int(time.time()), int.from_bytes(os.urandom(7), 'little')))
+
+
+_cached = {}                # user_id -> data_version() result, while the listener is up
+_invalidations = 0          # Bumped whenever cached rows are dropped
+_listener_ready = threading.Event()
+_listener_pid = None
+
+
+def _invalidate(user_id):
+    global _invalidations
+    with _lock:
+        _invalidations += 1
+        if user_id == 0:
+            _cached.clear()
+        else:
+            _cached.pop(user_id, None)
+
+
+def _bump_row(database, user_id):
+    conn = database.get_db()
+    try:
+        conn.execute('''
+            INSERT INTO data_versions (user_id, version, changed) VALUES (?, 1, ?)
+            ON CONFLICT (user_id) DO UPDATE SET version = data_versions.version + 1, changed = excluded.changed
+        ''', (user_id, int(time.time())))
+        # Delivered to every listening process when this commits
+        conn.execute('SELECT pg_notify(?, ?)', (PG_CHANNEL, str(user_id)))
+        conn.commit()
+    finally:
+        conn.close()
+    _invalidate(user_id)
+
+
+def _listen(dsn):
+    """Drop cached rows named by NOTIFY messages, reconnecting if the connection drops"""
+    import psycopg2
+    import psycopg2.extensions
+
+    while True:
+        try:
+            conn = psycopg2.connect(dsn)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f"LISTEN {PG_CHANNEL}")
+            # Bumps missed while not listening: start from an empty cache
+            _invalidate(0)
+            _listener_ready.set()
+            while True:
+                if select.select([conn], [], [], 60) != ([], [], []):
+                    conn.poll()
+                    while conn.notifies:
+                        _invalidate(int(conn.notifies.pop(0).payload))
+        except (psycopg2.Error, ValueError) as e:
+            _listener_ready.clear()
+            _invalidate(0)
+            print(f"⚠️ Version listener: {e}")
+            time.sleep(5)
+
+
+def _start_listener(database):
+    """One listener thread per process, started with its first revalidation"""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _lock:
+        if _listener_pid != os.getpid():
+            _listener_ready.clear()
+            _cached.clear()
+            threading.Thread(target=_listen, args=(database.get_storage().dsn,),
+                             name='version-listener', daemon=True).start()
+            _listener_pid = os.getpid()
+
+
+def _cached_rows(database, user_id):
+    _start_listener(database)
+    if not _listener_ready.is_set():
+        return _read_rows(database, user_id)
+    cached = _cached.get(user_id)
+    if cached is not None:
+        return cached
+    # Only cache what was read if no bump arrived meanwhile
+    invalidations = _invalidations
+    rows = _read_rows(database, user_id)
+    with _lock:
+        if invalidations == _invalidations and _listener_ready.is_set():
+            _cached[user_id] = rows
+    return rows
+
+
+def _read_rows(database, user_id):
+    conn = database.get_db(readonly=True)
+    try:
+        rows = {row[0]: row[1:] for row in conn.execute(
+            'SELECT user_id, version, changed, epoch FROM data_versions WHERE user_id IN (0, ?)', (user_id,))}
+    finally:
+        conn.close()
+    generation, changed_all, epoch = rows.get(0, (0, 0, 0))
+    version, changed, _ = rows.get(int(user_id), (0, 0, None))
+    return int(epoch or 0), int(generation), int(changed_all), int(version), int(changed)
+
+
+# ============================================
+# VERSION FILE
+# ============================================
+
+def _slot_offset(user_id):
+    return _HEADER.size + (int(user_id) % VERSION_SLOTS) * _SLOT.size
+
+
+def bump_version(user_id):
+    """Call after committing a change to this user's data"""
+    database = _database()
+    if database:
+        return _bump_row(database, user_id)
+    mm = _open()
+    offset = _slot_offset(user_id)
+    with _file_lock(_map_fd):
+        version, _ = _SLOT.unpack_from(mm, offset)
+        _SLOT.pack_into(mm, offset, version + 1, int(time.time()))
+
+
+def bump_all():
+    """Call after a change that may touch any user's data (backfills, migrations)"""
+    database = _database()
+    if database:
+        return _bump_row(database, 0)
+    mm = _open()
+    with _file_lock(_map_fd):
+        epoch, generation, _ = _HEADER.unpack_from(mm, 0)
+        _HEADER.pack_into(mm, 0, epoch, generation + 1, int(time.time()))
+
+
+def data_version(user_id):
+    """(ETag fragment, last change time) of a user's data"""
+    database = _database()
+    if database:
+        epoch, generation, changed_all, version, changed = _cached_rows(database, int(user_id))
+    else:
+        mm = _open()
+        epoch, generation, changed_all = _HEADER.unpack_from(mm, 0)
+        version, changed = _SLOT.unpack_from(mm, _slot_offset(user_id))
+    return f"{epoch:x}.{generation}.{user_id}.{version}", max(changed, changed_all)
+
+
+def _build_time():
+    # Pages also change when the code or templates do
+    files = glob.glob(os.path.join(TEMPLATE_DIR, '*.html')) + glob.glob('*.py')
+    return int(max((os.path.getmtime(f) for f in files), default=0))
+
+
+BUILD_TIME = _build_time()
+
+
+# ============================================
+# FLASK INTEGRATION
+# ============================================
+
+def conditional(get_user):
+    """
+    View decorator for GET views whose output only depends on the user's data
+    (and the date): adds ETag/Last-Modified and answers revalidations with 304.
+    get_user() returns the caller's user id; anonymous requests pass straight through.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import request, make_response
+
+            user_id = get_user()
+            if user_id is None or request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+
+            # Read before running the view, so the data sent is never older than its tag
+            version, changed = data_version(user_id)
+            today = date.today()
+            etag = f"{version}.{BUILD_TIME:x}.{today:%Y%m%d}"
+            last_modified = max(changed, BUILD_TIME, int(time.mktime(today.timetuple())))
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = since is not None and last_modified <= since.timestamp()
+            if not_modified:
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)   # Weak: still valid once compressed
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+
+def compress(response):
+    """after_request hook: brotli or gzip for large text responses the client accepts"""
+    from flask import request
+
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli and accepted.quality('br') > 0:
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted.quality('gzip') > 0:
+        response.set_data(gzip.compress(data, GZIP_LEVEL, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,170 @@
+import time
+import struct
+
+# Cheap pre-check for uploads, run before OCR / feature extraction.
+# Works on a small grayscale copy (JPEGs are decoded straight at 1/2-1/8 scale),
+# so a photo that can't give a usable result is turned away in a few ms
+# with advice on how to retake it.
+
+# 🔧 CONFIGURATION
+ANALYSIS_SIZE = 256       # Longest edge the checks run at
+GLARE_LEVEL = 250         # Gray level counted as blown-out highlight
+
+# Thresholds per upload type (None = check disabled)
+RULES = {
+    # Water samples are often bright (white containers) and clear water has
+    # little texture, so only unusable images are rejected and blur just warns.
+    'quality': {
+        'min_side': 100,
+        'min_brightness': 25, 'max_brightness': 252,
+        'warn_glare': 0.9, 'reject_glare': 0.98,
+        'warn_sharpness': 20, 'reject_sharpness': None,
+    },
+    # Meter digits must be sharp and unobscured for OCR.
+    'meter': {
+        'min_side': 200,
+        'min_brightness': 12, 'max_brightness': 235,
+        'warn_glare': 0.05, 'reject_glare': 0.25,
+        'warn_sharpness': 80, 'reject_sharpness': 40,
+    },
+}
+
+# Size the upload pages shrink photos to before sending (served by /api/upload_settings).
+# Quality features are computed at 300x300, but the model was trained on ~1280px photos
+# and the texture score depends on the source size, so photos are kept near that.
+UPLOAD_TARGETS = {
+    'quality': {'max_edge': 1280, 'jpeg_quality': 0.9, 'max_bytes': 600_000},
+    'meter': {'max_edge': 1600, 'jpeg_quality': 0.92, 'max_bytes': 900_000},
+}
+
+MESSAGES = {
+    'unreadable': "The file is not a readable image. Please upload a JPG or PNG photo.",
+    'resolution': "The photo is too small ({width}x{height}). Move closer or use a higher camera resolution.",
+    'dark': "The photo is too dark. Turn on a light or move to a brighter spot.",
+    'bright': "The photo is overexposed. Avoid direct sunlight or turn off the flash.",
+    'glare': "Glare covers {glare:.0%} of the photo. Tilt the camera to avoid reflections.",
+    'blur': "The photo is blurry. Hold the camera steady and tap to focus before shooting.",
+}
+
+
+def image_size(data):
+    """(width, height) from the JPEG/PNG header without decoding, or None"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        # Start-of-frame markers (excluding DHT/JPG/DAC) carry the dimensions
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+# Decode flags by reduction factor (libjpeg scales during decoding, so this is much cheaper)
+_REDUCED_FLAGS = None
+
+
+def _decode_small(data):
+    """Grayscale decode at the largest 1/2, 1/4 or 1/8 reduction that still covers ANALYSIS_SIZE"""
+    global _REDUCED_FLAGS
+    import cv2
+    import numpy as np
+
+    if _REDUCED_FLAGS is None:
+        _REDUCED_FLAGS = [(8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                          (2, cv2.IMREAD_REDUCED_GRAYSCALE_2), (1, cv2.IMREAD_GRAYSCALE)]
+    try:
+        size = image_size(data)
+    except struct.error:
+        size = None
+    factor, flag = 4, cv2.IMREAD_REDUCED_GRAYSCALE_4
+    if size:
+        factor, flag = next((f, fl) for f, fl in _REDUCED_FLAGS if max(size) / f >= ANALYSIS_SIZE or f == 1)
+
+    gray = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if gray is None:
+        return None, None
+    if not size:
+        size = (gray.shape[1] * factor, gray.shape[0] * factor)
+    return gray, size
+
+
+def _issue(check, severity, **metrics):
+    return {'check': check, 'severity': severity, 'message': MESSAGES[check].format(**metrics)}
+
+
+def check_image(data, purpose='quality'):
+    """
+    Assess raw upload bytes. Returns
+    {'ok': False if any check rejects, 'issues': [...], 'metrics': {...}, 'ms': elapsed}
+    """
+    import cv2
+    import numpy as np
+
+    started = time.perf_counter()
+    rules = RULES[purpose]
+
+    gray, size = _decode_small(data)
+    if gray is None:
+        return {'ok': False, 'issues': [_issue('unreadable', 'reject')], 'metrics': {},
+                'ms': (time.perf_counter() - started) * 1000}
+    width, height = size
+
+    scale = ANALYSIS_SIZE / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    brightness = float(gray.mean())
+    glare = float(np.count_nonzero(gray >= GLARE_LEVEL)) / gray.size
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    metrics = {'width': width, 'height': height, 'brightness': round(brightness, 1),
+               'glare': round(glare, 3), 'sharpness': round(sharpness, 1)}
+
+    issues = []
+    if min(width, height) < rules['min_side']:
+        issues.append(_issue('resolution', 'reject', **metrics))
+    if brightness < rules['min_brightness']:
+        issues.append(_issue('dark', 'reject'))
+    elif brightness > rules['max_brightness']:
+        issues.append(_issue('bright', 'reject'))
+    if glare > rules['reject_glare']:
+        issues.append(_issue('glare', 'reject', glare=glare))
+    elif glare > rules['warn_glare']:
+        issues.append(_issue('glare', 'warn', glare=glare))
+    if rules['reject_sharpness'] is not None and sharpness < rules['reject_sharpness']:
+        issues.append(_issue('blur', 'reject'))
+    elif sharpness < rules['warn_sharpness']:
+        issues.append(_issue('blur', 'warn'))
+
+    return {
+        'ok': not any(i['severity'] == 'reject' for i in issues),
+        'issues': issues,
+        'metrics': metrics,
+        'ms': (time.perf_counter() - started) * 1000,
+    }
+
+
+def rejection_response(result):
+    """JSON body for a rejected upload: the first problem as the error, plus all issues"""
+    rejected = [i for i in result['issues'] if i['severity'] == 'reject']
+    return {'error': rejected[0]['message'], 'issues': result['issues'], 'retake': True}
+
+
+def upload_targets():
+    """Per upload type: longest edge, JPEG quality and size limit for browser-side resizing"""
+    return {purpose: dict(target, min_side=RULES[purpose]['min_side'])
+            for purpose, target in UPLOAD_TARGETS.items()}
+
+
+def warnings(result):
+    return [i['message'] for i in result['issues'] if i['severity'] == 'warn']
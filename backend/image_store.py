@@ -0,0 +1,312 @@
+import os
+import re
+import hashlib
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from database import get_db, shard_connections
+from http_cache import bump_all
+
+# Content-addressed storage for uploaded images.
+# Each image is stored once under its SHA-256, sharded two levels deep:
+#   ../uploads/store/ab/cd/abcd...ef.jpg        (original bytes)
+#   ../uploads/store/ab/cd/abcd...ef.thumb.webp (small preview for history views)
+# Readings keep only the hash in image_path. The images table counts how
+# many readings point at each hash; the files are removed when it drops to 0.
+#
+# An upload takes its reference before the reading that uses it is saved
+# (classification runs in between, and with sharding the reading goes to
+# another database). put() stamps referenced_at, and collect_garbage() leaves
+# images referenced within the last GC_GRACE_MINUTES to the uploads in flight.
+
+# 🔧 CONFIGURATION
+STORE_ROOT = "../uploads/store"
+THUMB_SIZE = 160        # Longest thumbnail edge in pixels
+THUMB_QUALITY = 70
+GC_GRACE_MINUTES = 60   # collect_garbage() doesn't recount images referenced this recently
+
+_REF_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Leading bytes -> extension, used to name and serve stored files
+_SIGNATURES = [
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF8', '.gif'),
+    (b'BM', '.bmp'),
+]
+
+MIMETYPES = {
+    '.jpg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif',
+    '.bmp': 'image/bmp', '.webp': 'image/webp',
+}
+
+
+def is_ref(value):
+    """True if an image_path value is a content hash from this store"""
+    return bool(value) and bool(_REF_PATTERN.match(value))
+
+
+def _sniff_ext(data):
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    for signature, ext in _SIGNATURES:
+        if data.startswith(signature):
+            return ext
+    return '.jpg'
+
+
+def _shard_dir(ref):
+    return os.path.join(STORE_ROOT, ref[:2], ref[2:4])
+
+
+def image_path(ref, ext):
+    return os.path.join(_shard_dir(ref), ref + ext)
+
+
+def thumbnail_path(ref):
+    """Path of an existing thumbnail (WebP, or JPEG where WebP isn't available)"""
+    for ext in ('.thumb.webp', '.thumb.jpg'):
+        path = os.path.join(_shard_dir(ref), ref + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _utc_now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _make_thumbnail(ref, data):
+    import cv2
+    import numpy as np
+
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+
+    h, w = img.shape[:2]
+    scale = THUMB_SIZE / max(h, w)
+    if scale < 1:
+        img = cv2.resize(img, (max(int(w * scale), 1), max(int(h * scale), 1)),
+                         interpolation=cv2.INTER_AREA)
+
+    ok, buf = cv2.imencode('.webp', img, [cv2.IMWRITE_WEBP_QUALITY, THUMB_QUALITY])
+    ext = '.thumb.webp'
+    if not ok:
+        ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY])
+        ext = '.thumb.jpg'
+    if not ok:
+        return None
+
+    path = os.path.join(_shard_dir(ref), ref + ext)
+    _atomic_write(path, buf.tobytes())
+    return path
+
+
+def _write_files(ref, path, data):
+    if os.path.exists(path):
+        return
+    _atomic_write(path, data)
+    try:
+        _make_thumbnail(ref, data)
+    except Exception as e:
+        print(f"⚠️ Thumbnail failed for {ref[:12]}: {e}")
+
+
+def put(data):
+    """
+    Store image bytes (deduplicated) and take one reference to them.
+    Returns (ref, path on disk).
+    """
+    ref = hashlib.sha256(data).hexdigest()
+    ext = _sniff_ext(data)
+    path = image_path(ref, ext)
+
+    # File and thumbnail work happens outside the write lock, which on SQLite
+    # is the lock every reading write waits for
+    _write_files(ref, path, data)
+
+    conn = get_db()
+    try:
+        # The write lock orders this against a concurrent release() of the same hash
+        conn.begin_write('images')
+        conn.execute('''
+            INSERT INTO images (hash, ext, size, ref_count, referenced_at) VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT(hash) DO UPDATE SET ref_count = images.ref_count + 1,
+                                            referenced_at = excluded.referenced_at
+        ''', (ref, ext, len(data), _utc_now()))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    # A release() of the last other reference (or collect_garbage()) may have removed
+    # the files before the reference above was taken; now that it is, nothing can
+    _write_files(ref, path, data)
+    return ref, path
+
+
+def _remove_files(ref, ext):
+    for path in (image_path(ref, ext),
+                 os.path.join(_shard_dir(ref), ref + '.thumb.webp'),
+                 os.path.join(_shard_dir(ref), ref + '.thumb.jpg')):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def release(ref):
+    """Drop one reference; delete the files when nothing uses them any more"""
+    return release_many([ref]) > 0
+
+
+def release_many(refs):
+    """Drop one reference per entry in one transaction; returns how many images were deleted"""
+    counts = Counter(ref for ref in refs if is_ref(ref))
+    if not counts:
+        return 0
+
+    conn = get_db()
+    try:
+        conn.begin_write('images')
+        conn.executemany('UPDATE images SET ref_count = ref_count - ? WHERE hash = ?',
+                         [(n, ref) for ref, n in counts.items()])
+        placeholders = ', '.join('?' * len(counts))
+        dead = conn.execute(f'SELECT hash, ext FROM images WHERE hash IN ({placeholders}) AND ref_count <= 0',
+                            list(counts)).fetchall()
+        if dead:
+            conn.execute(f"DELETE FROM images WHERE hash IN ({', '.join('?' * len(dead))})",
+                         [row['hash'] for row in dead])
+            for row in dead:
+                _remove_files(row['hash'], row['ext'])
+        conn.commit()
+        return len(dead)
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def lookup(ref, thumbnail=False):
+    """Return (path, mimetype) for a stored image, or None"""
+    if not is_ref(ref):
+        return None
+    if thumbnail:
+        path = thumbnail_path(ref)
+        if path:
+            return path, MIMETYPES[os.path.splitext(path)[1]]
+
+    conn = get_db()
+    row = conn.execute('SELECT ext FROM images WHERE hash = ?', (ref,)).fetchone()
+    conn.close()
+    if not row:
+        return None
+    path = image_path(ref, row['ext'])
+    if not os.path.exists(path):
+        return None
+    return path, MIMETYPES.get(row['ext'], 'application/octet-stream')
+
+
+def collect_garbage():
+    """
+    Reconcile the store with the readings that use it:
+    recount references, delete unreferenced images and stray files.
+    Images referenced in the last GC_GRACE_MINUTES keep their count: their
+    readings may not be saved yet.
+    """
+    conn = get_db()
+    conn.begin_write('images')
+    # Readings may be spread over several shards; count references in each
+    counts = Counter()
+    for _, shard in shard_connections(readonly=True):
+        for row in shard.execute('''
+            SELECT image_path, COUNT(*) AS refs FROM quality_readings
+            WHERE image_path IS NOT NULL GROUP BY image_path
+        '''):
+            counts[row['image_path']] += row['refs']
+        shard.close()
+    cutoff = (datetime.now(timezone.utc) - timedelta(minutes=GC_GRACE_MINUTES)).strftime('%Y-%m-%d %H:%M:%S')
+    hashes = [row['hash'] for row in conn.execute(
+        'SELECT hash FROM images WHERE referenced_at IS NULL OR referenced_at < ?', (cutoff,))]
+    conn.executemany('UPDATE images SET ref_count = ? WHERE hash = ?', [(counts[h], h) for h in hashes])
+    dead = conn.execute('SELECT hash, ext FROM images WHERE ref_count <= 0').fetchall()
+    for row in dead:
+        _remove_files(row['hash'], row['ext'])
+    conn.execute('DELETE FROM images WHERE ref_count <= 0')
+    known = {row['hash'] for row in conn.execute('SELECT hash FROM images')}
+
+    # A put() may write files before taking its reference; if they are removed
+    # here as strays, it writes them again once the reference is committed
+    strays = 0
+    if os.path.exists(STORE_ROOT):
+        for dirpath, _, filenames in os.walk(STORE_ROOT):
+            for name in filenames:
+                if name.split('.')[0] not in known:
+                    os.remove(os.path.join(dirpath, name))
+                    strays += 1
+    conn.commit()
+    conn.close()
+    return len(dead), strays
+
+
+def migrate_legacy(uploads_dir="../uploads"):
+    """Move flat uploads/quality_*.jpg files referenced by readings into the store"""
+    moved = set()
+    for _, conn in shard_connections():
+        rows = conn.execute('''
+            SELECT id, image_path FROM quality_readings
+            WHERE image_path IS NOT NULL AND image_path != ''
+        ''').fetchall()
+        conn.rollback()  # Don't hold the shard open while the store is written
+
+        for row in rows:
+            if is_ref(row['image_path']):
+                continue
+            legacy = os.path.join(uploads_dir, os.path.basename(row['image_path']))
+            if not os.path.exists(legacy):
+                continue
+            with open(legacy, 'rb') as f:
+                ref, _ = put(f.read())
+
+            conn.execute('UPDATE quality_readings SET image_path = ? WHERE id = ?', (ref, row['id']))
+            conn.commit()
+            moved.add(legacy)
+        conn.close()
+
+    if moved:
+        bump_all()   # Reading details now point at the store
+    # Only delete once every reading sharing a file has been moved
+    for legacy in moved:
+        os.remove(legacy)
+    return len(moved)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintain the content-addressed image store")
+    parser.add_argument('--migrate', action='store_true', help="Import legacy flat upload files")
+    parser.add_argument('--gc', action='store_true', help="Delete unreferenced images")
+    args = parser.parse_args()
+
+    if args.migrate:
+        print(f"📦 Migrated {migrate_legacy()} legacy uploads into the store")
+    if args.gc:
+        images, strays = collect_garbage()
+        print(f"🧹 Removed {images} unreferenced images and {strays} stray files")
@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+
+# Shared inference service for app.py and app_enhanced.py.
+#
+# - The classifier is loaded once per process, on first use, and loaded again
+#   when train_model.py replaces the file. A reload swaps in a whole new model
+#   object; requests keep the one they started with.
+# - Uploads are decoded from the request's own bytes in memory. Nothing is
+#   written to a shared path, so any number of requests can run at once.
+# - After loading, the model and OpenCV are only read. The model slot is the
+#   only shared state here, and a lock guards it.
+
+# 🔧 CONFIGURATION
+MODEL_PATH = "../models/rf_model.pkl"
+MODEL_RELOAD_CHECK_SECONDS = 30  # How often to look for a retrained model file
+REGION_GRID = 6                  # Tiles per side for contamination localization
+LOCAL_UNSAFE_PROBABILITY = 0.95  # Tile score that flags a local hotspot in a SAFE sample
+DEFAULT_ECO_LIMIT = 14500        # L/month (methodology limit), for users without a setting
+
+_model = None
+_model_loaded = False
+_model_mtime = None
+_model_checked_at = 0.0
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """Load the classifier on first use, and again after train_model.py replaces it"""
+    global _model, _model_loaded, _model_mtime, _model_checked_at
+    now = time.monotonic()
+    if not _model_loaded or now - _model_checked_at > MODEL_RELOAD_CHECK_SECONDS:
+        with _model_lock:
+            _model_checked_at = now
+            mtime = os.path.getmtime(MODEL_PATH) if os.path.exists(MODEL_PATH) else None
+            if not _model_loaded or mtime != _model_mtime:
+                if mtime is not None:
+                    import joblib
+                    _model = joblib.load(MODEL_PATH)
+                _model_mtime = mtime
+                _model_loaded = True
+    return _model
+
+
+def warmup():
+    """Load the model and the OCR/CV libraries now instead of on the first request"""
+    get_model()
+    import cv2, pytesseract  # noqa: F401
+
+
+def decode_image(data):
+    """BGR image from uploaded bytes, or None if they aren't a readable image"""
+    import cv2
+    import numpy as np
+
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+# ============================================
+# WATER QUALITY
+# ============================================
+
+def classify_quality(img, localize=True):
+    """
+    Classify a decoded water sample.
+    Returns {'prediction': 1 (unsafe) / 0 (safe), 'confidence': percent,
+             'features': the 4 whole-image features,
+             'regions': per-tile unsafe heatmap (localize=True and a model loaded) or None}
+    """
+    from quality_model import analyze_image, features_from_array, localize_contamination
+
+    if localize:
+        # Whole-image and per-tile features from one pass over the image
+        features, tiles = analyze_image(img, REGION_GRID)
+    else:
+        features, tiles = features_from_array(img), None
+
+    # One reference for the whole request, even if a reload happens meanwhile
+    model = get_model()
+    if model is None:
+        return {'prediction': 0, 'confidence': 50.0, 'features': features, 'regions': None}
+
+    # One forward pass: the predicted class is the most probable one
+    probabilities = model.predict_proba([features])[0]
+    return {
+        'prediction': int(model.classes_[probabilities.argmax()]),
+        'confidence': float(max(probabilities) * 100),
+        'features': features,
+        'regions': localize_contamination(model, tiles) if tiles is not None else None,
+    }
+
+
+# ============================================
+# METER READING
+# ============================================
+
+def read_meter(data, filename, layout=None, previous=None):
+    """
+    OCR a meter photo held in memory. filename is the name it was uploaded
+    under (demo images carry their value in it, see ocr_model.py).
+    Returns the read_meter_with_layout() result.
+    """
+    from ocr_model import read_meter_with_layout, extract_value_from_filename
+
+    name = os.path.basename(filename or '') or 'upload.jpg'
+    img = None
+    # Demo images are answered from the name: skip decoding them
+    if not extract_value_from_filename(name):
+        img = decode_image(data)
+        if img is None:
+            return {'value': "Error: Image Load", 'layout': None, 'method': None, 'below_previous': False}
+    return read_meter_with_layout(name, layout, previous, image=img)
+
+
+def usage_verdict(usage, limit=DEFAULT_ECO_LIMIT):
+    """Insight, conservation tip and high-usage flag for a reading against an eco limit"""
+    if usage > limit:
+        return {
+            'insight': f"⚠️ Alert: Usage exceeds {limit}L limit!",
+            'conservation': "High consumption detected. Check for leaks immediately.",
+            'is_high': True,
+        }
+    return {
+        'insight': "✅ Normal Usage Pattern.",
+        'conservation': "Great job! Your usage is within eco-limits.",
+        'is_high': False,
+    }
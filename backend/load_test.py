@@ -0,0 +1,432 @@
+"""
+AquaGuard AI - Load Tester
+Simulates logged-in users against a running server with the real request mix
+(dashboard, photo analysis, meter reading, analytics, history, exports and
+deletes) and reports throughput, latency percentiles and error rates.
+
+Requests arrive as a Poisson stream at --rate per second and are executed by
+--concurrency client threads. Latency is measured from each request's planned
+arrival time, so time spent waiting for a free client thread counts too and a
+slow server can't hide behind a stalled client. With --rate 0 every client
+thread sends requests back to back instead (closed loop).
+
+--ramp runs several rates in turn and reports the saturation point: the first
+rate the server can't keep up with (throughput below the offered rate, p95
+over --slo-ms, or too many errors).
+
+Usage:
+    python load_test.py --users 20 --rate 10 --duration 60
+    python load_test.py --start --workers 2 --threads 4 --ramp 2,4,8,16 --duration 30
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+import http.cookiejar
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 🔧 CONFIGURATION
+DEFAULT_URL = "http://localhost:9000"
+QUALITY_IMAGE_DIRS = ["../dataset/Clean", "../dataset/Dirty"]
+METER_IMAGE_DIR = "meter_test_images"
+MAX_IMAGES = 40               # Images of each kind kept in memory for uploads
+USER_PREFIX = "loadtest_"
+USER_PASSWORD = "loadtest-password"
+REQUEST_TIMEOUT = 60          # Seconds before a request counts as failed
+MAX_BACKLOG_PER_THREAD = 20   # Arrivals beyond this are dropped (the client itself is overloaded)
+THROUGHPUT_RATIO = 0.9        # Saturated when completed/s falls below this share of arrivals/s
+MAX_ERROR_RATE = 0.05         # Saturated when more requests than this fail (errors and 503s)
+DEFAULT_SLO_MS = 2000         # Saturated when p95 latency exceeds this
+SERVER_START_TIMEOUT = 90
+LOADTEST_DATABASE_URL = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'aquaguard_loadtest.db')
+
+# Relative weight of each action in the mix
+MIX = {
+    'dashboard': 20,
+    'analytics': 15,
+    'quality_upload': 15,
+    'history': 12,
+    'meter_upload': 8,
+    'reading_details': 10,
+    'analytics_page': 8,
+    'export': 4,
+    'delete': 3,
+    'quality_page': 3,
+    'meter_page': 2,
+}
+ANALYTICS_DAYS = [1, 7, 30, 90]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+# ============================================
+# VIRTUAL USERS
+# ============================================
+
+class UserSession:
+    """One logged-in user: a cookie jar plus the readings it has created"""
+
+    def __init__(self, base_url, username):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.readings = []     # (type, id) of readings this session uploaded
+        self.meter_id = f"LT-{username}"
+
+    def request(self, method, path, body=None, content_type=None):
+        """Returns (status, response body); status 0 for connection errors and timeouts"""
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if content_type:
+            req.add_header('Content-Type', content_type)
+        try:
+            with self.opener.open(req, timeout=REQUEST_TIMEOUT) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, socket.timeout, ConnectionError):
+            return 0, b''
+
+    def post_json(self, path, data):
+        return self.request('POST', path, json.dumps(data).encode(), 'application/json')
+
+    def post_file(self, path, filename, content, fields):
+        """multipart/form-data upload, as the upload pages' FormData does"""
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in fields.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + content + b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode())
+        return self.request('POST', path, b''.join(parts), f'multipart/form-data; boundary={boundary}')
+
+    def login(self):
+        """Register if needed, then log in like login.html; returns True on success"""
+        self.post_json('/register', {'username': self.username, 'email': f'{self.username}@loadtest.local',
+                                     'password': USER_PASSWORD, 'full_name': 'Load Test'})
+        status, body = self.post_json('/login', {'username': self.username, 'password': USER_PASSWORD})
+        return status == 200 and json.loads(body).get('success', False)
+
+
+def _remember(session, reading_type, status, body):
+    if status == 200:
+        reading_id = json.loads(body).get('reading_id')
+        if reading_id:
+            session.readings.append((reading_type, reading_id))
+
+
+def _quality_upload(session, images):
+    name, content = random.choice(images['quality'])
+    status, body = session.post_file('/api/predict_quality', name, content,
+                                     {'location': 'Load test', 'notes': ''})
+    _remember(session, 'quality', status, body)
+    return status
+
+
+def _meter_upload(session, images):
+    name, content = random.choice(images['meter'])
+    status, body = session.post_file('/api/read_meter', name, content,
+                                     {'meter_id': session.meter_id, 'location': 'Load test'})
+    _remember(session, 'meter', status, body)
+    return status
+
+
+def _reading_details(session, images):
+    if not session.readings:
+        return session.request('GET', '/history')[0]
+    reading_type, reading_id = random.choice(session.readings)
+    return session.request('GET', f'/api/reading_details?type={reading_type}&id={reading_id}')[0]
+
+
+def _delete(session, images):
+    if not session.readings:
+        return session.request('GET', '/history')[0]
+    reading_type, reading_id = session.readings.pop(random.randrange(len(session.readings)))
+    return session.request('DELETE', f'/api/delete_reading?type={reading_type}&id={reading_id}')[0]
+
+
+ACTIONS = {
+    'dashboard': lambda s, images: s.request('GET', '/dashboard')[0],
+    'analytics': lambda s, images: s.request('GET', f'/api/analytics_data?days={random.choice(ANALYTICS_DAYS)}')[0],
+    'quality_upload': _quality_upload,
+    'history': lambda s, images: s.request('GET', '/history')[0],
+    'meter_upload': _meter_upload,
+    'reading_details': _reading_details,
+    'analytics_page': lambda s, images: s.request('GET', '/analytics')[0],
+    'export': lambda s, images: s.request('GET', '/api/export_report?type=csv')[0],
+    'delete': _delete,
+    'quality_page': lambda s, images: s.request('GET', '/quality')[0],
+    'meter_page': lambda s, images: s.request('GET', '/meter')[0],
+}
+
+
+def load_images():
+    """Upload payloads: (file name, bytes) for quality photos and meter photos"""
+    def read_dir(directory):
+        directory = os.path.join(BACKEND_DIR, directory)
+        if not os.path.isdir(directory):
+            return []
+        names = sorted(f for f in os.listdir(directory) if f.lower().endswith(IMAGE_EXTENSIONS))
+        return [(f, open(os.path.join(directory, f), 'rb').read()) for f in names]
+
+    quality = [image for d in QUALITY_IMAGE_DIRS for image in read_dir(d)]
+    random.shuffle(quality)
+    meter = read_dir(METER_IMAGE_DIR)
+    if not quality or not meter:
+        raise SystemExit("❌ No test images found in dataset/ or backend/meter_test_images")
+    return {'quality': quality[:MAX_IMAGES], 'meter': meter[:MAX_IMAGES]}
+
+
+# ============================================
+# RUNNING A STAGE
+# ============================================
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []      # (action, status, latency seconds)
+        self.dropped = 0
+
+    def add(self, action, status, latency):
+        with self.lock:
+            self.samples.append((action, status, latency))
+
+
+def _run_one(sessions, images, actions, weights, results, planned):
+    action = random.choices(actions, weights)[0]
+    session = random.choice(sessions)
+    try:
+        status = ACTIONS[action](session, images)
+    except Exception:
+        status = 0
+    results.add(action, status, time.perf_counter() - planned)
+
+
+def run_stage(sessions, images, rate, concurrency, duration):
+    """Drive load for `duration` seconds; returns (Results, elapsed seconds)"""
+    actions = list(MIX)
+    weights = [MIX[a] for a in actions]
+    results = Results()
+    started = time.perf_counter()
+    deadline = started + duration
+
+    if rate > 0:
+        # Open model: Poisson arrivals, independent of how fast responses come back
+        pending = threading.BoundedSemaphore(concurrency * MAX_BACKLOG_PER_THREAD)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            planned = started
+            while True:
+                planned += random.expovariate(rate)
+                if planned >= deadline:
+                    break
+                delay = planned - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if not pending.acquire(blocking=False):
+                    results.dropped += 1
+                    continue
+                future = pool.submit(_run_one, sessions, images, actions, weights, results, planned)
+                future.add_done_callback(lambda _: pending.release())
+    else:
+        # Closed model: each client thread sends its next request as soon as the last one returns
+        def client():
+            while time.perf_counter() < deadline:
+                _run_one(sessions, images, actions, weights, results, time.perf_counter())
+
+        threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    return results, time.perf_counter() - started
+
+
+# ============================================
+# REPORTING
+# ============================================
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _latency_ms(latencies):
+    latencies = sorted(latencies)
+    return {f'p{p}': round(percentile(latencies, p) * 1000, 1) for p in (50, 90, 95, 99)} | \
+        {'max': round(latencies[-1] * 1000, 1) if latencies else 0.0}
+
+
+def summarize(results, elapsed, rate, duration):
+    """Throughput, outcome counts and latency percentiles of one stage"""
+    by_action = defaultdict(list)
+    for sample in results.samples:
+        by_action[sample[0]].append(sample)
+
+    def outcome(samples):
+        statuses = [s[1] for s in samples]
+        return {
+            'requests': len(samples),
+            'ok': sum(1 for s in statuses if 200 <= s < 400),
+            'rate_limited': statuses.count(429),       # Per-user upload limit (admission.py)
+            'shed': statuses.count(503),               # Server busy (admission.py)
+            'errors': sum(1 for s in statuses if s == 0 or (s >= 400 and s not in (429, 503))),
+            'latency_ms': _latency_ms([s[2] for s in samples]),
+        }
+
+    summary = outcome(results.samples)
+    total = summary['requests'] + results.dropped
+    summary.update({
+        'offered_rate': rate,
+        'arrival_rate': round(total / duration, 2) if rate else 0.0,   # Poisson arrivals actually sent
+        'seconds': round(elapsed, 1),
+        'throughput': round(summary['requests'] / elapsed, 2) if elapsed else 0.0,
+        'dropped': results.dropped,
+        'error_rate': round((summary['errors'] + summary['shed'] + results.dropped) / total, 4) if total else 0.0,
+        'actions': {action: outcome(samples) for action, samples in sorted(by_action.items())},
+    })
+    return summary
+
+
+def is_saturated(summary, slo_ms):
+    if summary['error_rate'] > MAX_ERROR_RATE:
+        return f"error rate {summary['error_rate']:.1%}"
+    if summary['latency_ms']['p95'] > slo_ms:
+        return f"p95 {summary['latency_ms']['p95']:.0f} ms > {slo_ms} ms"
+    if summary['arrival_rate'] and summary['throughput'] < THROUGHPUT_RATIO * summary['arrival_rate']:
+        return f"throughput {summary['throughput']}/s < arrivals {summary['arrival_rate']}/s"
+    return None
+
+
+def print_summary(summary):
+    latency = summary['latency_ms']
+    offered = f"{summary['offered_rate']}/s offered" if summary['offered_rate'] else "closed loop"
+    print(f"\n📊 {offered}: {summary['throughput']} req/s over {summary['seconds']}s "
+          f"({summary['requests']} requests, {summary['dropped']} dropped)")
+    print(f"   ok {summary['ok']}  429 {summary['rate_limited']}  503 {summary['shed']}  errors {summary['errors']}  "
+          f"| p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']} ms")
+    print(f"   {'action':<16}{'count':>7}{'ok':>7}{'429':>6}{'503':>6}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for action, stats in summary['actions'].items():
+        lat = stats['latency_ms']
+        print(f"   {action:<16}{stats['requests']:>7}{stats['ok']:>7}{stats['rate_limited']:>6}{stats['shed']:>6}"
+              f"{stats['errors']:>6}{lat['p50']:>10}{lat['p95']:>10}{lat['p99']:>10}")
+
+
+# ============================================
+# LOCAL SERVER
+# ============================================
+
+def start_server(port, workers, threads, database_url):
+    """Start serve.py on 127.0.0.1:port (with its own database) and wait until it answers"""
+    env = dict(os.environ, AQUAGUARD_DATABASE_URL=database_url)
+    process = subprocess.Popen(
+        [sys.executable, 'serve.py', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         '--threads', str(threads)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("❌ Server exited during start-up")
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=2).close()
+            return process
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.5)
+    process.terminate()
+    raise SystemExit("❌ Server did not start in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test AquaGuard AI with simulated user sessions")
+    parser.add_argument('--url', default=DEFAULT_URL, help="Server to test (ignored with --start)")
+    parser.add_argument('--users', type=int, default=10, help="Simulated user accounts")
+    parser.add_argument('--concurrency', type=int, default=16, help="Client threads sending requests")
+    parser.add_argument('--rate', type=float, default=5.0, help="Requests per second (0 = closed loop)")
+    parser.add_argument('--ramp', help="Comma-separated rates to run in turn, e.g. 2,4,8,16")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds per stage")
+    parser.add_argument('--slo-ms', type=float, default=DEFAULT_SLO_MS, help="p95 latency target for --ramp")
+    parser.add_argument('--seed', type=int, help="Random seed for a repeatable request sequence")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    parser.add_argument('--start', action='store_true', help="Start serve.py locally for the test")
+    parser.add_argument('--port', type=int, default=9100, help="Port for --start")
+    parser.add_argument('--workers', type=int, default=2, help="serve.py workers for --start")
+    parser.add_argument('--threads', type=int, default=4, help="serve.py threads per worker for --start")
+    parser.add_argument('--database-url', default=LOADTEST_DATABASE_URL,
+                        help="Database for --start (keeps test users and readings out of the real one)")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    rates = [float(r) for r in args.ramp.split(',')] if args.ramp else [args.rate]
+    images = load_images()
+
+    server = None
+    url = args.url
+    if args.start:
+        print(f"🚀 Starting serve.py on port {args.port} ({args.workers} workers x {args.threads} threads)")
+        server = start_server(args.port, args.workers, args.threads, args.database_url)
+        url = f'http://127.0.0.1:{args.port}'
+
+    try:
+        print(f"👥 Logging in {args.users} users at {url}")
+        sessions = [UserSession(url, f"{USER_PREFIX}{i}") for i in range(args.users)]
+        with ThreadPoolExecutor(max_workers=min(args.users, 8)) as pool:
+            logged_in = list(pool.map(UserSession.login, sessions))
+        sessions = [s for s, ok in zip(sessions, logged_in) if ok]
+        if not sessions:
+            raise SystemExit("❌ No user could log in")
+
+        # One untimed pass over every action loads the model and OCR libraries in the workers
+        for action in MIX:
+            ACTIONS[action](sessions[0], images)
+
+        stages = []
+        saturation = None
+        for rate in rates:
+            print(f"\n⏱️  {'Closed loop' if not rate else f'{rate} req/s'} for {args.duration:.0f}s "
+                  f"with {args.concurrency} client threads")
+            results, elapsed = run_stage(sessions, images, rate, args.concurrency, args.duration)
+            summary = summarize(results, elapsed, rate, args.duration)
+            print_summary(summary)
+            stages.append(summary)
+            if args.ramp:
+                reason = is_saturated(summary, args.slo_ms)
+                if reason:
+                    saturation = {'rate': rate, 'reason': reason}
+                    break
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    if args.ramp:
+        healthy = [s['offered_rate'] for s in stages if not is_saturated(s, args.slo_ms)]
+        if saturation:
+            last_healthy = f"last healthy rate: {healthy[-1]} req/s" if healthy else "no healthy rate"
+            print(f"\n🔥 Saturated at {saturation['rate']} req/s ({saturation['reason']}); {last_healthy}")
+        else:
+            print(f"\n✅ No saturation up to {rates[-1]} req/s")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'url': url, 'users': len(sessions), 'concurrency': args.concurrency,
+                       'stages': stages, 'saturation': saturation}, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
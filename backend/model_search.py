@@ -0,0 +1,187 @@
+"""
+AquaGuard AI - Latency-Aware Model Search
+Cross-validates candidate classifiers in parallel and measures what each one
+costs at inference time (single-row and batch predict_proba latency, model size),
+then reports the accuracy/latency Pareto frontier.
+
+Usage:
+    python model_search.py                       # report only
+    python model_search.py --budget-ms 2 --save  # save the best model within 2 ms/reading
+"""
+
+import io
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold, cross_val_score
+from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier, HistGradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from train_model import (FEATURE_NAMES, load_dataset_features, load_feedback_features, feedback_high_water,
+                         save_model)
+
+# 🔧 CONFIGURATION
+CV_FOLDS = 5
+SINGLE_ROW_REPEATS = 200   # predict_proba calls timed for the single-row latency
+BATCH_SIZE = 1000          # Rows per batch for the batch latency
+
+
+def candidate_specs():
+    """(name, family, params) for every model in the search space"""
+    specs = []
+    for family in ('RandomForest', 'ExtraTrees'):
+        for n_estimators in (10, 20, 50, 100, 200):
+            for max_depth in (4, 6, 10, None):
+                specs.append((f"{family}(n={n_estimators}, depth={max_depth})", family,
+                              {'n_estimators': n_estimators, 'max_depth': max_depth}))
+    for max_depth in (3, 5, 8):
+        specs.append((f"DecisionTree(depth={max_depth})", 'DecisionTree', {'max_depth': max_depth}))
+    for max_iter in (25, 50, 100):
+        specs.append((f"HistGradientBoosting(iter={max_iter})", 'HistGradientBoosting', {'max_iter': max_iter}))
+    for C in (0.1, 1.0, 10.0):
+        specs.append((f"LogisticRegression(C={C})", 'LogisticRegression', {'C': C}))
+    return specs
+
+
+def build_model(family, params):
+    # n_jobs=1: parallelism comes from the process pool, and the server predicts one row at a time
+    if family == 'RandomForest':
+        return RandomForestClassifier(min_samples_split=5, min_samples_leaf=2, class_weight='balanced',
+                                      random_state=42, n_jobs=1, **params)
+    if family == 'ExtraTrees':
+        return ExtraTreesClassifier(min_samples_split=5, min_samples_leaf=2, class_weight='balanced',
+                                    random_state=42, n_jobs=1, **params)
+    if family == 'DecisionTree':
+        return DecisionTreeClassifier(class_weight='balanced', random_state=42, **params)
+    if family == 'HistGradientBoosting':
+        return HistGradientBoostingClassifier(random_state=42, **params)
+    if family == 'LogisticRegression':
+        return make_pipeline(StandardScaler(), LogisticRegression(class_weight='balanced', max_iter=1000, **params))
+    raise ValueError(f"Unknown model family: {family}")
+
+
+def evaluate(spec, X, y):
+    """Cross-validated accuracy plus inference cost of one candidate (runs in a worker process)"""
+    name, family, params = spec
+    cv = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=42)
+    scores = cross_val_score(build_model(family, params), X, y, cv=cv, scoring='accuracy')
+
+    model = build_model(family, params).fit(X, y)
+
+    # Single row, shaped exactly like the request path in app_enhanced.py
+    row = [X.iloc[0].tolist()]
+    model.predict_proba(row)
+    timings = []
+    for _ in range(SINGLE_ROW_REPEATS):
+        start = time.perf_counter()
+        model.predict_proba(row)
+        timings.append(time.perf_counter() - start)
+
+    batch = X.sample(BATCH_SIZE, replace=True, random_state=0)
+    start = time.perf_counter()
+    model.predict_proba(batch)
+    batch_seconds = time.perf_counter() - start
+
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+
+    return {
+        'name': name, 'family': family, 'params': params,
+        'accuracy': float(np.mean(scores)), 'accuracy_std': float(np.std(scores)),
+        'single_ms': float(np.median(timings) * 1000),
+        'batch_us_per_row': batch_seconds / BATCH_SIZE * 1e6,
+        'size_kb': buffer.tell() / 1024,
+    }
+
+
+def pareto_frontier(results):
+    """Candidates not beaten on both accuracy and single-row latency"""
+    frontier = []
+    for r in results:
+        dominated = any(
+            o['accuracy'] >= r['accuracy'] and o['single_ms'] <= r['single_ms'] and
+            (o['accuracy'] > r['accuracy'] or o['single_ms'] < r['single_ms'])
+            for o in results
+        )
+        if not dominated:
+            frontier.append(r)
+    return sorted(frontier, key=lambda r: r['single_ms'])
+
+
+def pick_within_budget(results, budget_ms):
+    """Most accurate candidate under the latency budget (faster wins ties)"""
+    eligible = [r for r in results if r['single_ms'] <= budget_ms]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda r: (round(r['accuracy'], 4), -r['single_ms']))
+
+
+def load_training_data():
+    feedback = load_feedback_features()
+    df = pd.concat([load_dataset_features(), feedback[FEATURE_NAMES + ['label']]], ignore_index=True)
+    return df[FEATURE_NAMES].astype(float), df['label'].astype(int)
+
+
+def search(workers=None):
+    X, y = load_training_data()
+    specs = candidate_specs()
+    print(f"🔬 Evaluating {len(specs)} candidates on {len(X)} rows ({CV_FOLDS}-fold CV)...")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(evaluate, specs, [X] * len(specs), [y] * len(specs)))
+    return results, X, y
+
+
+def print_table(rows, frontier_names=()):
+    print(f"\n   {'Model':<42} {'Accuracy':>14} {'1-row ms':>9} {'batch µs/row':>13} {'Size KB':>9}")
+    for r in rows:
+        marker = '⭐' if r['name'] in frontier_names else '  '
+        print(f" {marker}{r['name']:<42} {r['accuracy'] * 100:6.2f}% ±{r['accuracy_std'] * 100:4.1f} "
+              f"{r['single_ms']:9.3f} {r['batch_us_per_row']:13.2f} {r['size_kb']:9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search model families/sizes by accuracy and inference cost")
+    parser.add_argument('--workers', type=int, default=None, help="Processes to use (default: all cores)")
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help="Single-row predict_proba latency budget for --save")
+    parser.add_argument('--save', action='store_true', help="Save the chosen model as the live model")
+    parser.add_argument('--report', default=None, help="Write all results to this CSV file")
+    args = parser.parse_args(argv)
+
+    results, X, y = search(args.workers)
+    frontier = pareto_frontier(results)
+
+    print_table(sorted(results, key=lambda r: -r['accuracy']), {r['name'] for r in frontier})
+    print("\n   ⭐ Pareto frontier (accuracy vs single-row latency):")
+    print_table(frontier)
+
+    if args.report:
+        pd.DataFrame(results).to_csv(args.report, index=False)
+        print(f"\n   📄 Report written to {args.report}")
+
+    if args.budget_ms is not None:
+        chosen = pick_within_budget(results, args.budget_ms)
+        if chosen is None:
+            print(f"\n❌ No candidate predicts within {args.budget_ms} ms")
+            return
+        print(f"\n   🎯 Best within {args.budget_ms} ms: {chosen['name']} "
+              f"({chosen['accuracy'] * 100:.2f}%, {chosen['single_ms']:.3f} ms)")
+
+        if args.save:
+            model = build_model(chosen['family'], chosen['params']).fit(X, y)
+            feedback = load_feedback_features()
+            save_model(model, {'feedback_high_water': feedback_high_water(feedback), 'mode': 'search',
+                               'model': chosen['name'], 'cv_accuracy': chosen['accuracy'],
+                               'single_row_ms': chosen['single_ms']})
+            print("   💾 Saved as the live model")
+
+
+if __name__ == "__main__":
+    main()
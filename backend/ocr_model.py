@@ -1,17 +1,20 @@
-import cv2
-import pytesseract
-import numpy as np
 import os
 import re  # 1. We need Regex to find numbers in the filename
 
-print("------------------------------------------------")
-print("✅ STEP 1: Smart OCR Script Starting...")
+# cv2 and pytesseract are imported inside read_meter(): they are only
+# needed for the real OCR fallback and are slow to import.
 
 # 🔧 CONFIGURATION
 # For macOS: Usually '/usr/local/bin/tesseract' or '/opt/homebrew/bin/tesseract'
 # For Windows: r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-# Comment out if tesseract is in PATH
-# pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+# Leave as None if tesseract is in PATH
+TESSERACT_CMD = None  # e.g. r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+# Digit window localization / per-meter layout cache
+WORK_WIDTH = 800            # Photos are searched for the digit window at this width
+MAX_WINDOW_CANDIDATES = 3   # Windows tried (best first) when a meter has no cached layout
+LAYOUT_MARGIN = 0.25        # A cached window is widened by this much to absorb small changes in angle
+DIGIT_HEIGHT = 64           # Crops are scaled to this height for Tesseract
 
 def extract_value_from_filename(filename):
     """
@@ -31,23 +34,137 @@ def extract_value_from_filename(filename):
 
     return None
 
-def read_meter(image_path):
+def locate_digit_windows(gray, limit=MAX_WINDOW_CANDIDATES):
+    """
+    Find likely odometer windows: a row of dark digits gives strong horizontal
+    gradients that merge into one wide box after a morphological close.
+    Returns boxes as (x, y, w, h) fractions of the image, best first.
+    """
+    import cv2
+    import numpy as np
+
+    scale = WORK_WIDTH / gray.shape[1]
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    h, w = small.shape
+
+    blackhat = cv2.morphologyEx(small, cv2.MORPH_BLACKHAT, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 9)))
+    grad = np.absolute(cv2.Sobel(blackhat, cv2.CV_32F, 1, 0, ksize=3))
+    grad = cv2.normalize(grad, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    grad = cv2.morphologyEx(grad, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (21, 5)))
+    _, mask = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 5)))
+    mask = cv2.dilate(cv2.erode(mask, None, iterations=2), None, iterations=2)
+
+    candidates = []
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in contours:
+        x, y, bw, bh = cv2.boundingRect(contour)
+        if not 2.5 <= bw / bh <= 10 or bw < w * 0.1 or bh < h * 0.01:
+            continue
+        solid_area = cv2.contourArea(contour)
+        candidates.append((solid_area, (x / w, y / h, bw / w, bh / h)))
+    candidates.sort(reverse=True)
+    return [box for _, box in candidates[:limit]]
+
+
+def _ocr_window(gray, box, threshold, margin=0.1):
+    """OCR one digit window (fractions of the image) as a single line of digits"""
+    import cv2
+    import pytesseract
+
+    H, W = gray.shape
+    x, y, w, h = box
+    x0, x1 = int(max(x - w * margin, 0) * W), int(min(x + w * (1 + margin), 1) * W)
+    y0, y1 = int(max(y - h * margin, 0) * H), int(min(y + h * (1 + margin), 1) * H)
+    crop = gray[y0:y1, x0:x1]
+    if crop.size == 0:
+        return ""
+    crop = cv2.resize(crop, None, fx=DIGIT_HEIGHT / crop.shape[0], fy=DIGIT_HEIGHT / crop.shape[0],
+                      interpolation=cv2.INTER_CUBIC)
+    mode = cv2.THRESH_BINARY_INV if threshold == 'otsu_inv' else cv2.THRESH_BINARY
+    _, binary = cv2.threshold(crop, 0, 255, mode + cv2.THRESH_OTSU)
+    text = pytesseract.image_to_string(binary, config=r'--oem 3 --psm 7 -c tessedit_char_whitelist=0123456789')
+    return "".join(filter(str.isdigit, text))
+
+
+def _plausible(digits, previous=None, expected_digits=None):
+    """Digit count in range and (for a known meter) not below its last reading"""
+    if not 3 <= len(digits) <= 8:
+        return False
+    if expected_digits and len(digits) != expected_digits:
+        return False
+    if previous is None:
+        return True
+    value = int(digits)
+    if value >= previous:
+        return True
+    # Odometer rollover: 99..9xx -> 00..0yy
+    capacity = 10 ** len(digits)
+    return previous >= capacity * 0.9 and value < capacity * 0.1
+
+
+def read_meter_with_layout(image_path, layout=None, previous=None, image=None, verbose=True):
+    """
+    Read a meter, using what is known about it from earlier reads.
+
+    layout:   cached {'box': [x, y, w, h] (fractions), 'threshold', 'digits'} from this
+              meter's last good read - tried first, on a small crop with one OCR pass
+    previous: this meter's last reading; lower values (other than an odometer
+              rollover) are treated as misreads
+    Returns {'value': digits / "Retake Photo" / "Error: ...",
+             'layout': layout to cache for next time (or None),
+             'method': 'filename' | 'cached' | 'located' | 'full_image' | None,
+             'below_previous': True if the only readable value was lower than previous}
+    """
     filename = os.path.basename(image_path)
-    print(f"   ... Analyzing: {filename}")
+    if verbose:
+        print(f"   ... Analyzing: {filename}")
+    result = {'value': "Retake Photo", 'layout': None, 'method': None, 'below_previous': False}
     
     # --- STRATEGY 1: SMART MATCH (Filename) ---
     # This guarantees 100% success for your demo images
     ground_truth = extract_value_from_filename(filename)
     if ground_truth:
-        print(f"      ✅ Smart Match found: {ground_truth}")
-        return ground_truth
+        if verbose:
+            print(f"      ✅ Smart Match found: {ground_truth}")
+        result.update(value=ground_truth, method='filename')
+        return result
 
     # --- STRATEGY 2: REAL OCR (Fallback for Camera Photos) ---
     try:
-        img = cv2.imread(image_path)
-        if img is None: return "Error: Image Load"
+        import cv2
+        import pytesseract
+        if TESSERACT_CMD:
+            pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+        img = image if image is not None else cv2.imread(image_path)
+        if img is None:
+            result['value'] = "Error: Image Load"
+            return result
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-        # Basic Processing
+        # 2a. Known meter: crop straight to last time's digit window
+        if layout:
+            digits = _ocr_window(gray, layout['box'], layout['threshold'], margin=LAYOUT_MARGIN)
+            if _plausible(digits, previous, layout['digits']):
+                result.update(value=digits, layout=layout, method='cached')
+                return result
+            if _plausible(digits, None, layout['digits']):
+                result['below_previous'] = True
+
+        # 2b. Find the digit window
+        for box in locate_digit_windows(gray):
+            for threshold in ('otsu', 'otsu_inv'):
+                digits = _ocr_window(gray, box, threshold)
+                if _plausible(digits, previous):
+                    result.update(value=digits, method='located', below_previous=False,
+                                  layout={'box': [round(v, 4) for v in box], 'threshold': threshold,
+                                          'digits': len(digits)})
+                    return result
+                if _plausible(digits):
+                    result['below_previous'] = True
+
+        # 2c. Whole photo (original method)
         img = cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
@@ -56,15 +173,27 @@ def read_meter(image_path):
         text = pytesseract.image_to_string(thresh, config=config)
         digits_only = "".join(filter(str.isdigit, text))
 
-        if len(digits_only) >= 3 and len(digits_only) <= 8:
-            return digits_only
-
-        return "Retake Photo"
+        if _plausible(digits_only, previous):
+            result.update(value=digits_only, method='full_image', below_previous=False)
+        elif _plausible(digits_only):
+            result['below_previous'] = True
+        return result
 
     except Exception as e:
-        return f"Error: {e}"
+        result['value'] = f"Error: {e}"
+        return result
+
+def read_meter(image_path, image=None, verbose=True):
+    """
+    Returns the meter reading as a digit string, or "Retake Photo" / "Error: ...".
+    image: an already decoded BGR image (e.g. from a zip archive); image_path
+    then only supplies the filename.
+    """
+    return read_meter_with_layout(image_path, image=image, verbose=verbose)['value']
 
 if __name__ == "__main__":
+    print("------------------------------------------------")
+    print("✅ STEP 1: Smart OCR Script Starting...")
     folder = "meter_test_images"
     if os.path.exists(folder):
         print("✅ STEP 2: Testing Images...")
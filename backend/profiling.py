@@ -0,0 +1,285 @@
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from functools import wraps
+
+# On-demand profiling of a live worker (served by the /admin/profile/* routes).
+#
+# - CPU windows: for N seconds, either sample the stacks of threads serving
+#   the inference endpoints (low overhead, collapsed-stack output for
+#   flamegraph.pl / speedscope) or run cProfile inside each of those requests
+#   and merge the results (pstats).
+# - Memory: tracemalloc snapshots of the top allocation sites, each diffed
+#   against the previous one.
+# - Single requests: an admin can add "X-Profile: 1" (or ?profile=1) to any
+#   request; its cProfile is saved under PROFILE_DIR and named in the
+#   X-Profile-Id response header.
+#
+# Everything is per process: with several gunicorn workers, each response
+# says which worker (pid) it describes.
+
+# 🔧 CONFIGURATION
+MAX_WINDOW_SECONDS = 120      # Longest CPU profiling window
+SAMPLE_INTERVAL = 0.005       # Seconds between stack samples
+PROFILE_DIR = "../data/profiles"
+KEEP_REQUEST_PROFILES = 50    # Older per-request profiles are deleted
+TRACEMALLOC_FRAMES = 10       # Stack depth recorded per allocation
+
+# Threads currently inside a tracked endpoint: thread id -> (endpoint, view frame)
+_tracked = {}
+_window = None
+_window_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Another CPU profiling window is already running in this worker"""
+
+
+class _Window:
+    def __init__(self, mode, endpoints):
+        self.mode = mode
+        self.endpoints = endpoints
+        self.samples = Counter()
+        self.sample_count = 0
+        self.stats = None
+        self.requests = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def add_profile(self, profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.requests += 1
+
+
+def track(endpoint):
+    """View decorator: make an endpoint visible to CPU profiling windows"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            ident = threading.get_ident()
+            _tracked[ident] = (endpoint, sys._getframe())
+            window = _window
+            profile = None
+            if window and window.mode == 'cprofile' and endpoint in window.endpoints:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # A per-request profile already runs in this thread
+                    window.skipped += 1
+                    profile = None
+            try:
+                return view(*args, **kwargs)
+            finally:
+                if profile:
+                    profile.disable()
+                    window.add_profile(profile)
+                _tracked.pop(ident, None)
+        return wrapper
+    return decorator
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _sample_loop(window, stop):
+    while not stop.wait(SAMPLE_INTERVAL):
+        frames = sys._current_frames()
+        window.sample_count += 1
+        for ident, (endpoint, view_frame) in list(_tracked.items()):
+            if endpoint not in window.endpoints:
+                continue
+            frame = frames.get(ident)
+            stack = []
+            # Walk from the running frame up to the endpoint's own frame
+            while frame is not None and frame is not view_frame:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if frame is None:
+                continue  # The request finished between the two lookups
+            stack.append(endpoint)
+            window.samples[';'.join(reversed(stack))] += 1
+
+
+def profile_cpu(seconds, endpoints, mode='sample'):
+    """
+    Profile the tracked endpoints for `seconds` (blocks meanwhile).
+    Returns the finished window (samples for 'sample', merged stats for 'cprofile').
+    """
+    global _window
+    seconds = min(float(seconds), MAX_WINDOW_SECONDS)
+    window = _Window(mode, set(endpoints))
+    with _window_lock:
+        if _window is not None:
+            raise ProfilerBusy()
+        _window = window
+
+    stop = threading.Event()
+    sampler = None
+    if mode == 'sample':
+        sampler = threading.Thread(target=_sample_loop, args=(window, stop), name='profiler-sampler', daemon=True)
+        sampler.start()
+    try:
+        time.sleep(seconds)
+    finally:
+        stop.set()
+        if sampler:
+            sampler.join()
+        with _window_lock:
+            _window = None
+    window.seconds = seconds
+    return window
+
+
+def collapsed(window):
+    """Sampled stacks in collapsed format ("frame;frame;frame count" per line)"""
+    return ''.join(f"{stack} {count}\n" for stack, count in window.samples.most_common())
+
+
+def stats_text(stats, top=40, sort='cumulative'):
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats(sort).print_stats(top)
+    return out.getvalue()
+
+
+def stats_bytes(stats):
+    """Marshalled pstats data (load with pstats.Stats(path) or snakeviz)"""
+    import marshal
+    return marshal.dumps(stats.stats)
+
+
+# ============================================
+# PER-REQUEST PROFILES
+# ============================================
+
+_request_local = threading.local()
+
+
+def start_request():
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        return False
+    _request_local.profile = profile
+    _request_local.started = time.perf_counter()
+    return True
+
+
+def finish_request(endpoint):
+    """Stop this thread's request profile and save it; returns (profile id, elapsed ms) or None"""
+    profile = getattr(_request_local, 'profile', None)
+    if profile is None:
+        return None
+    profile.disable()
+    elapsed_ms = (time.perf_counter() - _request_local.started) * 1000
+    _request_local.profile = None
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{endpoint or 'request'}-{int(elapsed_ms)}ms"
+    profile.dump_stats(os.path.join(PROFILE_DIR, profile_id + '.pstats'))
+
+    saved = sorted(os.listdir(PROFILE_DIR))
+    for old in saved[:-KEEP_REQUEST_PROFILES]:
+        os.remove(os.path.join(PROFILE_DIR, old))
+    return profile_id, elapsed_ms
+
+
+def request_profile_path(profile_id):
+    """Path of a saved per-request profile, or None (ids never contain path separators)"""
+    if not profile_id or os.path.basename(profile_id) != profile_id:
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + '.pstats')
+    return path if os.path.exists(path) else None
+
+
+def list_request_profiles():
+    if not os.path.exists(PROFILE_DIR):
+        return []
+    return sorted((name[:-len('.pstats')] for name in os.listdir(PROFILE_DIR) if name.endswith('.pstats')),
+                  reverse=True)
+
+
+# ============================================
+# MEMORY
+# ============================================
+
+_last_snapshot = None
+_memory_lock = threading.Lock()
+
+
+def _rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Peak, in KB on Linux
+
+
+def _site(stat):
+    frames = stat.traceback
+    return {'site': f"{frames[0].filename}:{frames[0].lineno}",
+            'traceback': [f"{f.filename}:{f.lineno}" for f in frames] if len(frames) > 1 else None}
+
+
+def memory_snapshot(top=25, group_by='lineno'):
+    """
+    Start tracing on the first call; afterwards take a snapshot and return the
+    top allocation sites plus the change since the previous snapshot.
+    """
+    global _last_snapshot
+    import tracemalloc
+
+    with _memory_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _last_snapshot = None
+            return {'pid': os.getpid(), 'tracing': True, 'started': True, 'rss_kb': _rss_kb(),
+                    'message': "Tracing started. Call again to take a snapshot."}
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            'pid': os.getpid(),
+            'tracing': True,
+            'rss_kb': _rss_kb(),
+            'traced_kb': current // 1024,
+            'traced_peak_kb': peak // 1024,
+            'top': [dict(_site(s), size_kb=round(s.size / 1024, 1), count=s.count)
+                    for s in snapshot.statistics(group_by)[:top]],
+        }
+        if _last_snapshot is not None:
+            result['diff'] = [dict(_site(s), size_kb=round(s.size / 1024, 1),
+                                   size_diff_kb=round(s.size_diff / 1024, 1), count_diff=s.count_diff)
+                              for s in snapshot.compare_to(_last_snapshot, group_by)[:top]]
+        _last_snapshot = snapshot
+        return result
+
+
+def stop_memory():
+    global _last_snapshot
+    import tracemalloc
+
+    with _memory_lock:
+        was_tracing = tracemalloc.is_tracing()
+        tracemalloc.stop()
+        _last_snapshot = None
+    return was_tracing
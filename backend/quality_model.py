@@ -1,38 +1,110 @@
-import cv2
-import numpy as np
-
 def extract_features(image_path):
     """
     Reads an image and returns 4 numbers:
     [Mean Hue, Mean Saturation, Mean Value, Texture Score]
     """
+    # Imported here so importing this module stays cheap at start-up
+    import cv2
+
     try:
         # 1. Read the image
         img = cv2.imread(image_path)
         if img is None:
             return None
-        
-        # 2. Resize to speed up processing (300x300 is enough for water)
-        img = cv2.resize(img, (300, 300))
-
-        # 3. Color Analysis (Convert to HSV)
-        # HSV = Hue (Color), Saturation (Intensity), Value (Brightness)
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(hsv)
-        
-        mean_hue = np.mean(h)
-        mean_sat = np.mean(s)
-        mean_val = np.mean(v)
-
-        # 4. Texture Analysis (Turbidity Detection)
-        # We turn it to Gray and measure "Laplacian Variance"
-        # High Variance = Sharp/Rough (Dirty particles)
-        # Low Variance = Smooth/Blurry (Clear liquid)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        texture_score = cv2.Laplacian(gray, cv2.CV_64F).var()
-
-        return [mean_hue, mean_sat, mean_val, texture_score]
+        return features_from_array(img)
 
     except Exception as e:
         print(f"Error reading {image_path}: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def features_from_array(img):
+    """Same features as extract_features, for an already decoded BGR image (e.g. a video frame)"""
+    import cv2
+    import numpy as np
+
+    # 2. Resize to speed up processing (300x300 is enough for water)
+    img = cv2.resize(img, (300, 300))
+
+    # 3. Color Analysis (Convert to HSV)
+    # HSV = Hue (Color), Saturation (Intensity), Value (Brightness)
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    h, s, v = cv2.split(hsv)
+    
+    mean_hue = np.mean(h)
+    mean_sat = np.mean(s)
+    mean_val = np.mean(v)
+
+    # 4. Texture Analysis (Turbidity Detection)
+    # We turn it to Gray and measure "Laplacian Variance"
+    # High Variance = Sharp/Rough (Dirty particles)
+    # Low Variance = Smooth/Blurry (Clear liquid)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    texture_score = cv2.Laplacian(gray, cv2.CV_64F).var()
+
+    return [mean_hue, mean_sat, mean_val, texture_score]
+
+
+def analyze_image(img, grid=6):
+    """
+    Global features plus the same 4 features for every tile of a grid x grid
+    layout, in one pass: each tile's sums come from 4 lookups in integral images
+    (sum and squared-sum tables), so the cost doesn't grow with the number of tiles.
+    Returns (global features, tiles array of shape (grid, grid, 4)).
+    """
+    import cv2
+    import numpy as np
+
+    img = cv2.resize(img, (300, 300))
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
+
+    hsv_sum = cv2.integral(hsv, sdepth=cv2.CV_64F)
+    lap_sum, lap_sq = cv2.integral2(laplacian, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+    edges = np.linspace(0, 300, grid + 1).astype(int)
+    y0, y1 = edges[:-1, None], edges[1:, None]
+    x0, x1 = edges[None, :-1], edges[None, 1:]
+
+    def box(table):
+        # Sum over every tile at once: bottom-right - top-right - bottom-left + top-left
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+    area = ((y1 - y0) * (x1 - x0)).astype(np.float64)
+    hsv_means = box(hsv_sum) / area[..., None]
+    lap_mean = box(lap_sum) / area
+    lap_var = box(lap_sq) / area - lap_mean ** 2
+    tiles = np.dstack([hsv_means, lap_var])
+
+    # Whole image = the single box spanning the tables
+    n = 300 * 300
+    mean_hue, mean_sat, mean_val = hsv_sum[-1, -1] / n
+    texture_score = lap_sq[-1, -1] / n - (lap_sum[-1, -1] / n) ** 2
+    return [float(mean_hue), float(mean_sat), float(mean_val), float(texture_score)], tiles
+
+
+def localize_contamination(model, tiles):
+    """
+    Score every tile in one batched model call.
+    Returns the unsafe-probability heatmap and the worst tile (box as image fractions).
+    """
+    import numpy as np
+
+    grid = tiles.shape[0]
+    classes = list(model.classes_)
+    if 1 not in classes:
+        return None
+    probabilities = model.predict_proba(tiles.reshape(-1, 4))[:, classes.index(1)]
+    heatmap = probabilities.reshape(grid, grid)
+
+    row, col = (int(i) for i in np.unravel_index(int(heatmap.argmax()), heatmap.shape))
+    return {
+        'grid': grid,
+        'heatmap': np.round(heatmap, 3).tolist(),
+        'worst_tile': {
+            'row': row, 'col': col,
+            'probability': round(float(heatmap[row, col]), 3),
+            'box': [col / grid, row / grid, 1 / grid, 1 / grid]
+        }
+    }
@@ -0,0 +1,131 @@
+"""
+AquaGuard AI - Production Server
+Runs app_enhanced.py under a multi-process / multi-thread WSGI server
+instead of the Flask debug server.
+
+Linux/macOS: gunicorn (pre-forked workers, recycling, timeouts). Workers are
+             gevent (one greenlet per connection, so thousands of idle live-update
+             streams are cheap) when gevent is installed and live updates are on,
+             otherwise gthread.
+Windows:     waitress (multi-threaded, single process)
+"""
+
+import os
+import sys
+import argparse
+import importlib.util
+
+# Live dashboard updates, unless AQUAGUARD_SSE=0
+SSE_WANTED = os.environ.get('AQUAGUARD_SSE', '1') != '0'
+GEVENT_INSTALLED = importlib.util.find_spec('gevent') is not None
+
+# 🔧 CONFIGURATION (every option can also be set through the environment)
+DEFAULT_BIND = os.environ.get('AQUAGUARD_BIND', '0.0.0.0:9000')
+DEFAULT_WORKERS = int(os.environ.get('AQUAGUARD_WORKERS', min((os.cpu_count() or 1) * 2 + 1, 8)))
+DEFAULT_THREADS = int(os.environ.get('AQUAGUARD_THREADS', 4))
+DEFAULT_WORKER_CLASS = os.environ.get('AQUAGUARD_WORKER_CLASS',
+                                      'gevent' if SSE_WANTED and GEVENT_INSTALLED else 'gthread')
+DEFAULT_WORKER_CONNECTIONS = int(os.environ.get('AQUAGUARD_WORKER_CONNECTIONS', 1000))
+DEFAULT_TIMEOUT = int(os.environ.get('AQUAGUARD_TIMEOUT', 60))
+DEFAULT_GRACEFUL_TIMEOUT = int(os.environ.get('AQUAGUARD_GRACEFUL_TIMEOUT', 30))
+DEFAULT_MAX_REQUESTS = int(os.environ.get('AQUAGUARD_MAX_REQUESTS', 1000))
+DEFAULT_MAX_REQUESTS_JITTER = int(os.environ.get('AQUAGUARD_MAX_REQUESTS_JITTER', 100))
+# Worker classes where an open live-update stream costs a greenlet, not one of a few threads
+STREAMING_WORKER_CLASSES = ('gevent', 'eventlet')
+
+
+def load_app():
+    """
+    Import the Flask app and load the model in the master process.
+    Workers forked afterwards share these memory pages copy-on-write.
+    """
+    from app_enhanced import app, warmup
+    warmup()
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run AquaGuard AI with a production WSGI server")
+    parser.add_argument('--bind', default=DEFAULT_BIND, help="host:port to listen on")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Worker processes")
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help="Threads per worker (gthread)")
+    parser.add_argument('--worker-class', default=DEFAULT_WORKER_CLASS,
+                        help="gunicorn worker class: gevent (default when installed; serves live updates), "
+                             "gthread or sync")
+    parser.add_argument('--worker-connections', type=int, default=DEFAULT_WORKER_CONNECTIONS,
+                        help="Open connections per gevent worker")
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT,
+                        help="Seconds before a stuck worker is killed and replaced")
+    parser.add_argument('--graceful-timeout', type=int, default=DEFAULT_GRACEFUL_TIMEOUT,
+                        help="Seconds a recycled worker gets to finish in-flight requests")
+    parser.add_argument('--max-requests', type=int, default=DEFAULT_MAX_REQUESTS,
+                        help="Recycle a worker after this many requests (0 = never)")
+    parser.add_argument('--max-requests-jitter', type=int, default=DEFAULT_MAX_REQUESTS_JITTER,
+                        help="Random spread so workers don't all recycle at once")
+    return parser.parse_args(argv)
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class AquaGuardApplication(BaseApplication):
+        def __init__(self, app, options):
+            self.application = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    # Set before the app is imported (events.py reads it at import time)
+    os.environ['AQUAGUARD_SSE'] = '1' if SSE_WANTED and args.worker_class in STREAMING_WORKER_CLASSES else '0'
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': args.worker_class,
+        'worker_connections': args.worker_connections,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'preload_app': True,
+        'accesslog': '-',
+    }
+    AquaGuardApplication(load_app(), options).run()
+
+
+def run_waitress(args):
+    from waitress import serve
+
+    # Every stream would hold one of the fixed pool's threads
+    os.environ['AQUAGUARD_SSE'] = '0'
+    host, _, port = args.bind.rpartition(':')
+    # waitress has no worker processes, so give it the combined thread budget
+    serve(load_app(), host=host or '0.0.0.0', port=int(port),
+          threads=max(args.workers * args.threads, 4),
+          channel_timeout=args.timeout)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"🚀 Production server on {args.bind}")
+    if sys.platform == 'win32':
+        print(f"   waitress: {max(args.workers * args.threads, 4)} threads")
+        run_waitress(args)
+    elif args.worker_class == 'gevent':
+        # Patch before anything creates a lock or thread: the app is imported
+        # here (preloaded), before gunicorn's worker would patch it
+        from gevent import monkey
+        monkey.patch_all()
+        print(f"   gunicorn: {args.workers} gevent workers x {args.worker_connections} connections")
+        run_gunicorn(args)
+    else:
+        print(f"   gunicorn: {args.workers} workers x {args.threads} threads ({args.worker_class})")
+        if SSE_WANTED and args.worker_class not in STREAMING_WORKER_CLASSES:
+            print("   live dashboard updates off (pip install gevent, or use --worker-class gevent)")
+        run_gunicorn(args)
@@ -0,0 +1,197 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+from functools import lru_cache
+
+# SQL tracing for every database connection storage.py hands out.
+#
+# - Each statement's time (execute, plus fetching rows for SQLite, where rows
+#   are computed as they are fetched) is added to per-fingerprint totals:
+#   the statement with literals and IN lists collapsed, so the same query
+#   with different values is counted once.
+# - Statements slower than SLOW_MS are appended to SLOW_LOG with their query
+#   plan and the id of the request that ran them (X-Request-Id).
+# - Commits are timed as "COMMIT" (that's where SQLite waits for the disk).
+#
+# Totals are per process: with several gunicorn workers, each response from
+# /admin/sql/stats describes the worker (pid) that served it.
+
+# 🔧 CONFIGURATION
+ENABLED = os.environ.get('AQUAGUARD_SQL_TRACE', '1') != '0'
+SLOW_MS = float(os.environ.get('AQUAGUARD_SQL_SLOW_MS', 100))
+SLOW_LOG = os.environ.get('AQUAGUARD_SQL_SLOW_LOG', "../data/slow_queries.log")
+# Print every statement SQLite runs, with its values (local debugging only: values include user data)
+LOG_ALL = os.environ.get('AQUAGUARD_SQL_TRACE_ALL') == '1'
+MAX_FINGERPRINTS = 2000       # Statements past this many distinct fingerprints are counted as "other"
+
+_stats = {}
+_stats_since = time.time()
+_stats_lock = threading.Lock()
+_log_lock = threading.Lock()
+_request = threading.local()
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement):
+    """(short id, normalized text) of a statement"""
+    text = _SPACE.sub(' ', statement).strip()
+    text = _STRING.sub('?', text)
+    text = _NUMBER.sub('?', text)
+    text = _IN_LIST.sub('(?, ...)', text)
+    return hashlib.sha1(text.encode()).hexdigest()[:12], text
+
+
+# ============================================
+# REQUEST CORRELATION
+# ============================================
+
+def start_request(request_id, endpoint=None):
+    _request.id = request_id
+    _request.endpoint = endpoint
+    _request.count = 0
+    _request.ms = 0.0
+
+
+def request_totals():
+    """(statements, milliseconds) of SQL run so far by this thread's request"""
+    return getattr(_request, 'count', 0), getattr(_request, 'ms', 0.0)
+
+
+def finish_request():
+    _request.id = _request.endpoint = None
+    _request.count, _request.ms = 0, 0.0
+
+
+def current_request_id():
+    return getattr(_request, 'id', None)
+
+
+# ============================================
+# RECORDING (called by storage.py)
+# ============================================
+
+class Statement:
+    """One execution being timed; fetches on the same cursor add to it"""
+    __slots__ = ('fingerprint', 'statement', 'params', 'ms', 'logged', 'explain')
+
+    def __init__(self, statement, params, explain):
+        self.fingerprint = fingerprint(statement)
+        self.statement = statement
+        self.params = params
+        self.ms = 0.0
+        self.logged = False
+        self.explain = explain
+
+
+def executed(statement, params, seconds, explain=None):
+    """Record an execute(); explain(statement, params) returns the query plan lines. Returns the Statement."""
+    traced = Statement(statement, params, explain)
+    _add(traced, seconds, new=True)
+    return traced
+
+
+def fetched(traced, seconds):
+    """Add row-fetching time to the statement that produced the rows"""
+    if traced is not None:
+        _add(traced, seconds, new=False)
+
+
+def _add(traced, seconds, new):
+    ms = seconds * 1000
+    traced.ms += ms
+    fp, text = traced.fingerprint
+    with _stats_lock:
+        entry = _stats.get(fp)
+        if entry is None:
+            if len(_stats) >= MAX_FINGERPRINTS:
+                fp, text = 'other', 'other statements'
+                entry = _stats.get(fp)
+            if entry is None:
+                entry = _stats[fp] = {'fingerprint': fp, 'statement': text, 'count': 0,
+                                      'total_ms': 0.0, 'max_ms': 0.0, 'slow': 0}
+        entry['total_ms'] += ms
+        if new:
+            entry['count'] += 1
+        entry['max_ms'] = max(entry['max_ms'], traced.ms)
+        if traced.ms >= SLOW_MS and not traced.logged:
+            entry['slow'] += 1
+    if hasattr(_request, 'count'):
+        _request.count += new
+        _request.ms += ms
+    if traced.ms >= SLOW_MS and not traced.logged:
+        traced.logged = True
+        _log_slow(traced)
+
+
+def _log_slow(traced):
+    plan = None
+    if traced.explain and _EXPLAINABLE.match(traced.statement):
+        try:
+            plan = traced.explain(traced.statement, traced.params)
+        except Exception as e:
+            # e.g. PostgreSQL after an error aborted the transaction
+            plan = [f"(no plan: {e})"]
+    fp, text = traced.fingerprint
+    # Values are left out on purpose: they hold users' data
+    entry = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'pid': os.getpid(),
+        'request_id': current_request_id(),
+        'endpoint': getattr(_request, 'endpoint', None),
+        'ms': round(traced.ms, 1),
+        'fingerprint': fp,
+        'statement': text,
+        'plan': plan,
+    }
+    print(f"🐢 Slow SQL ({entry['ms']} ms, request {entry['request_id']}): {text[:120]}")
+    with _log_lock:
+        os.makedirs(os.path.dirname(SLOW_LOG) or '.', exist_ok=True)
+        with open(SLOW_LOG, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+
+def log_statement(statement):
+    """sqlite3 trace callback (LOG_ALL): every statement SQLite runs, including implicit BEGIN/COMMIT"""
+    print(f"🔎 [{current_request_id() or '-'}] {statement}")
+
+
+# ============================================
+# REPORTS
+# ============================================
+
+def stats(top=50, sort='total_ms'):
+    with _stats_lock:
+        entries = [dict(e) for e in _stats.values()]
+    for e in entries:
+        e['mean_ms'] = round(e['total_ms'] / e['count'], 3) if e['count'] else 0.0
+        e['total_ms'] = round(e['total_ms'], 1)
+        e['max_ms'] = round(e['max_ms'], 1)
+    entries.sort(key=lambda e: e[sort], reverse=True)
+    return {'pid': os.getpid(), 'since': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(_stats_since)),
+            'slow_ms': SLOW_MS, 'fingerprints': len(entries), 'statements': entries[:top]}
+
+
+def reset():
+    global _stats_since
+    with _stats_lock:
+        _stats.clear()
+        _stats_since = time.time()
+
+
+def slow_entries(limit=100):
+    """Newest entries of the slow-query log (all processes write to it)"""
+    if not os.path.exists(SLOW_LOG):
+        return []
+    with _log_lock, open(SLOW_LOG) as f:
+        lines = deque(f, maxlen=limit)
+    return [json.loads(line) for line in reversed(lines) if line.strip()]
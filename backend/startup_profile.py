@@ -0,0 +1,83 @@
+"""
+AquaGuard AI - Startup Profiler
+Measures how long a fresh worker takes to become ready and which modules
+dominate import time (uses Python's -X importtime in a clean interpreter).
+
+Usage: python startup_profile.py [--warmup] [--top 15]
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs inside the child interpreter; the last stdout line is the JSON result
+CHILD_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import app_enhanced
+t1 = time.perf_counter()
+app_enhanced.ensure_db()
+t2 = time.perf_counter()
+phases = {'import app_enhanced': t1 - t0, 'init database': t2 - t1}
+if sys.argv[1] == 'warmup':
+    app_enhanced.warmup()
+    phases['warmup (model + OCR/CV libraries)'] = time.perf_counter() - t2
+print(json.dumps(phases))
+"""
+
+
+def parse_importtime(stderr):
+    """Sum self-time per top-level package from -X importtime output (microseconds)"""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # "import time:  <self us> | <cumulative us> | <indented module name>"
+        try:
+            self_part, _, name = line.split('|')
+            self_us = int(self_part.split(':')[1])
+        except ValueError:
+            continue
+        root = name.strip().split('.')[0]
+        totals[root] = totals.get(root, 0) + self_us
+    return totals
+
+
+def profile(warmup=False):
+    started = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD_SCRIPT, 'warmup' if warmup else 'cold'],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if started.returncode != 0:
+        raise RuntimeError(started.stderr.strip().splitlines()[-1])
+
+    phases = json.loads(started.stdout.strip().splitlines()[-1])
+    return phases, parse_importtime(started.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report AquaGuard AI start-up cost")
+    parser.add_argument('--warmup', action='store_true',
+                        help="Also time the eager warm-up done by the production server")
+    parser.add_argument('--top', type=int, default=15, help="Number of packages to list")
+    args = parser.parse_args(argv)
+
+    print("⏱️  Profiling worker start-up...")
+    phases, modules = profile(args.warmup)
+
+    print("\n   🚦 Time to ready:")
+    for name, seconds in phases.items():
+        print(f"   {name:<40} {seconds * 1000:8.1f} ms")
+    print(f"   {'TOTAL':<40} {sum(phases.values()) * 1000:8.1f} ms")
+
+    print(f"\n   📦 Import time by package (top {args.top}):")
+    for name, us in sorted(modules.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f"   {name:<40} {us / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
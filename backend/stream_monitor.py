@@ -0,0 +1,221 @@
+"""
+AquaGuard AI - Stream Monitor
+Watches fixed cameras over sample channels (video files, RTSP or HTTP/MJPEG
+streams, or local camera indexes) and records a quality reading only when the
+smoothed water state changes.
+
+Per feed: frames are sampled at SAMPLE_FPS, near-identical samples reuse the
+previous score (cheap thumbnail difference), the rest go through
+features_from_array + the model, and predictions are averaged over a window
+with hysteresis so a single odd frame can't flip the state.
+
+Usage:
+    python stream_monitor.py --user 1 --feed channel-a=rtsp://10.0.0.5/live --feed channel-b=sample.mp4
+"""
+
+import os
+import time
+import argparse
+import threading
+from collections import deque
+
+from quality_model import features_from_array
+from inference import get_model, MODEL_PATH
+
+# 🔧 CONFIGURATION
+SAMPLE_FPS = 1.0          # Frames scored per second of video, per feed
+DIFF_SIZE = 32            # Samples are compared as DIFF_SIZE x DIFF_SIZE grayscale thumbnails
+DIFF_THRESHOLD = 3.0      # Mean gray-level change below which a sample counts as unchanged
+SMOOTHING_WINDOW = 5      # Samples averaged before deciding the state
+UNSAFE_ENTER = 0.6        # Smoothed unsafe probability that switches the state to UNSAFE
+UNSAFE_EXIT = 0.4         # ...and back to SAFE (the gap stops flapping)
+RECONNECT_SECONDS = 5     # Wait before reopening a dropped live stream
+
+
+def parse_source(source):
+    """Camera indexes are given as plain numbers; anything else is a path or URL"""
+    return int(source) if source.isdigit() else source
+
+
+class FeedMonitor:
+    def __init__(self, name, source, user_id, sample_fps=SAMPLE_FPS, window=SMOOTHING_WINDOW,
+                 diff_threshold=DIFF_THRESHOLD, dry_run=False):
+        self.name = name
+        self.source = parse_source(source)
+        self.user_id = user_id
+        self.interval = 1.0 / sample_fps
+        self.diff_threshold = diff_threshold
+        self.dry_run = dry_run
+        # Files are sampled on video time (processed as fast as possible), streams on wall time
+        self.is_file = isinstance(self.source, str) and os.path.exists(self.source)
+
+        self.window = deque(maxlen=window)
+        self.state = None
+        self._last_thumb = None
+        self._last_prob = None
+        self._last_features = None
+
+        self.frames = 0
+        self.sampled = 0
+        self.scored = 0
+        self.changes = 0
+
+    def _unsafe_probability(self, features):
+        model = get_model()
+        probabilities = model.predict_proba([features])[0]
+        classes = list(model.classes_)
+        return float(probabilities[classes.index(1)]) if 1 in classes else 0.0
+
+    def observe(self, frame):
+        """Feed one sampled frame; returns the new state if it changed, else None"""
+        import cv2
+
+        self.sampled += 1
+        thumb = cv2.cvtColor(cv2.resize(frame, (DIFF_SIZE, DIFF_SIZE), interpolation=cv2.INTER_AREA),
+                             cv2.COLOR_BGR2GRAY)
+
+        # Compared with the last *scored* sample, so slow drift still triggers a re-score
+        if self._last_thumb is None or cv2.absdiff(thumb, self._last_thumb).mean() >= self.diff_threshold:
+            self._last_features = features_from_array(frame)
+            self._last_prob = self._unsafe_probability(self._last_features)
+            self._last_thumb = thumb
+            self.scored += 1
+        self.window.append(self._last_prob)
+
+        if len(self.window) < self.window.maxlen:
+            return None
+        smoothed = sum(self.window) / len(self.window)
+        if self.state is None:
+            # First decision for this feed: no previous state to hold on to
+            new_state = 'UNSAFE' if smoothed >= 0.5 else 'SAFE'
+        elif self.state != 'UNSAFE' and smoothed >= UNSAFE_ENTER:
+            new_state = 'UNSAFE'
+        elif self.state != 'SAFE' and smoothed <= UNSAFE_EXIT:
+            new_state = 'SAFE'
+        else:
+            return None
+
+        self.state = new_state
+        self.changes += 1
+        self._record(new_state, smoothed, frame)
+        return new_state
+
+    def _record(self, state, smoothed, frame):
+        """Save a reading (and, for UNSAFE, its alert) with the frame that caused the change"""
+        confidence = (smoothed if state == 'UNSAFE' else 1 - smoothed) * 100
+        print(f"   {'🚨' if state == 'UNSAFE' else '✅'} [{self.name}] Water is now {state} "
+              f"({confidence:.1f}% over {len(self.window)} samples)")
+        if self.dry_run:
+            return
+
+        import cv2
+        import image_store
+        from database import save_quality_reading
+
+        image_ref = None
+        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if ok:
+            image_ref, _ = image_store.put(buf.tobytes())
+        save_quality_reading(
+            self.user_id,
+            state,
+            int(100 - confidence) if state == 'UNSAFE' else int(confidence),
+            self._last_features,
+            'HIGH' if state == 'UNSAFE' else 'NONE',
+            image_ref,
+            self.name,
+            f"Stream monitor: state change over {len(self.window)} samples"
+        )
+
+    def run(self, stop_event):
+        import cv2
+
+        next_sample = 0.0
+        while not stop_event.is_set():
+            cap = cv2.VideoCapture(self.source)
+            if not cap.isOpened():
+                if self.is_file:
+                    print(f"❌ [{self.name}] Could not open {self.source}")
+                    return
+                print(f"⚠️ [{self.name}] Stream unavailable, retrying in {RECONNECT_SECONDS}s")
+                stop_event.wait(RECONNECT_SECONDS)
+                continue
+
+            # grab() only demuxes/decodes; the frame is converted (retrieve) only when sampled
+            while not stop_event.is_set() and cap.grab():
+                self.frames += 1
+                now = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000 if self.is_file else time.monotonic()
+                if now < next_sample:
+                    continue
+                next_sample = now + self.interval
+                ok, frame = cap.retrieve()
+                if ok:
+                    self.observe(frame)
+            cap.release()
+
+            if self.is_file:
+                return
+            if not stop_event.is_set():
+                print(f"⚠️ [{self.name}] Stream ended, reconnecting in {RECONNECT_SECONDS}s")
+                stop_event.wait(RECONNECT_SECONDS)
+
+
+def monitor_feeds(monitors):
+    """Run every feed on its own thread until the files end or Ctrl+C"""
+    import cv2
+
+    if len(monitors) > 1:
+        # Feeds already run in parallel; stop OpenCV from oversubscribing the cores
+        cv2.setNumThreads(1)
+    # One copy shared by every feed (inference.py), reloaded when train_model.py replaces it
+    if get_model() is None:
+        raise FileNotFoundError(f"No trained model at {MODEL_PATH}; run train_model.py first")
+
+    stop_event = threading.Event()
+    threads = [threading.Thread(target=m.run, args=(stop_event,), name=f"feed-{m.name}", daemon=True)
+               for m in monitors]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(timeout=0.5)
+    except KeyboardInterrupt:
+        print("\n⏹️  Stopping feeds...")
+        stop_event.set()
+        for t in threads:
+            t.join()
+
+    elapsed = time.perf_counter() - started
+    print(f"\n📊 Monitored {len(monitors)} feeds for {elapsed:.1f}s")
+    for m in monitors:
+        print(f"   [{m.name}] frames: {m.frames}, sampled: {m.sampled}, scored: {m.scored}, "
+              f"state changes: {m.changes}, state: {m.state or 'UNKNOWN'}")
+
+
+def parse_feed(value):
+    """NAME=SOURCE, or just SOURCE (named after the file/URL)"""
+    name, sep, source = value.partition('=')
+    if not sep or '://' in name:
+        source = value
+        name = os.path.basename(value.rstrip('/')) or value
+    return name, source
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monitor water quality from video files or camera streams")
+    parser.add_argument('--user', type=int, required=True, help="User the readings and alerts belong to")
+    parser.add_argument('--feed', action='append', required=True, metavar='NAME=SOURCE',
+                        help="Video file, rtsp:// or http:// stream, or camera index (repeatable)")
+    parser.add_argument('--fps', type=float, default=SAMPLE_FPS, help="Samples per second per feed")
+    parser.add_argument('--window', type=int, default=SMOOTHING_WINDOW, help="Samples averaged per decision")
+    parser.add_argument('--diff-threshold', type=float, default=DIFF_THRESHOLD,
+                        help="Mean gray-level change needed to re-score a sample")
+    parser.add_argument('--dry-run', action='store_true', help="Print state changes without saving them")
+    args = parser.parse_args()
+
+    monitors = [FeedMonitor(name, source, args.user, args.fps, args.window, args.diff_threshold, args.dry_run)
+                for name, source in map(parse_feed, args.feed)]
+    print(f"🎥 Monitoring {len(monitors)} feeds at {args.fps} samples/s (window {args.window})")
+    monitor_feeds(monitors)
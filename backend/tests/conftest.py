@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The backend modules are flat and use paths relative to backend/, like the app
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+os.chdir(BACKEND)
+
+# Files shared by every process are kept out of ../data while testing
+_SCRATCH = tempfile.mkdtemp(prefix='aquaguard-tests-')
+os.environ.setdefault('AQUAGUARD_SSE', '0')
+os.environ.setdefault('AQUAGUARD_EVENT_LOG', os.path.join(_SCRATCH, 'events.log'))
+
+import sql_trace    # noqa: E402
+import http_cache   # noqa: E402
+
+sql_trace.SLOW_LOG = os.path.join(_SCRATCH, 'slow_queries.log')
+http_cache.VERSION_FILE = os.path.join(_SCRATCH, 'data_versions.bin')
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """A fresh single-file SQLite database (and image store)"""
+    import database
+    import image_store
+    monkeypatch.setattr(database, 'DATABASE_URL', None)
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'aquaguard.db'))
+    monkeypatch.setattr(image_store, 'STORE_ROOT', str(tmp_path / 'store'))
+    database.init_db()
+    return database
+
+
+@pytest.fixture
+def sharded_db(tmp_path, monkeypatch):
+    """A fresh SQLite database split over 3 shards"""
+    import database
+    import image_store
+    monkeypatch.setattr(database, 'DATABASE_URL', f"sqlite+sharded:///{tmp_path}/sharded?shards=3")
+    monkeypatch.setattr(image_store, 'STORE_ROOT', str(tmp_path / 'store'))
+    database.init_db()
+    return database
@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+import area_stats
+from batch_score import DbSink
+
+LOCATIONS = ['Ward 5, North', 'ward 5 north', 'São Paulo', None, '']
+METERS = [None, '', 'M1', 'M2']
+
+
+@pytest.fixture(params=['sqlite_db', 'sharded_db'])
+def db(request):
+    return request.getfixturevalue(request.param)
+
+
+def _aggregates(database):
+    tables = []
+    for _, conn in database.shard_connections():
+        tables.append((
+            sorted(tuple(r) for r in conn.execute('SELECT * FROM area_quality_hourly')),
+            sorted(tuple(r) for r in conn.execute('SELECT * FROM area_usage_daily')),
+        ))
+        conn.close()
+    return tables
+
+
+def _rebuilt(database):
+    for _, conn in database.shard_connections():
+        area_stats.rebuild(conn)
+        conn.commit()
+        conn.close()
+    return _aggregates(database)
+
+
+def _expected_deltas(database):
+    """usage_delta recomputed in Python: increase over the same meter's previous reading, never < 0"""
+    deltas, stored = {}, {}
+    for _, conn in database.shard_connections():
+        previous = {}
+        for row in conn.execute('SELECT id, user_id, meter_id, reading_value, usage_delta '
+                                'FROM meter_readings ORDER BY id'):
+            key = (row['user_id'], row['meter_id'] or '')
+            deltas[row['id']] = max(0, row['reading_value'] - previous[key]) if key in previous else 0
+            stored[row['id']] = row['usage_delta']
+            previous[key] = row['reading_value']
+        conn.close()
+    return deltas, stored
+
+
+def _ids(database, user_id, table):
+    conn = database.get_db(user_id)
+    ids = [row[0] for row in conn.execute(f'SELECT id FROM {table} WHERE user_id = ? ORDER BY id', (user_id,))]
+    conn.close()
+    return ids
+
+
+def test_incremental_aggregates_match_a_rebuild(db):
+    rng = random.Random(7)
+    users = [db.create_user(f'u{i}', f'u{i}@example.com', 'password123', 'U') for i in range(3)]
+
+    for i in range(60):
+        user_id = rng.choice(users)
+        location = rng.choice(LOCATIONS)
+        db.save_quality_reading(user_id, rng.choice(['SAFE', 'UNSAFE']), rng.randint(0, 100),
+                                [1, 2, 3, 4], 'LOW', location=location)
+        db.save_meter_reading(user_id, rng.randint(0, 5000), False, 'tip',
+                              meter_id=rng.choice(METERS), location=location)
+    # Historical imports land in other hours and days
+    for n, user_id in enumerate(users):
+        sink = DbSink(f'job{n}', user_id, rng.choice(METERS), rng.choice(LOCATIONS))
+        rows = [{'error': None, 'source': f'{n}-{i}.jpg', 'taken_at': f'2026-03-{1 + i % 5:02d} {i % 24:02d}:00:00',
+                 'safety_status': rng.choice(['SAFE', 'UNSAFE']), 'safety_score': 50, 'mean_hue': 1,
+                 'mean_saturation': 1, 'mean_value': 1, 'texture_score': 1,
+                 'meter_reading': str(rng.randint(0, 5000))} for i in range(20)]
+        sink.write(0, rows)
+
+    # Deletes by id (first, middle and last readings of meters) and by time range
+    for user_id in users:
+        meter_ids = _ids(db, user_id, 'meter_readings')
+        db.delete_readings(user_id, 'meter', ids=rng.sample(meter_ids, len(meter_ids) // 3))
+        db.delete_readings(user_id, 'quality', ids=rng.sample(_ids(db, user_id, 'quality_readings'), 5))
+    db.delete_readings(users[0], 'meter', start='2026-03-02', end='2026-03-04')
+    db.delete_readings(users[1], 'quality', start='2026-03-01', end='2026-03-03')
+
+    deltas, stored = _expected_deltas(db)
+    assert stored == deltas
+    incremental = _aggregates(db)
+    assert any(quality and usage for quality, usage in incremental)
+    assert incremental == _rebuilt(db)
+
+
+def test_deleting_a_meter_reading_rebases_the_next_one(db):
+    user_id = db.create_user('max', 'max@example.com', 'password123', 'Max')
+    ids = [db.save_meter_reading(user_id, value, False, 'tip', meter_id='M1', location='Ward 1')
+           for value in (100, 130, 90, 200)]
+    db.delete_readings(user_id, 'meter', ids=[ids[2]])   # The register "reset" was a misread
+
+    deltas, stored = _expected_deltas(db)
+    assert [stored[i] for i in ids if i in stored] == [0, 30, 70]
+    assert stored == deltas
+    assert [a['total_usage'] for a in area_stats.consumption_by_area(7, 10)] == [100]
+    assert _aggregates(db) == _rebuilt(db)
@@ -0,0 +1,45 @@
+def _alerts_for(database, user_id, column, reading_id):
+    conn = database.get_db(user_id)
+    count = conn.execute(f'SELECT COUNT(*) FROM alerts WHERE {column} = ?', (reading_id,)).fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_delete_readings_cascades_to_alerts_and_feedback(sqlite_db):
+    user_id = sqlite_db.create_user('jo', 'jo@example.com', 'password123', 'Jo')
+    quality_id = sqlite_db.save_quality_reading(user_id, 'UNSAFE', 20, [1, 2, 3, 4], 'HIGH')
+    sqlite_db.save_quality_feedback(user_id, quality_id, 'UNSAFE')
+    meter_id = sqlite_db.save_meter_reading(user_id, 99999, True, 'tip')
+    assert _alerts_for(sqlite_db, user_id, 'quality_reading_id', quality_id) == 1
+    assert _alerts_for(sqlite_db, user_id, 'meter_reading_id', meter_id) == 1
+
+    sqlite_db.delete_readings(user_id, 'quality', ids=[quality_id])
+    sqlite_db.delete_readings(user_id, 'meter', ids=[meter_id])
+
+    assert _alerts_for(sqlite_db, user_id, 'quality_reading_id', quality_id) == 0
+    assert _alerts_for(sqlite_db, user_id, 'meter_reading_id', meter_id) == 0
+    conn = sqlite_db.get_db(user_id)
+    assert conn.execute('SELECT COUNT(*) FROM quality_feedback').fetchone()[0] == 0
+    conn.close()
+
+
+def test_no_cascade_without_cascade_deletes(sqlite_db):
+    user_id = sqlite_db.create_user('kai', 'kai@example.com', 'password123', 'Kai')
+    quality_id = sqlite_db.save_quality_reading(user_id, 'UNSAFE', 20, [1, 2, 3, 4], 'HIGH')
+
+    # Foreign keys stay off on ordinary connections
+    conn = sqlite_db.get_db(user_id)
+    conn.execute('DELETE FROM quality_readings WHERE id = ?', (quality_id,))
+    conn.commit()
+    conn.close()
+    assert _alerts_for(sqlite_db, user_id, 'quality_reading_id', quality_id) == 1
+
+
+def test_cascade_within_a_shard(sharded_db):
+    user_id = sharded_db.create_user('lee', 'lee@example.com', 'password123', 'Lee')
+    # Inserts work although the user's row lives in main.db, not in the shard
+    quality_id = sharded_db.save_quality_reading(user_id, 'UNSAFE', 20, [1, 2, 3, 4], 'HIGH')
+    assert _alerts_for(sharded_db, user_id, 'quality_reading_id', quality_id) == 1
+
+    assert sharded_db.delete_readings(user_id, 'quality', ids=[quality_id])[0] == 1
+    assert _alerts_for(sharded_db, user_id, 'quality_reading_id', quality_id) == 0
@@ -0,0 +1,27 @@
+def test_delete_publishes_ids_and_stat_deltas(sqlite_db, monkeypatch):
+    user_id = sqlite_db.create_user('fay', 'fay@example.com', 'password123', 'Fay')
+    # UNSAFE readings raise an alert; mark one of them read
+    ids = [sqlite_db.save_quality_reading(user_id, status, 50, [1, 2, 3, 4], 'LOW')
+           for status in ('SAFE', 'UNSAFE', 'UNSAFE', 'SAFE')]
+    conn = sqlite_db.get_db(user_id)
+    read_alert, unread_alert = [row[0] for row in conn.execute(
+        'SELECT id FROM alerts WHERE quality_reading_id IN (?, ?) ORDER BY id', (ids[1], ids[2]))]
+    conn.close()
+    sqlite_db.mark_alert_read(read_alert, user_id)
+
+    published = []
+    monkeypatch.setattr(sqlite_db, 'publish', lambda user, event, data: published.append((user, event, data)))
+    assert sqlite_db.delete_readings(user_id, 'quality', ids=ids[:3])[0] == 3
+
+    assert published == [
+        (user_id, 'readings_deleted', {'type': 'quality', 'ids': ids[:3], 'alert_ids': [unread_alert]}),
+        (user_id, 'stats', {'quality_total': -3, 'safe_count': -1, 'unsafe_count': -2, 'unread_alerts': -1}),
+    ]
+
+
+def test_delete_of_nothing_publishes_nothing(sqlite_db, monkeypatch):
+    user_id = sqlite_db.create_user('gus', 'gus@example.com', 'password123', 'Gus')
+    published = []
+    monkeypatch.setattr(sqlite_db, 'publish', lambda *args: published.append(args))
+    assert sqlite_db.delete_readings(user_id, 'meter', ids=[12345])[0] == 0
+    assert published == []
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+import image_store
+
+
+def _image(n):
+    return b'\xff\xd8\xff' + bytes([n]) * 64
+
+
+def _expire_leases(database):
+    """As if every upload had been taken well over GC_GRACE_MINUTES ago"""
+    conn = database.get_db()
+    conn.execute("UPDATE images SET referenced_at = '2000-01-01 00:00:00'")
+    conn.commit()
+    conn.close()
+
+
+def _save(database, user_id, ref):
+    return database.save_quality_reading(user_id, 'SAFE', 90, [1, 2, 3, 4], 'LOW', image_path=ref)
+
+
+@pytest.fixture(params=['sqlite_db', 'sharded_db'])
+def db(request):
+    return request.getfixturevalue(request.param)
+
+
+def test_gc_between_put_and_save_keeps_the_image(db):
+    user_id = db.create_user('ana', 'ana@example.com', 'password123', 'Ana')
+
+    ref, path = image_store.put(_image(1))
+    # The upload is still being classified: its reading isn't saved yet
+    assert image_store.collect_garbage() == (0, 0)
+    _save(db, user_id, ref)
+
+    assert os.path.exists(path)
+    assert image_store.lookup(ref)[0] == path
+    # Once the grace period is over the reading's reference is what counts
+    _expire_leases(db)
+    assert image_store.collect_garbage()[0] == 0
+    assert os.path.exists(path)
+
+
+def test_gc_collects_abandoned_uploads_after_the_grace_period(db):
+    user_id = db.create_user('ben', 'ben@example.com', 'password123', 'Ben')
+    kept, kept_path = image_store.put(_image(2))
+    _save(db, user_id, kept)
+    abandoned, abandoned_path = image_store.put(_image(3))   # Request failed before saving
+
+    assert image_store.collect_garbage() == (0, 0)
+    _expire_leases(db)
+    assert image_store.collect_garbage()[0] == 1
+
+    assert os.path.exists(kept_path)
+    assert not os.path.exists(abandoned_path)
+    assert image_store.lookup(abandoned) is None
+
+
+def test_second_upload_of_same_image_renews_the_lease(db):
+    user_id = db.create_user('cy', 'cy@example.com', 'password123', 'Cy')
+    ref, path = image_store.put(_image(4))
+    _save(db, user_id, ref)
+
+    # An old first reference, then the same bytes uploaded again
+    _expire_leases(db)
+    image_store.put(_image(4))
+
+    image_store.collect_garbage()
+    conn = db.get_db()
+    assert conn.execute('SELECT ref_count FROM images WHERE hash = ?', (ref,)).fetchone()[0] == 2
+    conn.close()
+    assert os.path.exists(path)
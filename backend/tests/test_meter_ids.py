@@ -0,0 +1,35 @@
+import usage_analytics
+
+
+def _deltas(database, user_id):
+    conn = database.get_db(user_id)
+    rows = [tuple(r) for r in conn.execute(
+        'SELECT meter_id, usage_delta FROM meter_readings WHERE user_id = ? ORDER BY id', (user_id,))]
+    conn.close()
+    return rows
+
+
+def test_null_and_empty_meter_ids_are_one_meter(sqlite_db):
+    user_id = sqlite_db.create_user('dee', 'dee@example.com', 'password123', 'Dee')
+    # Older readings and batch imports without --meter-id vs. the web form's ''
+    for value, meter_id in ((100, None), (150, ''), (170, None), (900, 'garden'), (175, '')):
+        last_id = sqlite_db.save_meter_reading(user_id, value, False, 'tip', meter_id=meter_id)
+
+    assert _deltas(sqlite_db, user_id) == [(None, 0), ('', 50), (None, 20), ('garden', 0), ('', 5)]
+
+    usage_analytics.reset_state()
+    state = usage_analytics.get_state(user_id, '', last_id + 1)
+    assert state.last_id == last_id and state.last_value == 175
+    assert usage_analytics.get_state(user_id, None, last_id + 1) is state
+
+
+def test_batch_import_without_meter_id_uses_the_unnamed_meter(sqlite_db, tmp_path):
+    from batch_score import DbSink
+
+    user_id = sqlite_db.create_user('eli', 'eli@example.com', 'password123', 'Eli')
+    sqlite_db.save_meter_reading(user_id, 100, False, 'tip', meter_id='')
+    sink = DbSink('job', user_id)
+    row = dict.fromkeys(['error', 'safety_status'], None)
+    sink.write(0, [dict(row, source='a.jpg', taken_at='2026-01-01 10:00:00', meter_reading='130')])
+
+    assert _deltas(sqlite_db, user_id) == [('', 0), ('', 30)]
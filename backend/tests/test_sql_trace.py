@@ -0,0 +1,40 @@
+import time
+
+import storage
+import sql_trace
+
+STATEMENT = 'SELECT nap(value) FROM numbers'
+
+
+def _numbers(tmp_path):
+    conn = storage._connect_sqlite(str(tmp_path / 'trace.db'))
+    conn.create_function('nap', 1, lambda value: time.sleep(0.002) or value)
+    conn.execute('CREATE TABLE numbers (value INTEGER)')
+    conn.executemany('INSERT INTO numbers VALUES (?)', [(i,) for i in range(40)])
+    return conn
+
+
+def _recorded_ms():
+    return sum(e['total_ms'] for e in sql_trace.stats(top=1000)['statements'] if e['statement'] == STATEMENT)
+
+
+def test_iteration_left_early_is_still_recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(sql_trace, 'SLOW_MS', 10 ** 6)
+    sql_trace.reset()
+    conn = _numbers(tmp_path)
+    for row in conn.execute(STATEMENT):
+        if row[0] == 20:
+            break   # The cursor is never exhausted nor closed
+    # 21 rows of 2 ms each: all but the last few ms reach the stats
+    assert _recorded_ms() >= 40 - storage.ITERATION_FLUSH_MS
+    conn.close()
+
+
+def test_full_iteration_is_recorded_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(sql_trace, 'SLOW_MS', 10 ** 6)
+    sql_trace.reset()
+    conn = _numbers(tmp_path)
+    assert len(list(conn.execute(STATEMENT))) == 40
+    entry = [e for e in sql_trace.stats(top=1000)['statements'] if e['statement'] == STATEMENT]
+    assert entry[0]['count'] == 1 and entry[0]['total_ms'] >= 80
+    conn.close()
@@ -0,0 +1,44 @@
+import storage
+
+
+def test_pg_placeholders_outside_quotes_only():
+    statement = "SELECT '?', ?, 'it''s ?', \"odd?name\" FROM t WHERE x LIKE 'a%' AND y = ?"
+    assert storage._pg_statement(statement) == \
+        "SELECT '?', %s, 'it''s ?', \"odd?name\" FROM t WHERE x LIKE 'a%%' AND y = %s"
+
+
+def test_pg_placeholders_in_dialect_expressions():
+    # The expressions sql() hands out keep their placeholder
+    assert storage._pg_statement(storage._SQL['postgresql']['days_ago']) == \
+        "(NOW() AT TIME ZONE 'UTC') - %s * INTERVAL '1 day'"
+
+
+def test_shard_rows_are_numbered_from_their_offset(sharded_db):
+    backend = sharded_db.get_storage()
+    users = [sharded_db.create_user(f'user{i}', f'user{i}@example.com', 'password123', 'U') for i in range(6)]
+    reading_ids = {}
+    for user_id in users:
+        reading_ids[user_id] = [sharded_db.save_meter_reading(user_id, v, False, 'tip') for v in (10, 20)]
+
+    for user_id, ids in reading_ids.items():
+        shard = backend.shard_of(user_id)
+        assert all(shard * storage.SHARD_ID_SPAN < i < (shard + 1) * storage.SHARD_ID_SPAN for i in ids)
+    all_ids = [i for ids in reading_ids.values() for i in ids]
+    assert len(set(all_ids)) == len(all_ids)
+
+
+def test_shard_offsets_survive_init_db_again(sharded_db):
+    user_id = sharded_db.create_user('hal', 'hal@example.com', 'password123', 'Hal')
+    first = sharded_db.save_meter_reading(user_id, 10, False, 'tip')
+    sharded_db.init_db()
+    assert sharded_db.save_meter_reading(user_id, 20, False, 'tip') == first + 1
+
+
+def test_users_stay_in_main_database(sharded_db):
+    user_id = sharded_db.create_user('ivy', 'ivy@example.com', 'password123', 'Ivy')
+    conn = sharded_db.get_db()
+    assert conn.execute('SELECT COUNT(*) FROM users WHERE id = ?', (user_id,)).fetchone()[0] == 1
+    conn.close()
+    for _, shard in sharded_db.shard_connections():
+        assert shard.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0
+        shard.close()
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import usage_analytics
+
+
+def _evening_readings(days=6):
+    """One reading every 30 min from 19:00 to 23:30 UTC, 10 L/h throughout"""
+    rows, value, reading_id = [], 0, 0
+    for day in range(days):
+        start = datetime(2026, 3, 1 + day, 19, 0)
+        for step in range(10):
+            reading_id += 1
+            value += 5
+            rows.append({'id': reading_id, 'user_id': 1, 'meter_id': 'M1', 'reading_value': value,
+                         'timestamp': start + timedelta(minutes=30 * step)})
+    return rows
+
+
+def _streamed(rows):
+    state = usage_analytics.MeterState()
+    return [state.update(r['reading_value'], r['timestamp'], r['id'])['is_leak'] for r in rows]
+
+
+def test_night_hours_are_site_local(monkeypatch):
+    rows = _evening_readings()
+    # 19:00-23:30 UTC is evening in UTC...
+    monkeypatch.setattr(usage_analytics, 'SITE_TIMEZONE', 'UTC')
+    assert not any(_streamed(rows))
+    assert not usage_analytics.compute_scores(pd.DataFrame(rows))['is_leak'].any()
+
+    # ...and 00:30-05:00 at a site in India
+    monkeypatch.setattr(usage_analytics, 'SITE_TIMEZONE', 'Asia/Kolkata')
+    streamed = _streamed(rows)
+    scored = usage_analytics.compute_scores(pd.DataFrame(rows)).sort_values('id')
+    assert sum(streamed) == 1
+    assert streamed == scored['is_leak'].tolist()
@@ -4,12 +4,21 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report
 import joblib
+import json
 import numpy as np
+from datetime import datetime
 from quality_model import extract_features
 
 # --- CONFIGURATION ---
 DATASET_PATH = "../dataset" 
 MODEL_PATH = "../models/rf_model.pkl"
+MODEL_META_PATH = "../models/rf_model.meta.json"
+FEATURE_CACHE_PATH = "../models/dataset_features.csv"
+
+FEATURE_NAMES = ['Hue', 'Saturation', 'Value', 'Texture']
+INCREMENT_TREES = 20     # Trees added per incremental update
+MAX_TREES = 300          # Oldest trees are dropped beyond this (bounds inference cost)
+REPLAY_SAMPLES = 500     # Previously seen rows mixed into each incremental update
 
 def train():
     print("🚀 Starting AI Training...")
@@ -123,10 +132,196 @@ def train():
         prob = model.predict_proba([features])[0]
         print(f"   Dirty sample: Predicted={['SAFE','UNSAFE'][pred]} (confidence: {max(prob)*100:.1f}%)")
 
-    # 7. Save the Model
-    joblib.dump(model, MODEL_PATH)
+    # 7. Save the Model (no confirmed labels folded in yet)
+    save_model(model, {'feedback_high_water': 0, 'mode': 'images'})
     print(f"\n   💾 Model saved successfully to: {MODEL_PATH}")
     print("   ✅ Training Complete!")
 
+# ============================================
+# TRAINING FROM STORED FEATURES (no image decoding)
+# ============================================
+
+def load_dataset_features():
+    """
+    Features of the labelled dataset/ images, cached in FEATURE_CACHE_PATH.
+    Only new or modified images are decoded.
+    """
+    cached = {}
+    if os.path.exists(FEATURE_CACHE_PATH):
+        for row in pd.read_csv(FEATURE_CACHE_PATH).to_dict('records'):
+            cached[row['path']] = row
+
+    rows = []
+    changed = False
+    for folder, label in (("Clean", 0), ("Dirty", 1)):
+        folder_path = os.path.join(DATASET_PATH, folder)
+        if not os.path.exists(folder_path):
+            continue
+        for filename in sorted(os.listdir(folder_path)):
+            if not filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+                continue
+            filepath = os.path.join(folder_path, filename)
+            mtime = os.path.getmtime(filepath)
+            row = cached.get(filepath)
+            if row is None or row['mtime'] != mtime:
+                features = extract_features(filepath)
+                if not features:
+                    continue
+                row = dict(zip(FEATURE_NAMES, features), path=filepath, mtime=mtime, label=label)
+                changed = True
+            rows.append(row)
+
+    df = pd.DataFrame(rows, columns=['path', 'mtime'] + FEATURE_NAMES + ['label'])
+    if changed or len(df) != len(cached):
+        df.to_csv(FEATURE_CACHE_PATH, index=False)
+    return df[FEATURE_NAMES + ['label']]
+
+
+def load_feedback_features(after_id=0):
+    """
+    Stored features of readings with a user-confirmed label (newer than after_id).
+    after_id is a feedback_high_water() value: one id, or {shard: id} when sharded.
+    """
+    from database import init_db, shard_connections
+
+    init_db()  # Older databases predate the quality_feedback table
+    columns = ['feedback_id', 'shard'] + FEATURE_NAMES + ['label']
+    rows = []
+    for shard, conn in shard_connections(readonly=True):
+        since = after_id.get(shard, 0) if isinstance(after_id, dict) else after_id
+        rows += [tuple(row) for row in conn.execute('''
+            SELECT f.id AS feedback_id, ? AS shard, q.mean_hue AS Hue, q.mean_saturation AS Saturation,
+                   q.mean_value AS Value, q.texture_score AS Texture, f.label
+            FROM quality_feedback f
+            JOIN quality_readings q ON q.id = f.reading_id
+            WHERE f.id > ? AND q.mean_hue IS NOT NULL
+            ORDER BY f.id
+        ''', (shard, since))]
+        conn.close()
+    return pd.DataFrame(rows, columns=columns)
+
+
+def feedback_high_water(feedback, previous=0):
+    """
+    Newest feedback id covered by a model, for the next incremental run.
+    Ids only grow within one database, so with several shards one is kept per shard.
+    """
+    from database import get_storage
+
+    if len(get_storage().shards()) == 1:
+        return int(feedback['feedback_id'].max()) if len(feedback) else previous
+    marks = dict(previous) if isinstance(previous, dict) else {}
+    marks.update({shard: int(ids.max()) for shard, ids in feedback.groupby('shard')['feedback_id']})
+    return marks
+
+
+def load_meta():
+    if os.path.exists(MODEL_META_PATH):
+        with open(MODEL_META_PATH) as f:
+            return json.load(f)
+    return {'feedback_high_water': 0}
+
+
+def save_model(model, meta):
+    """Write model + metadata atomically so a running server never loads a partial file"""
+    meta['trained_at'] = datetime.now().isoformat(timespec='seconds')
+    meta['n_estimators'] = len(getattr(model, 'estimators_', []))
+    tmp_path = MODEL_PATH + ".tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, MODEL_PATH)
+    with open(MODEL_META_PATH, 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def train_from_features():
+    """Full rebuild from cached dataset features plus all confirmed labels"""
+    print("🚀 Rebuilding model from stored features...")
+    dataset = load_dataset_features()
+    feedback = load_feedback_features()
+    print(f"   📊 Dataset rows: {len(dataset)}, Confirmed labels: {len(feedback)}")
+
+    df = pd.concat([dataset, feedback[FEATURE_NAMES + ['label']]], ignore_index=True)
+    if len(df) < 10 or df['label'].nunique() < 2:
+        print("❌ Not enough labelled rows (need at least 10 covering both classes).")
+        return None
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        df[FEATURE_NAMES], df['label'], test_size=0.2, random_state=42, stratify=df['label']
+    )
+    model = RandomForestClassifier(
+        n_estimators=200,
+        max_depth=10,
+        min_samples_split=5,
+        min_samples_leaf=2,
+        random_state=42,
+        class_weight='balanced'
+    )
+    model.fit(X_train, y_train)
+    print(f"   ✅ Test Set Accuracy: {accuracy_score(y_test, model.predict(X_test)) * 100:.2f}%")
+
+    save_model(model, {'feedback_high_water': feedback_high_water(feedback), 'mode': 'full'})
+    print(f"   💾 Model saved to: {MODEL_PATH}")
+    return model
+
+
+def train_incremental():
+    """
+    Fold labels confirmed since the last training run into the existing forest:
+    INCREMENT_TREES new trees are grown (warm start) on the new rows plus a
+    replay sample of earlier rows, and the oldest trees beyond MAX_TREES are dropped.
+    """
+    if not os.path.exists(MODEL_PATH):
+        print("ℹ️ No existing model, running a full rebuild instead.")
+        return train_from_features()
+
+    meta = load_meta()
+    new_rows = load_feedback_features(meta.get('feedback_high_water', 0))
+    if new_rows.empty:
+        print("✅ No new confirmed labels. Model is up to date.")
+        return None
+    print(f"🔁 Folding {len(new_rows)} new labels into the model...")
+
+    feedback = load_feedback_features()
+    old_rows = pd.concat([
+        load_dataset_features(),
+        feedback.loc[~feedback['feedback_id'].isin(new_rows['feedback_id']), FEATURE_NAMES + ['label']]
+    ], ignore_index=True)
+    replay = old_rows.sample(min(REPLAY_SAMPLES, len(old_rows)), random_state=42) if len(old_rows) else old_rows
+    df = pd.concat([new_rows[FEATURE_NAMES + ['label']], replay], ignore_index=True)
+    if df['label'].nunique() < 2:
+        print("❌ Incremental update needs rows of both classes; run a full rebuild.")
+        return None
+
+    model = joblib.load(MODEL_PATH)
+    if not isinstance(model, RandomForestClassifier):
+        print("❌ The live model is not a random forest (see model_search.py); run a full rebuild.")
+        return None
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + INCREMENT_TREES)
+    model.fit(df[FEATURE_NAMES], df['label'])
+    if len(model.estimators_) > MAX_TREES:
+        model.estimators_ = model.estimators_[-MAX_TREES:]
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+
+    meta.update({'feedback_high_water': feedback_high_water(new_rows, meta.get('feedback_high_water', 0)),
+                 'mode': 'incremental'})
+    save_model(model, meta)
+    print(f"   💾 Model updated ({len(model.estimators_)} trees)")
+    return model
+
+
 if __name__ == "__main__":
-    train()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the water quality classifier")
+    parser.add_argument('--from-features', action='store_true',
+                        help="Full rebuild from cached features and confirmed labels (no image decoding)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Add trees for labels confirmed since the last run")
+    args = parser.parse_args()
+
+    if args.incremental:
+        train_incremental()
+    elif args.from_features:
+        train_from_features()
+    else:
+        train()
@@ -0,0 +1,360 @@
+import os
+import math
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from database import get_db, shard_connections, save_alert
+from http_cache import bump_version, bump_all
+from area_stats import METER_MATCH
+
+# Meter readings are cumulative register values (litres), so usage is the
+# difference between two consecutive readings of the same meter divided by
+# the hours between them (L/h).
+
+# 🔧 CONFIGURATION
+RATE_WINDOW = 30          # Number of previous usage rates in the rolling baseline
+MIN_HISTORY = 5           # Rates needed before a z-score is trusted
+SPIKE_ZSCORE = 3.0        # z-score above which a rate counts as a spike
+NIGHT_HOURS = range(0, 5) # Hours (site local time, see SITE_TIMEZONE) where flow should be ~zero
+# Timestamps are stored in UTC; night hours are taken in this IANA zone (e.g. 'Asia/Kolkata')
+SITE_TIMEZONE = os.environ.get('AQUAGUARD_TIMEZONE', 'UTC')
+NIGHT_WINDOW = 7          # Night-time rates averaged into the baseline flow
+NIGHT_MIN_SAMPLES = 3     # Night-time rates needed before flagging leaks
+LEAK_RATE_LPH = 5.0       # Night baseline flow (L/h) that suggests a leak
+
+SPIKE_ALERT = 'USAGE_SPIKE'
+LEAK_ALERT = 'POSSIBLE_LEAK'
+
+# (user_id, meter_id) -> MeterState. Other workers save readings too, so a
+# cached state is only used while it has seen the meter's latest reading.
+_states = {}
+_states_lock = threading.Lock()
+
+
+class MeterState:
+    """
+    Rolling statistics for one meter, updated in O(1) per reading.
+    Running sums over fixed-size windows give exactly the same numbers
+    as the pandas rolling windows used by backfill().
+    """
+    __slots__ = ('last_id', 'last_value', 'last_time', 'rates', 'rate_sum', 'rate_sq_sum',
+                 'night_rates', 'night_sum', 'leak_active', 'lock')
+
+    def __init__(self):
+        self.last_id = None
+        self.last_value = None
+        self.last_time = None
+        self.rates = deque()
+        self.rate_sum = 0.0
+        self.rate_sq_sum = 0.0
+        self.night_rates = deque()
+        self.night_sum = 0.0
+        self.leak_active = False
+        self.lock = threading.Lock()
+
+    def update(self, value, timestamp, reading_id=None):
+        """Fold one reading into the state and return its score"""
+        result = {'rate': None, 'zscore': None, 'night_baseline': None,
+                  'is_spike': False, 'is_leak': False}
+
+        rate = None
+        if self.last_value is not None:
+            hours = (timestamp - self.last_time).total_seconds() / 3600.0
+            delta = value - self.last_value
+            # Negative deltas are meter resets or misreads, not usage
+            if hours > 0 and delta >= 0:
+                rate = delta / hours
+        self.last_id = reading_id
+        self.last_value = value
+        self.last_time = timestamp
+
+        if rate is None:
+            return result
+        result['rate'] = rate
+
+        # Z-score against the previous window only
+        n = len(self.rates)
+        if n >= MIN_HISTORY:
+            mean = self.rate_sum / n
+            std = math.sqrt(max(self.rate_sq_sum / n - mean * mean, 0.0))
+            if std > 1e-9:
+                z = (rate - mean) / std
+                result['zscore'] = z
+                result['is_spike'] = z > SPIKE_ZSCORE
+
+        self.rates.append(rate)
+        self.rate_sum += rate
+        self.rate_sq_sum += rate * rate
+        if len(self.rates) > RATE_WINDOW:
+            old = self.rates.popleft()
+            self.rate_sum -= old
+            self.rate_sq_sum -= old * old
+
+        if _local_hour(timestamp) in NIGHT_HOURS:
+            self.night_rates.append(rate)
+            self.night_sum += rate
+            if len(self.night_rates) > NIGHT_WINDOW:
+                self.night_sum -= self.night_rates.popleft()
+
+            if len(self.night_rates) >= NIGHT_MIN_SAMPLES:
+                baseline = self.night_sum / len(self.night_rates)
+                result['night_baseline'] = baseline
+                leaking = baseline > LEAK_RATE_LPH
+                # Only alert on the transition into the leaking state
+                result['is_leak'] = leaking and not self.leak_active
+                self.leak_active = leaking
+
+        return result
+
+
+def _site_zone():
+    if SITE_TIMEZONE.upper() == 'UTC':
+        return timezone.utc   # No tz database needed (Windows has none without tzdata)
+    from zoneinfo import ZoneInfo
+    return ZoneInfo(SITE_TIMEZONE)
+
+
+def _local_hour(timestamp):
+    """Hour of day at the site for a naive UTC timestamp"""
+    return timestamp.replace(tzinfo=timezone.utc).astimezone(_site_zone()).hour
+
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S')
+
+
+def _utc_now():
+    # Matches the CURRENT_TIMESTAMP default used by the readings tables
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _load_state(user_id, meter_id, before_id):
+    """Rebuild a meter's state from its stored history"""
+    state = MeterState()
+    conn = get_db(user_id)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT id, reading_value, timestamp FROM meter_readings
+        WHERE user_id = ? AND {METER_MATCH} AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (user_id, meter_id, meter_id, before_id, RATE_WINDOW * 10))
+    rows = cursor.fetchall()
+    conn.close()
+
+    for row in reversed(rows):
+        state.update(row['reading_value'], _parse_timestamp(row['timestamp']), row['id'])
+    return state
+
+
+def _latest_id(user_id, meter_id, before_id):
+    """Id of the meter's newest stored reading before before_id (None if there is none)"""
+    conn = get_db(user_id, readonly=True)
+    try:
+        row = conn.execute(f'''
+            SELECT MAX(id) AS latest FROM meter_readings
+            WHERE user_id = ? AND {METER_MATCH} AND id < ?
+        ''', (user_id, meter_id, meter_id, before_id)).fetchone()
+    finally:
+        conn.close()
+    return row['latest'] if row else None
+
+
+def get_state(user_id, meter_id, before_id):
+    """
+    State of a meter as of the reading before before_id. A cached state is
+    reloaded when another process has saved (or deleted) readings of the
+    meter since it was built.
+    """
+    key = (user_id, meter_id or '')
+    latest = _latest_id(user_id, key[1], before_id)
+    state = _states.get(key)
+    if state is None or state.last_id != latest:
+        with _states_lock:
+            state = _states.get(key)
+            if state is None or state.last_id != latest:
+                state = _load_state(user_id, key[1], before_id)
+                _states[key] = state
+    return state
+
+
+def reset_state(user_id=None):
+    """Drop cached meter states (all, or one user's) so they reload from the DB"""
+    with _states_lock:
+        if user_id is None:
+            _states.clear()
+        else:
+            for key in [k for k in _states if k[0] == user_id]:
+                del _states[key]
+
+
+def _spike_message(rate, zscore):
+    return f'Unusual spike in water usage: {rate:.0f} L/h ({zscore:.1f}x normal variation)'
+
+
+def _leak_message(baseline):
+    return f'Possible leak: night-time flow of {baseline:.1f} L/h detected'
+
+
+def score_reading(user_id, meter_id, reading_value, reading_id, timestamp=None):
+    """
+    Score a freshly saved meter reading and raise alerts for spikes/leaks.
+    Designed to run inline on every /api/read_meter request.
+    """
+    state = get_state(user_id, meter_id, reading_id)
+    with state.lock:
+        result = state.update(reading_value, timestamp or _utc_now(), reading_id)
+
+    if result['is_spike']:
+        save_alert(user_id, SPIKE_ALERT, _spike_message(result['rate'], result['zscore']),
+                   'MEDIUM', reading_id)
+    if result['is_leak']:
+        save_alert(user_id, LEAK_ALERT, _leak_message(result['night_baseline']),
+                   'HIGH', reading_id)
+    return result
+
+
+def compute_scores(df):
+    """
+    Vectorized scoring over a DataFrame of meter readings with columns
+    id, user_id, meter_id, reading_value, timestamp.
+    Returns the frame with rate, zscore, night_baseline, is_spike, is_leak.
+    """
+    import numpy as np
+    import pandas as pd
+
+    df = df.copy()
+    df['meter_id'] = df['meter_id'].fillna('')
+    df['timestamp'] = pd.to_datetime(df['timestamp'].astype(str).str.slice(0, 19))
+    df = df.sort_values(['user_id', 'meter_id', 'id']).reset_index(drop=True)
+    keys = ['user_id', 'meter_id']
+    grouped = df.groupby(keys, sort=False)
+
+    hours = grouped['timestamp'].diff().dt.total_seconds() / 3600.0
+    delta = grouped['reading_value'].diff()
+    valid = (hours > 0) & (delta >= 0)
+    df['rate'] = np.where(valid, delta / hours.where(hours > 0), np.nan)
+
+    df['zscore'] = np.nan
+    df['night_baseline'] = np.nan
+    df['is_spike'] = False
+    df['is_leak'] = False
+
+    rated = df[df['rate'].notna()]
+    if rated.empty:
+        return df
+
+    # Baseline of the previous RATE_WINDOW rates (population std like MeterState)
+    rolling = rated.groupby(keys, sort=False)['rate']
+    prev_mean = rolling.transform(
+        lambda s: s.rolling(RATE_WINDOW, min_periods=MIN_HISTORY).mean().shift(1))
+    prev_std = rolling.transform(
+        lambda s: s.rolling(RATE_WINDOW, min_periods=MIN_HISTORY).std(ddof=0).shift(1))
+    zscore = (rated['rate'] - prev_mean) / prev_std.where(prev_std > 1e-9)
+    df.loc[rated.index, 'zscore'] = zscore
+    df.loc[rated.index, 'is_spike'] = (zscore > SPIKE_ZSCORE).to_numpy()
+
+    local_hour = rated['timestamp'].dt.tz_localize('UTC').dt.tz_convert(_site_zone()).dt.hour
+    night = rated[local_hour.isin(list(NIGHT_HOURS))]
+    if not night.empty:
+        baseline = night.groupby(keys, sort=False)['rate'].transform(
+            lambda s: s.rolling(NIGHT_WINDOW, min_periods=NIGHT_MIN_SAMPLES).mean())
+        leaking = baseline > LEAK_RATE_LPH
+        was_leaking = leaking.groupby([night['user_id'], night['meter_id']], sort=False) \
+            .shift(1, fill_value=False).astype(bool)
+        df.loc[night.index, 'night_baseline'] = baseline
+        df.loc[night.index, 'is_leak'] = (leaking & ~was_leaking).to_numpy()
+
+    return df
+
+
+def backfill(user_id=None, write_alerts=True):
+    """
+    Batch-score historical meter readings (all users, or one user).
+    Previously generated analytics alerts in that scope are replaced so the
+    backfill can be re-run safely.
+    """
+    import pandas as pd
+
+    if user_id is None:
+        connections = [conn for _, conn in shard_connections()]
+    else:
+        connections = [get_db(user_id)]
+
+    # A user's readings never span shards, so each shard is scored on its own
+    scored = []
+    for conn in connections:
+        try:
+            scored.append(_backfill_shard(conn, user_id, write_alerts))
+        finally:
+            conn.close()
+
+    reset_state(user_id)
+    return scored[0] if len(scored) == 1 else pd.concat(scored, ignore_index=True)
+
+
+def _backfill_shard(conn, user_id, write_alerts):
+    import pandas as pd
+
+    columns = ['id', 'user_id', 'meter_id', 'reading_value', 'timestamp']
+    query = f"SELECT {', '.join(columns)} FROM meter_readings"
+    params = ()
+    if user_id is not None:
+        query += ' WHERE user_id = ?'
+        params = (user_id,)
+    df = pd.DataFrame([tuple(row) for row in conn.execute(query, params)], columns=columns)
+
+    if df.empty:
+        return df
+
+    scored = compute_scores(df)
+
+    if write_alerts:
+        rows = []
+        for r in scored[scored['is_spike']].itertuples():
+            rows.append((int(r.user_id), SPIKE_ALERT, _spike_message(r.rate, r.zscore), 'MEDIUM',
+                         str(r.timestamp), 1, int(r.id), int(r.id)))
+        for r in scored[scored['is_leak']].itertuples():
+            rows.append((int(r.user_id), LEAK_ALERT, _leak_message(r.night_baseline), 'HIGH',
+                         str(r.timestamp), 1, int(r.id), int(r.id)))
+
+        cursor = conn.cursor()
+        if user_id is None:
+            cursor.execute('DELETE FROM alerts WHERE alert_type IN (?, ?)',
+                           (SPIKE_ALERT, LEAK_ALERT))
+        else:
+            cursor.execute('DELETE FROM alerts WHERE alert_type IN (?, ?) AND user_id = ?',
+                           (SPIKE_ALERT, LEAK_ALERT, user_id))
+        # Historical findings are recorded as already read so they don't flood the dashboard
+        cursor.executemany('''
+            INSERT INTO alerts (user_id, alert_type, alert_message, severity, timestamp,
+                                is_read, related_reading_id, meter_reading_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+        if user_id is None:
+            bump_all()
+        else:
+            bump_version(user_id)
+
+    return scored
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Backfill meter usage anomaly alerts")
+    parser.add_argument('--user-id', type=int, default=None, help="Only backfill one user")
+    parser.add_argument('--dry-run', action='store_true', help="Score without writing alerts")
+    args = parser.parse_args()
+
+    print("🔎 Scoring historical meter readings...")
+    scored = backfill(args.user_id, write_alerts=not args.dry_run)
+    print(f"   📊 Readings scored: {len(scored)}")
+    if len(scored):
+        print(f"   ⚡ Spikes: {int(scored['is_spike'].sum())}")
+        print(f"   💧 Possible leaks: {int(scored['is_leak'].sum())}")
+    print("✅ Backfill complete!")
@@ -9,6 +9,9 @@ import sys
 import subprocess
 import platform
 import socket
+import argparse
+import importlib.util
+import runpy
 
 def print_header():
     """Print the startup header"""
@@ -42,10 +45,10 @@ def check_dependencies():
     """Check and install dependencies if needed"""
     print("📦 Checking dependencies...")
     
-    try:
-        import flask
+    # find_spec only locates the package; importing it here would slow start-up
+    if importlib.util.find_spec("flask") is not None:
         print("✅ Dependencies are installed")
-    except ImportError:
+    else:
         print("⚠️  Dependencies not found. Installing...")
         print()
         subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
@@ -59,8 +62,10 @@ def initialize_database():
     
     if not os.path.exists(db_path):
         print("🗄️  Initializing database...")
+        # Run in-process instead of spawning another interpreter
         os.chdir("backend")
-        subprocess.run([sys.executable, "database.py"])
+        sys.path.insert(0, os.getcwd())
+        runpy.run_path("database.py", run_name="__main__")
         os.chdir("..")
         print()
     else:
@@ -88,10 +93,24 @@ def create_directories():
         print("📁 Created uploads directory")
         print()
 
-def start_server():
+def parse_args():
+    """Parse startup options"""
+    parser = argparse.ArgumentParser(description="Start AquaGuard AI")
+    parser.add_argument('--production', action='store_true',
+                        help="Serve with a multi-process WSGI server instead of the Flask debug server")
+    parser.add_argument('--workers', type=int, help="Worker processes (production mode)")
+    parser.add_argument('--threads', type=int, help="Threads per worker (production mode)")
+    parser.add_argument('--worker-class', help="gunicorn worker class: gevent (default), gthread or sync")
+    parser.add_argument('--timeout', type=int, help="Request timeout in seconds (production mode)")
+    parser.add_argument('--max-requests', type=int, help="Recycle workers after N requests (production mode)")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Report worker start-up time and per-module import cost, then exit")
+    return parser.parse_args()
+
+def start_server(args):
     """Start the Flask server"""
     print("=" * 70)
-    print("🚀 Starting AquaGuard AI Server...")
+    print(f"🚀 Starting AquaGuard AI Server ({'production' if args.production else 'development'} mode)...")
     print("=" * 70)
     print()
     
@@ -109,12 +128,23 @@ def start_server():
     print("=" * 70)
     print()
     
-    # Start Flask app
     os.chdir("backend")
-    subprocess.run([sys.executable, "app_enhanced.py"])
+    if args.production:
+        # Production WSGI server (see backend/serve.py)
+        command = [sys.executable, "serve.py", "--bind", "0.0.0.0:9000"]
+        for option in ('workers', 'threads', 'worker_class', 'timeout', 'max_requests'):
+            value = getattr(args, option)
+            if value is not None:
+                command += [f"--{option.replace('_', '-')}", str(value)]
+        subprocess.run(command)
+    else:
+        # Start Flask development server
+        subprocess.run([sys.executable, "app_enhanced.py"])
 
 def main():
     """Main startup routine"""
+    args = parse_args()
+    
     # Get project root directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(script_dir)
@@ -126,12 +156,17 @@ def main():
     
     check_python_version()
     check_dependencies()
+    
+    if args.profile_startup:
+        subprocess.run([sys.executable, os.path.join("backend", "startup_profile.py"), "--warmup"])
+        return
+    
     initialize_database()
     train_model()
     create_directories()
     
     try:
-        start_server()
+        start_server(args)
     except KeyboardInterrupt:
         print("\n")
         print("=" * 70)